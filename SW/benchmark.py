@@ -0,0 +1,183 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import torch
+
+from networks.efgcn import EFGCN
+from networks.layers.graph_gen import GraphGen
+from data.synthetic import PROFILES, synthetic_events, normalise_events, synthetic_sample
+
+'''Benchmarks of the graph generation, the layers and the whole EFGCN on seeded synthetic samples.'''
+'''Every benchmark is timed on the same synthetic sample for every dataset, dimension and scale of the
+number of events, so the results of two runs can be compared with --baseline to catch regressions.'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark GraphGen, the layers and EFGCN on synthetic event samples')
+    parser.add_argument('--datasets', type=str, nargs='+', default=['ncars', 'mnistdvs', 'cifar10'], help='Statistics of the synthetic samples')
+    parser.add_argument('--dims', type=int, nargs='+', default=[128, 256], help='Normalised dimensions')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.25, 1, 4], help='Number of events as a multiple of the mean of the dataset')
+    parser.add_argument('--radius', type=int, default=3, help='Radius of the graph')
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=None, help='Run only these benchmarks (default all)')
+    parser.add_argument('--repeats', type=int, default=10, help='Number of timed runs')
+    parser.add_argument('--warmup', type=int, default=2, help='Number of runs before timing')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic samples and of the model weights')
+    parser.add_argument('--device', type=str, default='cpu', help='Device of the layers and the model')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to a JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare the results with a JSON file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown of the median reported as a regression')
+    return parser.parse_args()
+
+def timeit(function, repeats, warmup, device):
+    '''Times of repeated calls of function in seconds.'''
+    synchronize = torch.cuda.synchronize if torch.device(device).type == 'cuda' else (lambda: None)
+    with torch.no_grad():
+        for _ in range(warmup):
+            function()
+        times = []
+        for _ in range(repeats):
+            synchronize()
+            start = time.perf_counter()
+            function()
+            synchronize()
+            times.append(time.perf_counter() - start)
+    return np.array(times)
+
+def frozen_model(dim, num_outputs, samples, seed, device):
+    '''EFGCN with seeded random weights, calibrated on the samples and frozen.'''
+    torch.manual_seed(seed)
+    model = EFGCN(input_dimension=(dim, dim, dim), num_outputs=num_outputs, num_bits=8, bias=True).to(device)
+    model.eval()
+    with torch.no_grad():
+        for nodes, features, edges in samples:
+            model.calibration(nodes, features, edges)
+    model.freeze()
+    return model
+
+def stage_inputs(model, nodes, features, edges, quantized):
+    '''Inputs of the layers of EFGCN for a single graph (float or quantized pass).'''
+    def conv(layer, *args, **kwargs):
+        return layer.q_forward(*args, **kwargs) if quantized else layer(*args)
+
+    def relu(layer, features):
+        return layer.q_forward(features) if quantized else layer(features)
+
+    inputs = {'conv1': (nodes, features, edges)}
+    with torch.no_grad():
+        features = relu(model.relu1, conv(model.conv1, nodes, features, edges, first_layer=True))
+        inputs['max_pool1'] = (nodes, features, edges)
+        nodes, features, edges = model.max_pool1(nodes, features, edges)
+
+        inputs['conv2'] = (nodes, features, edges)
+        features = relu(model.relu2, conv(model.conv2, nodes, features, edges))
+        features = relu(model.relu3, conv(model.conv3, nodes, features, edges))
+        inputs['max_pool2'] = (nodes, features, edges)
+        nodes, features, edges = model.max_pool2(nodes, features, edges)
+
+        inputs['conv4'] = (nodes, features, edges)
+        features = relu(model.relu4, conv(model.conv4, nodes, features, edges))
+        features = relu(model.relu5, conv(model.conv5, nodes, features, edges))
+        inputs['out'] = (nodes, features)
+    return inputs
+
+def benchmarks(model, dataset, dim, radius, seed, num_events, device):
+    '''Benchmarked functions and the sizes of their input graphs.'''
+    '''The layers run on the synthetic sample with num_events events as it is stored by the datasets.'''
+    raw_events = synthetic_events(dataset, seed, num_events)
+    events = normalise_events(dataset, raw_events, dim)
+    sample = synthetic_sample(dataset, dim, radius, seed, num_events)
+    nodes, features, edges = sample['nodes'].to(device), sample['features'].to(device), sample['edges'].to(device)
+    float_inputs = stage_inputs(model, nodes, features, edges, quantized=False)
+    q_inputs = stage_inputs(model, nodes, features, edges, quantized=True)
+
+    def size(inputs):
+        return {'nodes': int(inputs[0].size(0)), 'edges': int(inputs[2].size(0)) if len(inputs) > 2 else None}
+
+    def conv(name):
+        layer, first_layer = getattr(model, name), name == 'conv1'
+        return {name + '.forward': (lambda: layer(*float_inputs[name]), size(float_inputs[name])),
+                name + '.q_forward': (lambda: layer.q_forward(*q_inputs[name], first_layer=first_layer), size(q_inputs[name]))}
+
+    # Cases in the order of the pipeline
+    cases = {
+        'normalise': (lambda: normalise_events(dataset, raw_events, dim), {'nodes': len(raw_events['t']), 'edges': None}),
+        'graph_gen': (lambda: GraphGen(r=radius, dimension_XY=(dim, dim), self_loop=True).build(events), {'nodes': len(events), 'edges': None}),
+        'graph_gen_hw': (lambda: GraphGen(r=radius, dimension_XY=(dim, dim), self_loop=True, hw_context=True).build(events), {'nodes': len(events), 'edges': None}),
+        **conv('conv1'),
+        'max_pool1': (lambda: model.max_pool1(*float_inputs['max_pool1']), size(float_inputs['max_pool1'])),
+        **conv('conv2'),
+        'max_pool2': (lambda: model.max_pool2(*float_inputs['max_pool2']), size(float_inputs['max_pool2'])),
+        **conv('conv4'),
+        'out.forward': (lambda: model.out(*float_inputs['out']), size(float_inputs['out'])),
+        'out.q_forward': (lambda: model.out.q_forward(*q_inputs['out']), size(q_inputs['out'])),
+        'efgcn.forward': (lambda: model(nodes, features, edges), size(float_inputs['conv1'])),
+        'efgcn.q_forward': (lambda: model.q_forward(nodes, features, edges), size(q_inputs['conv1'])),
+    }
+    return cases
+
+def compare(results, baseline, tolerance):
+    '''Print the benchmarks slower than the baseline by more than tolerance, returns their number.'''
+    def key(result):
+        return result['benchmark'], result['dataset'], result['dim'], result['scale']
+    reference = {key(result): result for result in baseline['results']}
+
+    regressions, compared = 0, 0
+    for result in results:
+        base = reference.get(key(result))
+        if base is None:
+            continue
+        if (base['nodes'], base['edges']) != (result['nodes'], result['edges']):
+            print(f"{'/'.join(map(str, key(result)))}: input graph differs from the baseline, not compared")
+            continue
+        compared += 1
+        ratio = result['median_ms'] / base['median_ms']
+        if ratio > 1 + tolerance:
+            regressions += 1
+            print(f"REGRESSION {'/'.join(map(str, key(result)))}: {base['median_ms']:.3f} ms -> {result['median_ms']:.3f} ms (x{ratio:.2f})")
+    print(f"{regressions} regressions in {compared} benchmarks compared with the baseline (tolerance {tolerance:.0%})")
+    return regressions
+
+def main(args):
+    results = []
+    for dataset in args.datasets:
+        if dataset not in PROFILES:
+            raise ValueError('Dataset not supported')
+        for dim in args.dims:
+            # Frozen model calibrated on samples with the mean number of events
+            samples = [synthetic_sample(dataset, dim, args.radius, args.seed + index) for index in range(2)]
+            samples = [tuple(sample[key].to(args.device) for key in ('nodes', 'features', 'edges')) for sample in samples]
+            model = frozen_model(dim, 2 if dataset == 'ncars' else 10, samples, args.seed, args.device)
+
+            for scale in args.scales:
+                num_events = int(PROFILES[dataset]['num_events'] * scale)
+                for name, (function, size) in benchmarks(model, dataset, dim, args.radius, args.seed, num_events, args.device).items():
+                    if args.benchmarks is not None and name not in args.benchmarks:
+                        continue
+                    times = timeit(function, args.repeats, args.warmup, args.device) * 1000
+                    results.append({'benchmark': name, 'dataset': dataset, 'dim': dim, 'scale': scale, 'events': num_events,
+                                    'nodes': size['nodes'], 'edges': size['edges'], 'repeats': args.repeats,
+                                    'median_ms': float(np.median(times)), 'min_ms': float(times.min()),
+                                    'mean_ms': float(times.mean()), 'std_ms': float(times.std())})
+                    edges = size['edges'] if size['edges'] is not None else '-'
+                    print(f"{dataset:<9}{dim:>4} x{scale:<5g}{name:<17}{size['nodes']:>8} nodes{edges:>9} edges {np.median(times):>10.3f} ms")
+
+    if args.output is not None:
+        meta = {'python': platform.python_version(), 'torch': torch.__version__, 'numpy': np.__version__,
+                'platform': platform.platform(), 'processor': platform.processor(), 'threads': torch.get_num_threads(),
+                'device': args.device, 'arguments': vars(args), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.output, 'w') as fp:
+            json.dump({'meta': meta, 'results': results}, fp, indent=2)
+        print("Results written to", args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
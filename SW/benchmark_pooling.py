@@ -0,0 +1,60 @@
+import time
+import argparse
+import numpy as np
+import torch
+
+from networks.efgcn import EFGCN
+from networks.layers.graph_gen import GraphGen
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark graph pooling with linear keys against torch.unique(dim=0)')
+    parser.add_argument('--dims', type=int, nargs='+', default=[128, 256], help='Input dimensions of EFGCN')
+    parser.add_argument('--num_events', type=int, default=20000, help='Number of events of a synthetic sample')
+    parser.add_argument('--radius', type=int, default=3, help='Radius of the graph')
+    parser.add_argument('--repeats', type=int, default=10, help='Number of timed runs')
+    return parser.parse_args()
+
+def synthetic_graph(dim, num_events, radius, seed=0):
+    '''Graph of uniformly distributed events with increasing timestamps.'''
+    rng = np.random.default_rng(seed)
+    events = np.column_stack((rng.integers(0, dim, num_events),
+                              rng.integers(0, dim, num_events),
+                              np.sort(rng.integers(0, dim, num_events)),
+                              rng.integers(0, 2, num_events)))
+    nodes, _, edges = GraphGen(r=radius, dimension_XY=dim).build(events)
+    return nodes, edges
+
+def pooling_topology(layers, nodes, edges):
+    '''Topology of all pooling stages of EFGCN.'''
+    max_pool1, max_pool2, out = layers
+    nodes1, assign1, edges1, _ = max_pool1.topology(nodes, edges)
+    nodes2, assign2, edges2, _ = max_pool2.topology(nodes1, edges1)
+    cells, assign3, _ = out.topology(nodes2)
+    return nodes1, assign1, edges1, nodes2, assign2, edges2, cells, assign3
+
+def benchmark(layers, nodes, edges, linear_keys, repeats):
+    for layer in layers:
+        layer.linear_keys = linear_keys
+    result = pooling_topology(layers, nodes, edges)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pooling_topology(layers, nodes, edges)
+    return result, (time.perf_counter() - start) / repeats
+
+def main(args):
+    for dim in args.dims:
+        nodes, edges = synthetic_graph(dim, args.num_events, args.radius)
+        layers = EFGCN.pooling_layers((dim, dim, dim))
+
+        reference, unique_time = benchmark(layers, nodes, edges, False, args.repeats)
+        result, linear_time = benchmark(layers, nodes, edges, True, args.repeats)
+        identical = all(torch.equal(a, b) for a, b in zip(reference, result))
+
+        print(f'dim={dim} nodes={nodes.shape[0]} edges={edges.shape[0]}: '
+              f'torch.unique {unique_time * 1000:.2f} ms, linear keys {linear_time * 1000:.2f} ms '
+              f'(x{unique_time / linear_time:.1f}), identical={identical}')
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
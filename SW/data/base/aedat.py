@@ -0,0 +1,184 @@
+import os
+import mmap
+import numpy as np
+
+############################################################################################################
+# AEDAT READER (MNIST-DVS, CIFAR10-DVS)
+############################################################################################################
+    
+EVT_DVS = 0  # DVS event type
+EVT_APS = 1  # APS event
+
+def read_bits(arr, mask=None, shift=None):
+    if mask is not None:
+        arr = arr & mask
+    if shift is not None:
+        arr = arr >> shift
+    return arr
+
+
+y_mask = 0x7FC00000
+y_shift = 22
+
+x_mask = 0x003FF000
+x_shift = 12
+
+polarity_mask = 0x800
+polarity_shift = 11
+
+valid_mask = 0x80000000
+valid_shift = 31
+
+
+def skip_header(fp):
+    p = 0
+    lt = fp.readline()
+    ltd = lt.decode().strip()
+    while ltd and ltd[0] == "#":
+        p += len(lt)
+        lt = fp.readline()
+        try:
+            ltd = lt.decode().strip()
+        except UnicodeDecodeError:
+            break
+    return p
+
+
+def load_raw_events(fp,
+                    bytes_skip=0,
+                    bytes_trim=0,
+                    filter_dvs=False,
+                    times_first=False):
+    p = skip_header(fp)
+    fp.seek(p + bytes_skip)
+    data = fp.read()
+    if bytes_trim > 0:
+        data = data[:-bytes_trim]
+    data = np.frombuffer(data, dtype='>u4')
+    if len(data) % 2 != 0:
+        print(data[:20:2])
+        print('---')
+        print(data[1:21:2])
+        raise ValueError('odd number of data elements')
+    raw_addr = data[::2]
+    timestamp = data[1::2]
+    if times_first:
+        timestamp, raw_addr = raw_addr, timestamp
+    if filter_dvs:
+        valid = read_bits(raw_addr, valid_mask, valid_shift) == EVT_DVS
+        timestamp = timestamp[valid]
+        raw_addr = raw_addr[valid]
+    return timestamp, raw_addr
+
+
+def parse_raw_address(addr,
+                      x_mask=x_mask,
+                      x_shift=x_shift,
+                      y_mask=y_mask,
+                      y_shift=y_shift,
+                      polarity_mask=polarity_mask,
+                      polarity_shift=polarity_shift):
+    polarity = read_bits(addr, polarity_mask, polarity_shift).astype(np.bool_)
+    x = read_bits(addr, x_mask, x_shift)
+    y = read_bits(addr, y_mask, y_shift)
+    return x, y, polarity
+
+
+def load_events(
+        fp,
+        filter_dvs=False,
+        **kwargs):
+    timestamp, addr = load_raw_events(
+        fp,
+        filter_dvs=filter_dvs,
+    )
+    x, y, polarity = parse_raw_address(addr, **kwargs)
+    return timestamp, x, y, polarity
+
+
+def iter_raw_events(path,
+                    chunk_size=1 << 20,
+                    bytes_skip=0,
+                    bytes_trim=0,
+                    filter_dvs=False,
+                    times_first=False):
+    '''Memory-map an AEDAT file and yield (timestamp, raw_addr) chunks of chunk_size events.'''
+    with open(path, 'rb') as fp:
+        start = skip_header(fp) + bytes_skip
+        size = os.fstat(fp.fileno()).st_size - start - bytes_trim
+        if size <= 0:
+            return
+        if size % 8 != 0:
+            raise ValueError('odd number of data elements')
+
+        num_events = size // 8
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for first in range(0, num_events, chunk_size):
+                count = min(chunk_size, num_events - first)
+                data = np.frombuffer(mm, dtype='>u4', count=2 * count, offset=start + 8 * first)
+
+                # Copy to native byte order, so no views of the mapped file leave this function
+                raw_addr = data[::2].astype(np.uint32)
+                timestamp = data[1::2].astype(np.uint32)
+                del data
+                if times_first:
+                    timestamp, raw_addr = raw_addr, timestamp
+                if filter_dvs:
+                    valid = read_bits(raw_addr, valid_mask, valid_shift) == EVT_DVS
+                    timestamp = timestamp[valid]
+                    raw_addr = raw_addr[valid]
+                yield timestamp, raw_addr
+        finally:
+            mm.close()
+
+
+def load_event_windows(path,
+                       time_window,
+                       num_windows=1,
+                       t_start=0,
+                       chunk_size=1 << 20,
+                       filter_dvs=False,
+                       **kwargs):
+    '''Read consecutive windows [t_start + k * time_window, t_start + (k + 1) * time_window) in one pass.'''
+    '''Timestamps are assumed to be non-decreasing, so decoding stops with the first chunk that
+    reaches past the last window (or at the end of the file if num_windows is None).
+    Returns a list of (timestamp, x, y, polarity) tuples, one per window.'''
+    t_end = None if num_windows is None else t_start + num_windows * time_window
+    windows = {}
+    for timestamp, addr in iter_raw_events(path, chunk_size=chunk_size, filter_dvs=filter_dvs):
+        # Events are sorted by time, so no later chunk can reach back into the windows
+        finished = t_end is not None and timestamp.size > 0 and timestamp[-1] >= t_end
+
+        mask = timestamp >= t_start
+        if t_end is not None:
+            mask &= timestamp < t_end
+        timestamp, addr = timestamp[mask], addr[mask]
+
+        # Split the chunk between windows
+        window_idx = (timestamp.astype(np.int64) - t_start) // time_window
+        for idx in np.unique(window_idx):
+            window_mask = window_idx == idx
+            windows.setdefault(int(idx), []).append((timestamp[window_mask], addr[window_mask]))
+
+        if finished:
+            break
+
+    if num_windows is None:
+        num_windows = max(windows.keys()) + 1 if windows else 0
+
+    results = []
+    for idx in range(num_windows):
+        parts = windows.get(idx, [])
+        timestamp = np.concatenate([part[0] for part in parts]) if parts else np.zeros(0, dtype=np.uint32)
+        addr = np.concatenate([part[1] for part in parts]) if parts else np.zeros(0, dtype=np.uint32)
+        x, y, polarity = parse_raw_address(addr, **kwargs)
+        results.append((timestamp, x, y, polarity))
+    return results
+
+
+def load_events_window(path,
+                       time_window,
+                       **kwargs):
+    '''Read a single window (by default only the events with timestamp < time_window).'''
+    return load_event_windows(path, time_window, num_windows=1, **kwargs)[0]
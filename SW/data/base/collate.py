@@ -0,0 +1,46 @@
+import torch
+
+from networks.efgcn import PYRAMID_LEVELS
+
+'''Batching of event graphs.'''
+'''Graphs are merged into a single disjoint graph - edges of every graph are offset by the number
+of nodes of the preceding graphs and batch holds the index of the graph for every node, so graphs
+are processed in a single call but never connected.'''
+
+
+def collate_graphs(data_list):
+    num_nodes = [data['nodes'].shape[0] for data in data_list]
+
+    edges = []
+    offset = 0
+    for data, size in zip(data_list, num_nodes):
+        edges.append(data['edges'].reshape(-1, 2) + offset)
+        offset += size
+
+    batch = torch.repeat_interleave(torch.arange(len(data_list)), torch.tensor(num_nodes, dtype=torch.int64))
+    merged = {'nodes': torch.cat([data['nodes'] for data in data_list], dim=0),
+              'features': torch.cat([data['features'] for data in data_list], dim=0),
+              'edges': torch.cat(edges, dim=0),
+              'batch': batch,
+              'y': torch.tensor([int(data['y']) for data in data_list])}
+
+    # Precomputed graph pyramids are merged level by level in the same way
+    if all(level + '_nodes' in data for data in data_list for level in PYRAMID_LEVELS):
+        for level in PYRAMID_LEVELS:
+            merged.update(_collate_level(data_list, level))
+    return merged
+
+
+def _collate_level(data_list, level):
+    # Assignments and edges index the pooled nodes of the level, so they are offset by its node counts
+    num_nodes = [data[level + '_nodes'].shape[0] for data in data_list]
+    offsets = [0]
+    for size in num_nodes[:-1]:
+        offsets.append(offsets[-1] + size)
+
+    merged = {level + '_nodes': torch.cat([data[level + '_nodes'] for data in data_list], dim=0),
+              level + '_assign': torch.cat([data[level + '_assign'] + offset for data, offset in zip(data_list, offsets)], dim=0),
+              level + '_batch': torch.repeat_interleave(torch.arange(len(data_list)), torch.tensor(num_nodes, dtype=torch.int64))}
+    if level + '_edges' in data_list[0]:
+        merged[level + '_edges'] = torch.cat([data[level + '_edges'].reshape(-1, 2) + offset for data, offset in zip(data_list, offsets)], dim=0)
+    return merged
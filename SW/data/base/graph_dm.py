@@ -0,0 +1,204 @@
+import os
+import glob
+import numpy as np
+import torch
+import lightning as L
+
+from networks.layers.graph_gen import GraphGen
+from networks.layers.max_pool import GraphPooling
+from networks.layers.qpool_out import QuantGraphPoolOut
+from networks.efgcn import EFGCN
+from utils.normalise import normalise
+from data.base.event_ds import EventDS
+from data.base.shard_ds import ShardDS, pack_shard, shard_is_current
+from data.base.scheduler import process_files
+from data.base.manifest import Manifest, file_hash, code_version
+
+'''Preprocessing shared by the event datamodules.'''
+'''Raw files are turned into graph sets (targets) of (radius, time window in ms, dim), each in its own processed
+directory with a manifest of processed files, and packed into shards. Subclasses set the dataset parameters in
+__init__, call init_targets and implement data_files (raw files of a split) and load_events (raw events and label).'''
+
+device = torch.device(torch.cuda.current_device()) if torch.cuda.is_available() else torch.device('cpu')
+
+
+class GraphDataModule(L.LightningDataModule):
+    def init_targets(self, radius, targets, hw_context, pyramid, *code):
+        '''Graph sets generated in a single preprocessing pass, code are the dataset specific functions of the code version.'''
+        # The first target is used for training and evaluation.
+        self.default_window_dim = (round(self.time_window / self.ms), self.dim[0])
+        self.targets = [tuple(target) for target in targets] if targets else [(radius, *self.default_window_dim)]
+        self.radius, time_window, dim = self.targets[0]
+        self.time_window = time_window * self.ms
+        self.original_dim = self.original_dim[:2] + (self.time_window,)
+        self.dim = (dim, dim, dim)
+
+        # Generate graphs with the bounded context of the hardware edges_gen module.
+        self.hw_context = hw_context
+        self.processed_dir = self.target_dir(self.targets[0])
+
+        # Store the pooled graphs of EFGCN with every sample, so that inference skips the pooling topology.
+        self.pyramid = pyramid
+
+        # Number of processed files between two saves of the manifests.
+        self.save_every = 100
+
+        # Version of the preprocessing code, recorded in the manifest of processed files.
+        self.code_version = code_version(type(self), GraphDataModule, GraphGen, normalise, *code,
+                                         *((EFGCN, GraphPooling, QuantGraphPoolOut) if pyramid else ()))
+
+    ############################################################################
+    # SINGLE FILE PROCESSING ###################################################
+    ############################################################################
+
+    def data_files(self, mode: str) -> list:
+        '''Raw files of a split.'''
+        raise NotImplementedError
+
+    def load_events(self, data_file, time_window):
+        '''Raw events (dict of x, y, t and p arrays) of the first time_window (raw time unit) and the label of a file.'''
+        raise NotImplementedError
+
+    def source_files(self, data_file) -> list:
+        '''Other files the processed file of a raw file depends on (e.g. labels), tracked by the manifest.'''
+        return []
+
+    def process_file(self, data_file):
+        '''Process a single file for all out of date targets.'''
+        '''Returns the number of events, the number of generated edges and the manifest records.'''
+        # Check which targets are out of date according to the manifest.
+        targets = self.stale_targets(data_file)
+        if not targets:
+            return 0, 0, []
+
+        # The raw file may have only been touched, so its content decides what is rebuilt.
+        sources = self.source_files(data_file)
+        raw_hash = file_hash(data_file, *sources)
+        rebuild = [target for target in self.stale_targets(data_file, raw_hash) if target in targets]
+        records = [(target, self.manifest(target).record(data_file, self.target_params(target), self.code_version, raw_hash, sources)) for target in targets]
+        targets = rebuild
+        if not targets:
+            return 0, 0, records
+
+        # Extract events from the raw data file (only events from the longest time window are needed).
+        raw_events, y = self.load_events(data_file, max(time_window for _, time_window, _ in targets) * self.ms)
+
+        # Events are filtered and normalised once for each time window and dimension.
+        num_edges = 0
+        for time_window, dim in sorted({(time_window, dim) for _, time_window, dim in targets}):
+            mask = raw_events['t'] < time_window * self.ms
+            events = {k: v[mask] for k, v in raw_events.items()}
+
+            # We normalize x, y and t to the target dimension.
+            events = normalise(events, original=self.original_dim[:2] + (time_window * self.ms,), normalised=(dim, dim, dim))
+
+            assert events[:,0].max() < dim
+            assert events[:,1].max() < dim
+            assert events[:,2].max() < dim
+
+            # Generate graph from events for each radius.
+            for radius in sorted(radius for radius, window, size in targets if (window, size) == (time_window, dim)):
+                graph_generator = GraphGen(r=radius, dimension_XY=(dim, dim), self_loop=True, hw_context=self.hw_context).to(device)
+                nodes, features, edges = graph_generator.build(events.astype(np.int32))
+
+                # Save processed file.
+                # To prevent memory issues, we save data to CPU.
+                data = {'nodes': nodes.to("cpu"),
+                        'features': features.to("cpu"),
+                        'edges': edges.to("cpu"),
+                        'y': y}
+                if self.pyramid:
+                    data.update(EFGCN.graph_pyramid(data['nodes'], data['edges'], (dim, dim, dim)))
+
+                # Write to a temporary file first, so that an interrupted run never leaves a partial file.
+                processed_file = self.processed_file(data_file, (radius, time_window, dim))
+                os.makedirs(os.path.dirname(processed_file), exist_ok=True)
+                torch.save(data, processed_file + '.tmp')
+                os.replace(processed_file + '.tmp', processed_file)
+                num_edges += edges.shape[0]
+
+        return raw_events['t'].size, num_edges, records
+
+    def target_dir(self, target) -> str:
+        # Dataset defaults keep the processed_<radius> name.
+        radius, time_window, dim = target
+        name = 'processed' + f'_{radius}'
+        if (time_window, dim) != self.default_window_dim:
+            name += f'_{time_window}ms_{dim}'
+        return name + ('_hw' if self.hw_context else '')
+
+    def target_params(self, target) -> dict:
+        radius, time_window, dim = target
+        return {'radius': radius,
+                'time_window': time_window,
+                'dim': dim,
+                'original_dim': list(self.original_dim[:2]),
+                'hw_context': self.hw_context,
+                'pyramid': self.pyramid}
+
+    def manifest(self, target) -> Manifest:
+        return Manifest.cached(os.path.join(self.data_dir, self.data_name, self.target_dir(target), 'manifest.json'))
+
+    def stale_targets(self, data_file, raw_hash=None) -> list:
+        return [target for target in self.targets
+                if not self.manifest(target).is_current(self.processed_file(data_file, target), data_file, self.target_params(target), self.code_version, raw_hash, self.source_files(data_file))]
+
+    def processed_file(self, data_file, target) -> str:
+        return os.path.splitext(data_file.replace(self.data_name, self.data_name + '/' + self.target_dir(target)))[0] + '.pt'
+
+    ############################################################################
+    # DATA PREPARATION #########################################################
+    ############################################################################
+
+    def prepare_data(self) -> None:
+        print('Preparing data...')
+        for mode in ['train', 'test']:
+            print(f'Loading {mode} data')
+            for target in self.targets:
+                os.makedirs(os.path.join(self.data_dir, self.data_name, self.target_dir(target), mode), exist_ok=True)
+            self._prepare_data(mode)
+            self._pack_data(mode)
+
+    def _prepare_data(self, mode: str) -> None:
+        data_files = self.data_files(mode)
+
+        # Only files with out of date targets are processed, the manifests are updated with the results
+        # and saved every save_every files, so that an interrupted run keeps most of its work.
+        stale_files = [data_file for data_file in data_files if self.stale_targets(data_file)]
+        updated = []
+
+        def update_manifest(data_file, result):
+            for target, record in result[2]:
+                manifest = self.manifest(target)
+                manifest.update(manifest.key(self.processed_file(data_file, target)), record)
+            updated.append(data_file)
+            if len(updated) % self.save_every == 0:
+                for target in self.targets:
+                    self.manifest(target).save()
+
+        try:
+            failed = process_files(self.process_file, stale_files, max_workers=self.processes, on_result=update_manifest)
+        finally:
+            for target in self.targets:
+                self.manifest(target).save()
+
+        # Failed files keep their manifest entries out of date, so they are processed again by the next run.
+        if failed:
+            print(f'Warning: {len(failed)} {mode} files failed and are missing from the out of date targets:')
+            for data_file in failed:
+                print(f'  {data_file}')
+
+    def _pack_data(self, mode: str) -> None:
+        # Pack processed files into a single memory-mapped shard, which is packed again when the processed files change.
+        for target in self.targets:
+            shard_dir = os.path.join(self.data_dir, self.data_name, self.target_dir(target), mode + '_shard')
+            processed_files = sorted(glob.glob(os.path.join(self.data_dir, self.data_name, self.target_dir(target), mode, '*', '*.pt')))
+            if not shard_is_current(shard_dir, processed_files):
+                pack_shard(processed_files, shard_dir)
+
+    def generate_ds(self, mode: str):
+        shard_dir = os.path.join(self.data_dir, self.data_name, self.processed_dir, mode + '_shard')
+        if os.path.exists(shard_dir):
+            return ShardDS(shard_dir, self.dim)
+        processed_files = glob.glob(os.path.join(self.data_dir, self.data_name, self.processed_dir,  mode, '*', '*.pt'))
+        return EventDS(processed_files, self.dim)
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import inspect
+
+'''Manifest of processed files.'''
+'''For every output the manifest records the hash, size and modification time of the raw file (and of the other
+source files it depends on, e.g. labels), the preprocessing parameters and the version of the preprocessing code. An output is up to date
+only if all of them match, so interrupted runs and changed parameters are rebuilt.'''
+
+
+def file_hash(*paths, chunk_size=1 << 20) -> str:
+    '''SHA-256 of the content of the files, in order.'''
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_version(*objects) -> str:
+    '''Hash of the source files that define the given modules, classes or functions.'''
+    digest = hashlib.sha256()
+    for path in sorted({inspect.getsourcefile(obj) for obj in objects}):
+        with open(path, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()[:16]
+
+
+class Manifest:
+    '''Manifest stored as manifest.json in a processed directory, keyed by paths relative to it.'''
+
+    # Manifests loaded in this process, reloaded when the file changes on disk
+    _cache = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.entries = json.load(fp)['entries']
+
+    @classmethod
+    def cached(cls, path):
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        manifest, cached_mtime = cls._cache.get(path, (None, None))
+        if manifest is None or cached_mtime != mtime:
+            manifest = cls(path)
+            cls._cache[path] = (manifest, mtime)
+        return manifest
+
+    def key(self, output_file) -> str:
+        return os.path.relpath(output_file, self.root)
+
+    def source_stats(self, sources) -> dict:
+        '''Size and modification time of the other source files of an output.'''
+        return {os.path.relpath(source, self.root): [os.stat(source).st_size, os.stat(source).st_mtime_ns] for source in sources}
+
+    def record(self, raw_file, params, code, raw_hash, sources=()) -> dict:
+        '''raw_hash covers the raw file followed by the sources (see file_hash).'''
+        stat = os.stat(raw_file)
+        return {'raw_file': os.path.relpath(raw_file, self.root),
+                'raw_hash': raw_hash,
+                'raw_size': stat.st_size,
+                'raw_mtime_ns': stat.st_mtime_ns,
+                'sources': self.source_stats(sources),
+                'params': params,
+                'code_version': code}
+
+    def is_current(self, output_file, raw_file, params, code, raw_hash=None, sources=()) -> bool:
+        '''Check if the output is up to date.'''
+        '''Without raw_hash the raw file and the sources are compared by size and modification time only.'''
+        entry = self.entries.get(self.key(output_file))
+        if entry is None or not os.path.exists(output_file):
+            return False
+        if entry['params'] != params or entry['code_version'] != code:
+            return False
+        if sorted(entry.get('sources', {})) != sorted(os.path.relpath(source, self.root) for source in sources):
+            return False
+        if raw_hash is not None:
+            return entry['raw_hash'] == raw_hash
+        stat = os.stat(raw_file)
+        return (entry['raw_size'] == stat.st_size and entry['raw_mtime_ns'] == stat.st_mtime_ns
+                and entry.get('sources', {}) == self.source_stats(sources))
+
+    def update(self, key, record):
+        self.entries[key] = record
+
+    def save(self):
+        # Write to a temporary file first, so that the manifest is never partially written
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump({'entries': self.entries}, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        Manifest._cache[self.path] = (self, os.stat(self.path).st_mtime_ns)
@@ -0,0 +1,82 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from tqdm import tqdm
+
+
+def available_cpus() -> int:
+    '''Number of CPUs this process is allowed to run on.'''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def process_files(process_fn, data_files, max_workers=None, retries=2, on_result=None):
+    '''Run process_fn for every file in a process pool, largest files first.'''
+    '''process_fn may return (number of events, number of edges), which is used to report the
+    throughput. Files whose call raised an exception are retried in a fresh pool up to retries
+    times without restarting the rest of the run. A killed worker breaks the pool and fails all its
+    unfinished files without counting an attempt: they are retried together in a fresh pool, and if
+    that pool breaks as well they are bisected into smaller pools until the file which kills its
+    worker runs alone, only then an attempt is counted. on_result(data_file, result) is called in
+    the main process for every processed file.
+    Returns the list of files which failed in every attempt.'''
+    max_workers = max_workers or available_cpus()
+
+    # Graph generation time grows with the number of events, so long files are started first
+    # to avoid waiting for a few of them at the end of the run.
+    attempts = {data_file: 0 for data_file in data_files}
+    failed = []
+    num_events = 0
+    num_edges = 0
+
+    # Groups of files run in a pool each, with a flag for groups of files which already broke a pool
+    groups = [(list(data_files), False)] if data_files else []
+
+    start = time.perf_counter()
+    with tqdm(total=len(data_files)) as progress:
+        while groups:
+            files, broken_before = groups.pop(0)
+            files = sorted(files, key=os.path.getsize, reverse=True)
+            retry, broken = [], []
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+                futures = {executor.submit(process_fn, data_file): data_file for data_file in files}
+                for future in as_completed(futures):
+                    data_file = futures[future]
+                    try:
+                        stats = future.result()
+                    except Exception as error:
+                        # The worker may have been killed by another file of the pool
+                        if isinstance(error, BrokenProcessPool) and len(files) > 1:
+                            broken.append(data_file)
+                            continue
+                        attempts[data_file] += 1
+                        if attempts[data_file] > retries:
+                            print(f'\nFailed to process {data_file}: {error!r}')
+                            failed.append(data_file)
+                            progress.update(1)
+                        else:
+                            retry.append(data_file)
+                        continue
+
+                    if stats is not None:
+                        num_events += stats[0]
+                        num_edges += stats[1]
+                    if on_result is not None:
+                        on_result(data_file, stats)
+                    progress.update(1)
+
+            if retry:
+                groups.append((retry, False))
+            if len(broken) == 1 or (broken and not broken_before):
+                groups.insert(0, (broken, True))
+            elif broken:
+                half = len(broken) // 2
+                groups[:0] = [(broken[:half], True), (broken[half:], True)]
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'Processed {len(data_files) - len(failed)}/{len(data_files)} files with {max_workers} workers in {elapsed:.1f} s '
+          f'({num_events / elapsed:.0f} events/s, {num_edges / elapsed:.0f} edges/s)')
+    return failed
@@ -0,0 +1,119 @@
+import os
+import json
+import shutil
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+'''Packed shard format for processed graphs.'''
+'''Every tensor of the samples (nodes, features, edges and the optional graph pyramid) is
+concatenated into a flat binary array <name>.bin and offsets.npy holds the start of every
+sample in each array, so a single sample is a slice of memory-mapped files. meta.json lists the packed
+files with their size and modification time, so that a shard is only reused for the same files.'''
+
+ARRAYS = {'nodes': np.float32, 'features': np.float32, 'edges': np.int32}
+
+
+def file_stats(files, shard_dir) -> dict:
+    '''Size and modification time of the packed files, keyed by paths relative to the parent of the shard.'''
+    return {os.path.relpath(data_file, os.path.dirname(shard_dir)): [os.stat(data_file).st_size, os.stat(data_file).st_mtime_ns]
+            for data_file in files}
+
+
+def shard_is_current(shard_dir, files) -> bool:
+    '''Check if the shard holds exactly the given files in their current version.'''
+    meta_file = os.path.join(shard_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+        return False
+    with open(meta_file) as fp:
+        meta = json.load(fp)
+    return (meta.get('files') == [os.path.relpath(data_file, os.path.dirname(shard_dir)) for data_file in files]
+            and meta.get('file_stats') == file_stats(files, shard_dir))
+
+
+def pack_shard(files, shard_dir):
+    '''Pack processed .pt files into a shard directory.'''
+    '''The shard is written to a temporary directory and renamed when complete.'''
+    tmp_dir = shard_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Arrays of the shard - nodes, features and edges with fixed types and any other tensors of the samples
+    first = torch.load(files[0]) if files else {}
+    arrays = dict(ARRAYS)
+    for name, value in first.items():
+        if name not in arrays and isinstance(value, torch.Tensor):
+            arrays[name] = value.numpy().dtype.type
+    shapes = {name: list(first[name].shape[1:]) if name in first else [] for name in arrays}
+    shapes.update({'nodes': [3], 'edges': [2]})
+
+    offsets = [[0] * len(arrays)]
+    labels = []
+    binaries = {name: open(os.path.join(tmp_dir, name + '.bin'), 'wb') for name in arrays}
+    try:
+        for data_file in files:
+            data = torch.load(data_file)
+            shapes['features'] = list(data['features'].shape[1:])
+            for name, dtype in arrays.items():
+                array = data[name].numpy().astype(dtype).reshape([-1] + shapes[name])
+                binaries[name].write(np.ascontiguousarray(array).tobytes())
+            offsets.append([offset + data[name].shape[0] for offset, name in zip(offsets[-1], arrays)])
+            labels.append(data['y'])
+    finally:
+        for binary in binaries.values():
+            binary.close()
+
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), np.array(offsets, dtype=np.int64).reshape(-1, len(arrays)))
+    np.save(os.path.join(tmp_dir, 'y.npy'), np.array(labels))
+
+    meta = {'num_samples': len(files),
+            'arrays': {name: {'dtype': np.dtype(dtype).name, 'shape': shapes[name], 'length': offsets[-1][i]} 
+                       for i, (name, dtype) in enumerate(arrays.items())},
+            'files': [os.path.relpath(data_file, os.path.dirname(shard_dir)) for data_file in files],
+            'file_stats': file_stats(files, shard_dir)}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as fp:
+        json.dump(meta, fp)
+
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.replace(tmp_dir, shard_dir)
+
+
+class ShardDS(Dataset):
+    '''Dataset reading samples from a shard written by pack_shard.'''
+    def __init__(self, shard_dir, dim=256):
+        self.shard_dir = shard_dir
+        self.dim = dim
+
+        with open(os.path.join(shard_dir, 'meta.json')) as fp:
+            self.meta = json.load(fp)
+        self.offsets = np.load(os.path.join(shard_dir, 'offsets.npy'))
+        self.y = np.load(os.path.join(shard_dir, 'y.npy'))
+
+        # Memory maps are opened lazily, so that each DataLoader worker maps the files itself
+        self.arrays = None
+
+    def _open(self):
+        self.arrays = {}
+        for name, array in self.meta['arrays'].items():
+            shape = tuple([array['length']] + array['shape'])
+            if array['length'] == 0:
+                self.arrays[name] = np.zeros(shape, dtype=array['dtype'])
+            else:
+                # Copy-on-write mapping gives writable zero-copy views for torch.from_numpy
+                self.arrays[name] = np.memmap(os.path.join(self.shard_dir, name + '.bin'), dtype=array['dtype'], mode='c', shape=shape)
+
+    def __len__(self) -> int:
+        return self.meta['num_samples']
+
+    def __getitem__(self, index: int):
+        if self.arrays is None:
+            self._open()
+        data = {name: torch.from_numpy(array[self.offsets[index, i]:self.offsets[index + 1, i]]) 
+                for i, (name, array) in enumerate(self.arrays.items())}
+        data['y'] = self.y[index].item()
+        return data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
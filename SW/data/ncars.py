@@ -1,24 +1,20 @@
 import os
 import glob
 import numpy as np
-import torch
-import lightning as L
-
-from tqdm import tqdm
-from tqdm.contrib.concurrent import process_map
 from torch.utils.data import DataLoader
 
-from networks.layers.graph_gen import GraphGen
-from utils.normalise import normalise
-from data.base.event_ds import EventDS
+from data.base.graph_dm import GraphDataModule
+from data.base.collate import collate_graphs
 
-device = torch.device(torch.cuda.current_device()) if torch.cuda.is_available() else torch.device('cpu')
 
-class NCars(L.LightningDataModule):
+class NCars(GraphDataModule):
     def __init__(self, 
                  data_dir, 
                  batch_size,
-                 radius=3):
+                 radius=3,
+                 hw_context=False,
+                 targets=None,
+                 pyramid=False):
         super().__init__()
 
         # Dataset directory and name.
@@ -31,14 +27,18 @@ class NCars(L.LightningDataModule):
 
         # Time window, normalization dimension and radius for graph generation.
         self.time_window = 0.1 # 100 ms
+        self.ms = 0.001 # 1 ms in seconds
         self.original_dim = (120, 100, self.time_window)
         self.dim = (128, 128, 128)
         self.radius = radius
 
+        # Graph sets generated in a single preprocessing pass as (radius, time window in ms, dim).
+        self.init_targets(radius, targets, hw_context, pyramid)
+
         # Number of workers, batch size and processes for data preparation.
         self.num_workers = 2
         self.batch_size = batch_size
-        self.processes = 6
+        self.processes = None  # None uses all available CPUs
 
         # Number of classes and class dictionary.
         self.num_classes = 2
@@ -48,90 +48,76 @@ class NCars(L.LightningDataModule):
     # SINGLE FILE PROCESSING ###################################################
     ############################################################################
 
-    def process_file(self, data_file) -> None:   
-        # Create name for processed file.
-        processed_file = data_file.replace(self.data_name, self.data_name + '/processed' + f'_{self.radius}').replace('txt', 'pt')
-
-        # Check if processed file already exists.
-        if os.path.exists(processed_file):
-            return
+    def data_files(self, mode: str) -> list:
+        return glob.glob(os.path.join(self.data_dir, self.data_name, mode, '*', 'events.txt'))
 
-        # Create directory for processed file.
-        os.makedirs(os.path.dirname(processed_file), exist_ok=True)
+    def source_files(self, data_file) -> list:
+        # The label of a sample is stored next to its events.
+        return [data_file.replace('events.txt', 'is_car.txt')]
 
-        # Extract events from raw data file.
-        events_file = os.path.join(data_file)
-        events = np.loadtxt(events_file)
+    def load_events(self, data_file, time_window):
+        # Extract events from the binary cache of the raw data file.
+        events, y = self.load_cached_events(data_file)
 
-        all_x = events[:, 0]
-        all_y = events[:, 1]
-        all_ts = events[:, 2]
-        all_p = events[:, 3]
+        all_x = events['x'].astype(np.float64)
+        all_y = events['y'].astype(np.float64)
+        all_ts = events['t']
+        all_p = events['p'].astype(np.float64)
         all_p[all_p == 0] = -1
         
-        events = {}
-        events['x'] = all_x
-        events['y'] = all_y
-        events['t'] = all_ts.astype(np.float64)
-        events['p'] = all_p
-        
-        # Filter events by time window.
-        mask = (events['t'] < self.time_window)
-        events['x'] = events['x'][mask]
-        events['y'] = events['y'][mask]
-        events['t'] = events['t'][mask]
-        events['p'] = events['p'][mask]
-
-        # We normalize x, y and t to the self.dim.
-        events = normalise(events, original=self.original_dim, normalised=self.dim)
-
-        assert events[:,0].max() < self.dim[0]
-        assert events[:,1].max() < self.dim[1]
-        assert events[:,2].max() < self.dim[2]
-        
-        # Generate graph from events.
-        # We assume that data is normalised to dim[0] for all dimensions.
-        graph_generator = GraphGen(r=self.radius, dimension_XY=self.dim[0], self_loop=True).to(device)
+        raw_events = {}
+        raw_events['x'] = all_x
+        raw_events['y'] = all_y
+        raw_events['t'] = all_ts.astype(np.float64)
+        raw_events['p'] = all_p
+        return raw_events, y
 
-        for event in events.astype(np.int32):
-            graph_generator.forward(event)
-        nodes, features, edges = graph_generator.release()
-        
-        # Save processed file.
-        # To prevent memory issues, we save data to CPU.
+    ############################################################################
+    # RAW EVENTS CACHE #########################################################
+    ############################################################################
+
+    def load_cached_events(self, data_file):
+        # Parsing events.txt with np.loadtxt is slow, so raw events are converted once
+        # to a binary file (cache/<mode>/<sample>/events.npz) and loaded from it later.
+        # The cache stores the size and modification time of the events and the label it was built from.
+        cache_file = data_file.replace(self.data_name, self.data_name + '/cache').replace('.txt', '.npz')
+        sources = self.source_stats(data_file)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cache:
+                if 'sources' in cache and np.array_equal(cache['sources'], sources):
+                    return cache['events'], cache['y'].item()
+        return self.cache_events(data_file, cache_file, sources)
+
+    def source_stats(self, data_file):
+        stats = [os.stat(path) for path in [data_file] + self.source_files(data_file)]
+        return np.array([[stat.st_size, stat.st_mtime_ns] for stat in stats], dtype=np.int64)
+
+    def cache_events(self, data_file, cache_file, sources):
+        raw = np.loadtxt(data_file, ndmin=2)
+        events = np.zeros(raw.shape[0], dtype=[('x', np.int16), ('y', np.int16), ('t', np.float64), ('p', np.int8)])
+        events['x'] = raw[:, 0]
+        events['y'] = raw[:, 1]
+        events['t'] = raw[:, 2]
+        events['p'] = raw[:, 3]
         y = np.loadtxt(data_file.replace('events.txt', 'is_car.txt')).astype(np.int32)
-        data = {'nodes': nodes.to("cpu"), 
-                'features': features.to("cpu"), 
-                'edges': edges.to("cpu"), 
-                'y': y.item()}
 
-        # Save processed file
-        torch.save(data, processed_file)
+        # Write to a temporary file first, so that an interrupted run does not leave a broken cache.
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'wb') as fp:
+            np.savez(fp, events=events, y=y, sources=sources)
+        os.replace(tmp_file, cache_file)
+        return events, y.item()
 
     ############################################################################
     # DATA PREPARATION #########################################################
     ############################################################################
 
-    def prepare_data(self) -> None:
-        print('Preparing data...')
-        for mode in ['train', 'test']:
-            print(f'Loading {mode} data')
-            os.makedirs(os.path.join(self.data_dir, self.data_name, 'processed' + f'_{self.radius}', mode), exist_ok=True)
-            self._prepare_data(mode)
-
-    def _prepare_data(self, mode: str) -> None:
-        data_files = glob.glob(os.path.join(self.data_dir, self.data_name, mode, '*', 'events.txt'))
-        process_map(self.process_file, data_files, max_workers=self.processes, chunksize=1, )
-            
     def setup(self, stage=None):
         # Load training and testing data.
         self.train_data = self.generate_ds('train')
         self.test_data = self.generate_ds('test')
 
-    def generate_ds(self, mode: str):
-        processed_files = glob.glob(os.path.join(self.data_dir, self.data_name, 'processed' + f'_{self.radius}',  mode, '*', '*.pt'))
-        return EventDS(processed_files, self.dim)
-
     def train_dataloader(self):
         return DataLoader(self.train_data, batch_size=self.batch_size, num_workers=self.num_workers, shuffle=True, collate_fn=self.collate_fn, persistent_workers=False)
     
@@ -142,5 +128,5 @@ class NCars(L.LightningDataModule):
         return DataLoader(self.test_data, batch_size=self.batch_size, num_workers=self.num_workers, shuffle=False, collate_fn=self.collate_fn, persistent_workers=False)
     
     def collate_fn(self, data_list):
-        # To work with batched data, we should change this function.
-        return data_list[0]
\ No newline at end of file
+        # Graphs of the batch are merged into a single disjoint graph with the graph index of every node in 'batch'.
+        return collate_graphs(data_list)
\ No newline at end of file
@@ -0,0 +1,94 @@
+import numpy as np
+
+from networks.layers.graph_gen import GraphGen
+from utils.normalise import normalise
+
+'''Seeded synthetic event recordings with the format and approximate statistics of the datasets.'''
+'''Events are emitted by a few moving objects (clusters of edge points which translate with a constant
+velocity, with the polarity given by the direction of motion) and by uniform background noise. The
+sensor size, time window, time unit, polarity coding and the typical number of events of a sample
+follow N-Cars, MNIST-DVS and CIFAR10-DVS, so the graphs have realistic sizes and densities for
+benchmarks without the licensed recordings. They are not a substitute for the datasets.'''
+
+# Statistics of a sample of every dataset - sensor size, time window in the time unit of the raw events,
+# time unit (1 ms), mean and log-normal spread of the number of events, moving objects and their size
+# as a fraction of the sensor, fraction of noise events
+PROFILES = {
+    'ncars': {'size': (120, 100), 'time_window': 0.1, 'ms': 0.001, 'num_events': 4000, 'spread': 0.7,
+              'num_objects': (1, 3), 'object_size': (0.3, 0.8), 'noise': 0.1},
+    'mnistdvs': {'size': (128, 128), 'time_window': 100000, 'ms': 1000, 'num_events': 8000, 'spread': 0.4,
+                 'num_objects': (1, 1), 'object_size': (0.3, 0.6), 'noise': 0.05},
+    'cifar10': {'size': (128, 128), 'time_window': 200000, 'ms': 1000, 'num_events': 30000, 'spread': 0.5,
+                'num_objects': (3, 8), 'object_size': (0.3, 1.0), 'noise': 0.15},
+}
+
+
+def synthetic_events(dataset, seed=0, num_events=None):
+    '''Raw events of a synthetic sample as a dict of x, y, t and p arrays sorted by t (as the datasets before normalise).'''
+    if dataset not in PROFILES:
+        raise ValueError('Dataset not supported')
+    profile = PROFILES[dataset]
+    rng = np.random.default_rng(seed)
+    width, height = profile['size']
+    window = profile['time_window']
+
+    if num_events is None:
+        num_events = int(profile['num_events'] * rng.lognormal(-profile['spread'] ** 2 / 2, profile['spread']))
+    num_events = max(int(num_events), 1)
+    t = np.sort(rng.uniform(0, window, num_events))
+
+    # Objects are clouds of edge points around a center, moving across the sensor during the window
+    num_objects = rng.integers(profile['num_objects'][0], profile['num_objects'][1] + 1)
+    shapes, velocities = [], []
+    for _ in range(num_objects):
+        radius = rng.uniform(*profile['object_size']) * min(width, height) / 2
+        angles = rng.uniform(0, 2 * np.pi, 64)
+        radii = radius * rng.uniform(0.5, 1.0, 64)
+        center = rng.uniform((0, 0), (width, height))
+        shapes.append(center + np.stack((radii * np.cos(angles), radii * np.sin(angles)), axis=1))
+        velocities.append(rng.normal(0, 0.5, 2) * (width, height) / window)
+
+    noise = rng.random(num_events) < profile['noise']
+    objects = rng.integers(0, num_objects, num_events)
+    points = rng.integers(0, 64, num_events)
+
+    x = np.empty(num_events)
+    y = np.empty(num_events)
+    p = np.empty(num_events, dtype=np.int64)
+    for index in range(num_objects):
+        mask = ~noise & (objects == index)
+        position = shapes[index][points[mask]] + velocities[index] * t[mask, None] + rng.normal(0, 1.0, (mask.sum(), 2))
+        x[mask], y[mask] = position[:, 0], position[:, 1]
+        # Leading edges of the moving object are ON events, trailing edges OFF events
+        offset = shapes[index][points[mask]] - shapes[index].mean(axis=0)
+        p[mask] = (offset @ velocities[index] > 0) ^ (rng.random(mask.sum()) < 0.1)
+
+    x[noise] = rng.uniform(0, width, noise.sum())
+    y[noise] = rng.uniform(0, height, noise.sum())
+    p[noise] = rng.integers(0, 2, noise.sum())
+
+    # Events outside the sensor are wrapped around, so that all objects stay in the field of view
+    x = np.floor(np.mod(x, width))
+    y = np.floor(np.mod(y, height))
+    return {'x': x, 'y': y, 't': t, 'p': p}
+
+
+def normalise_events(dataset, events, dim=128, time_window=None):
+    '''Normalised [x, y, t, p] events of a time window (ms) as in process_file of the dataset.'''
+    profile = PROFILES[dataset]
+    window = profile['time_window'] if time_window is None else time_window * profile['ms']
+    mask = events['t'] < window
+    events = {k: v[mask] for k, v in events.items()}
+
+    # N-Cars codes the polarity as -1 and 1
+    if dataset == 'ncars':
+        events['p'] = np.where(events['p'] == 0, -1, 1)
+    return normalise(events, original=profile['size'] + (window,), normalised=(dim, dim, dim))
+
+
+def synthetic_sample(dataset, dim=128, radius=3, seed=0, num_events=None, hw_context=False):
+    '''Processed synthetic sample (nodes, features, edges and a random label) as stored by the datasets.'''
+    events = normalise_events(dataset, synthetic_events(dataset, seed, num_events), dim)
+    nodes, features, edges = GraphGen(r=radius, dimension_XY=(dim, dim), self_loop=True, hw_context=hw_context).build(events)
+    y = int(np.random.default_rng(seed).integers(0, 2 if dataset == 'ncars' else 10))
+    return {'nodes': nodes, 'features': features, 'edges': edges, 'y': y}
@@ -0,0 +1,127 @@
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from data.ncars import NCars
+from data.mnistdvs import MnistDVS
+from data.cifar10 import Cifar10
+from data.synthetic import PROFILES, synthetic_events
+
+from hw_model.config import load_config
+from hw_model.cost_model import HWCostModel, print_report
+
+'''Throughput and latency of the HW configurations on a dataset from the cycle-level cost model (hw_model/cost_model.py).'''
+'''Windows of the processed dataset (or of seeded synthetic recordings) are streamed through the model of every
+configuration, optionally resampled to the given sensor event rates, to choose a configuration for a sensor without
+synthesising it.'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Estimate the latency, event rate and buffer occupancy of HW configurations on a dataset')
+    parser.add_argument('--configs', type=str, nargs='+', default=['../HW/configs/Small_100ms_128'], help='HW configuration directories')
+    parser.add_argument('--dataset', type=str, default='ncars', help='Dataset to use')
+    parser.add_argument('--synthetic', action='store_true', help='Use seeded synthetic recordings with the statistics of the dataset')
+    parser.add_argument('--split', type=str, default='test', choices=['train', 'test'], help='Dataset split')
+    parser.add_argument('--num_samples', type=int, default=None, help='Number of samples (default all, 100 synthetic)')
+    parser.add_argument('--event_rates', type=float, nargs='+', default=None, help='Sensor event rates in Mev/s (default the rate of the samples)')
+    parser.add_argument('--clock', type=float, default=200, help='Clock of the programmable logic in MHz')
+    parser.add_argument('--fifo_depth', type=int, default=1024, help='Depth of the input FIFO of edges_gen')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic recordings and of the resampling')
+    parser.add_argument('--output', type=str, default=None, help='Write the reports to a JSON file')
+    return parser.parse_args()
+
+def bin_arrivals(t, graph_size, time_window):
+    '''Arrival times (us) of events with normalised timestamps, spread evenly over their time bins in order.'''
+    t = np.asarray(t, dtype=np.int64)
+    counts = np.bincount(t, minlength=graph_size)
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    position = np.arange(t.size) - first[t]
+    return (t + (position + 0.5) / counts[t]) * time_window / graph_size
+
+def processed_windows(args, config):
+    '''Windows (t, arrivals, duration) of the processed samples for the graph size and time window of the configuration.'''
+    target = [(config.radius, config.time_window // 1000, config.graph_size)]
+    if args.dataset == 'ncars':
+        dm = NCars(data_dir='dataset', batch_size=1, radius=config.radius, hw_context=True, targets=target)
+    elif args.dataset == 'cifar10':
+        dm = Cifar10(data_dir='dataset', batch_size=1, radius=config.radius, hw_context=True, targets=target)
+    elif args.dataset == 'mnistdvs':
+        dm = MnistDVS(data_dir='dataset', batch_size=1, radius=config.radius, hw_context=True, targets=target)
+    else:
+        raise ValueError('Dataset not supported')
+    dm.setup()
+
+    dataset = dm.train_data if args.split == 'train' else dm.test_data
+    num_samples = len(dataset) if args.num_samples is None else min(args.num_samples, len(dataset))
+    windows = []
+    for index in tqdm(range(num_samples)):
+        t = dataset[index]['nodes'][:, 2].numpy().astype(np.int64)
+        windows.append((t, bin_arrivals(t, config.graph_size, config.time_window), config.time_window))
+    return windows
+
+def synthetic_windows(args, config):
+    '''Windows of synthetic recordings cut to the time window of the configuration, timestamps as in normalize.sv.'''
+    if args.dataset not in PROFILES:
+        raise ValueError('Dataset not supported')
+    profile = PROFILES[args.dataset]
+    num_samples = 100 if args.num_samples is None else args.num_samples
+
+    windows = []
+    for index in range(num_samples):
+        timestamps = synthetic_events(args.dataset, args.seed + index)['t'] / profile['ms'] * 1000
+        length = profile['time_window'] / profile['ms'] * 1000
+        for start in np.arange(0, length, config.time_window):
+            arrivals = timestamps[(timestamps >= start) & (timestamps < start + config.time_window)] - start
+            t = (arrivals.astype(np.int64) * config.graph_size // config.time_window).astype(np.int64)
+            windows.append((t, arrivals, config.time_window))
+    return windows
+
+def resample(windows, event_rate, graph_size, rng):
+    '''Windows with event_rate (ev/s) events per second with the event rate of every time bin of the window.'''
+    resampled = []
+    for t, arrivals, duration in windows:
+        num_events = int(round(event_rate * duration / 1e6))
+        if t.size == 0 or num_events == 0:
+            resampled.append((t[:0], arrivals[:0], duration))
+            continue
+        # Events are uniform within a time bin, so repeated events do not arrive at the same time
+        counts = np.bincount(t, minlength=graph_size)
+        bins = rng.choice(graph_size, num_events, p=counts / counts.sum())
+        arrivals = np.sort((bins + rng.random(num_events)) * duration / graph_size)
+        t = np.minimum(arrivals * graph_size // duration, graph_size - 1).astype(np.int64)
+        resampled.append((t, arrivals, duration))
+    return resampled
+
+def main(args):
+    reports = []
+    for path in args.configs:
+        config = load_config(path)
+        model = HWCostModel(config, clock_hz=args.clock * 1e6, fifo_depth=args.fifo_depth)
+        print(config)
+        windows = synthetic_windows(args, config) if args.synthetic else processed_windows(args, config)
+
+        for event_rate in (args.event_rates or [None]):
+            rng = np.random.default_rng(args.seed)
+            report = model.simulate(windows if event_rate is None else resample(windows, event_rate * 1e6, config.graph_size, rng))
+            report.update({'dataset': args.dataset, 'synthetic': args.synthetic, 'sensor_event_rate': event_rate})
+            print_report(report)
+            reports.append(report)
+
+    # Configurations keep up with the events if no event is dropped and no layer is switched while busy
+    print(f"\n{'config':<22}{'rate [Mev/s]':>13}{'latency p50 [ms]':>18}{'p99 [ms]':>10}{'FIFO max':>10}{'dropped':>9}{'overruns':>10}  bottleneck")
+    for report in reports:
+        latency = report['latency_us']
+        overruns = sum(stage['overruns'] for stage in report['stages'])
+        p50, p99 = (f"{latency[key] / 1000:.2f}" if latency is not None else '-' for key in ('p50', 'p99'))
+        print(f"{report['config']:<22}{report['event_rate'] / 1e6:>13.3f}{p50:>18}{p99:>10}"
+              f"{int(report['fifo']['occupancy']['max']) if report['fifo']['occupancy'] else 0:>10}"
+              f"{report['fifo']['dropped']:>9}{overruns:>10}  {report.get('bottleneck', '-')}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump({'arguments': vars(args), 'reports': reports}, fp, indent=2)
+        print("Reports written to", args.output)
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
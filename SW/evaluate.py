@@ -2,6 +2,7 @@ import torch
 import numpy as np
 import os
 import argparse
+import contextlib
 
 from data.ncars import NCars
 from data.mnistdvs import MnistDVS
@@ -9,48 +10,79 @@ from data.cifar10 import Cifar10
 
 from networks.efgcn import EFGCN
 
-from utils.run_models import float_inference, quantize_inference, calibration_inference
+from utils.run_models import float_inference, quantize_inference, calibration_inference, event_inference, anytime_inference
 from utils.load_ckpt_model import load_ckpt_model
+from utils.profiler import LayerProfiler
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Train a model')
     parser.add_argument('--dataset', type=str, default='cifar10', help='Dataset to use')
     parser.add_argument('--radius', type=int, default=5, help='Radius of the graph')
+    parser.add_argument('--batch_size', type=int, default=32, help='Number of graphs evaluated in a single forward pass')
+    parser.add_argument('--sparse_head', action='store_true', help='Apply the last linear layer only to occupied output cells')
+    parser.add_argument('--integer', action='store_true', help='Also run the quantized model on integer tensors with the arithmetic of the HW')
+    parser.add_argument('--hw_context', action='store_true', help='Use graphs generated with the HW bounded context')
+    parser.add_argument('--event_driven', action='store_true', help='Also run the quantized model event by event (conv1 and the first pooling on every event)')
+    parser.add_argument('--anytime_step', type=float, default=None, help='Also classify partial windows every ANYTIME_STEP ms of events (anytime / early exit)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.6, 0.7, 0.8, 0.9, 0.95], help='Confidence thresholds of the early exit')
+    parser.add_argument('--anytime_report', type=str, default=None, help='Write the accuracy-vs-latency report to a JSON file')
+    parser.add_argument('--profile', type=str, default=None, help='Profile the layers of the float and quantized passes, writes PROFILE.json and the Chrome trace PROFILE.trace.json')
     return parser.parse_args()
 
 def main(args):
     folder_name = 'weights/' + args.dataset
     
     if args.dataset == 'ncars':
-        dm = NCars(data_dir='dataset', batch_size=1, radius=args.radius)
+        dm = NCars(data_dir='dataset', batch_size=args.batch_size, radius=args.radius, hw_context=args.hw_context)
     elif args.dataset == 'cifar10':
-        dm = Cifar10(data_dir='dataset', batch_size=1, radius=args.radius)
+        dm = Cifar10(data_dir='dataset', batch_size=args.batch_size, radius=args.radius, hw_context=args.hw_context)
     elif args.dataset == 'mnistdvs':
-        dm = MnistDVS(data_dir='dataset', batch_size=1, radius=args.radius)
+        dm = MnistDVS(data_dir='dataset', batch_size=args.batch_size, radius=args.radius, hw_context=args.hw_context)
     else:
         raise ValueError('Dataset not supported')
     dm.setup()
 
-    model = EFGCN(input_dimension=dm.dim, num_outputs=dm.num_classes, num_bits=8, bias=True).cuda()
+    model = EFGCN(input_dimension=dm.dim, num_outputs=dm.num_classes, num_bits=8, bias=True, sparse_head=args.sparse_head).cuda()
     model.eval()
 
     # Load the float model
     model.load_state_dict(torch.load(folder_name+f'/float_model_{args.radius}.ckpt', map_location='cuda'))
 
-    # Run the float model
-    float_inference(model=model, dm=dm, device='cuda')
+    # Layers are profiled only with --profile, otherwise the model runs its original methods
+    profiler = LayerProfiler(model) if args.profile is not None else contextlib.nullcontext()
+    with profiler:
+        # Run the float model
+        float_inference(model=model, dm=dm, device='cuda')
 
-    # Run calibration only for initialisation all parameters
-    model = calibration_inference(model=model, dm=dm, num_calibration_samples=1, device='cuda')
-    model.freeze()
+        # Run calibration only for initialisation all parameters
+        model = calibration_inference(model=model, dm=dm, num_calibration_samples=1, device='cuda')
+        model.freeze()
 
-    # Load the quantized model
-    param = torch.load(folder_name+f'/qat_model_{args.radius}.ckpt', map_location='cuda')
-    for pa in param:
-        model.state_dict()[pa].copy_(param[pa])
+        # Load the quantized model
+        param = torch.load(folder_name+f'/qat_model_{args.radius}.ckpt', map_location='cuda')
+        for pa in param:
+            model.state_dict()[pa].copy_(param[pa])
 
-    # Run the quantized model
-    quantize_inference(model=model, dm=dm, device='cuda')
+        # Run the quantized model
+        quantize_inference(model=model, dm=dm, device='cuda')
+
+        # Run the quantized model with integer arithmetic
+        if args.integer:
+            quantize_inference(model=model, dm=dm, device='cuda', integer=True)
+
+    if args.profile is not None:
+        profiler.print_summary()
+        profiler.to_json(args.profile + '.json')
+        profiler.to_chrome_trace(args.profile + '.trace.json')
+        print("Profile written to", args.profile + '.json', "and", args.profile + '.trace.json')
+
+    # Run the quantized model event by event
+    if args.event_driven:
+        event_inference(model=model, dm=dm, radius=args.radius, hw_context=args.hw_context, device='cuda')
+
+    # Run the quantized model on partial windows with early exit
+    if args.anytime_step is not None:
+        anytime_inference(model=model, dm=dm, step_ms=args.anytime_step, thresholds=args.thresholds, device='cuda', output=args.anytime_report)
 
 if __name__ == '__main__':
     args = parse_args()
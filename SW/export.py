@@ -0,0 +1,52 @@
+import torch
+import argparse
+
+from data.ncars import NCars
+from data.mnistdvs import MnistDVS
+from data.cifar10 import Cifar10
+
+from networks.efgcn import EFGCN
+
+from utils.run_models import calibration_inference
+from runtime.export import export_model
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export a frozen quantized model for the NumPy runtime')
+    parser.add_argument('--dataset', type=str, default='cifar10', help='Dataset to use')
+    parser.add_argument('--radius', type=int, default=5, help='Radius of the graph')
+    parser.add_argument('--output', type=str, default=None, help='Output file (default weights/<dataset>/frozen_model_<radius>.npz)')
+    return parser.parse_args()
+
+def main(args):
+    folder_name = 'weights/' + args.dataset
+    
+    if args.dataset == 'ncars':
+        dm = NCars(data_dir='dataset', batch_size=1, radius=args.radius)
+    elif args.dataset == 'cifar10':
+        dm = Cifar10(data_dir='dataset', batch_size=1, radius=args.radius)
+    elif args.dataset == 'mnistdvs':
+        dm = MnistDVS(data_dir='dataset', batch_size=1, radius=args.radius)
+    else:
+        raise ValueError('Dataset not supported')
+    dm.setup()
+
+    model = EFGCN(input_dimension=dm.dim, num_outputs=dm.num_classes, num_bits=8, bias=True)
+    model.eval()
+    model.load_state_dict(torch.load(folder_name+f'/float_model_{args.radius}.ckpt', map_location='cpu'))
+
+    # Run calibration only for initialisation all parameters
+    model = calibration_inference(model=model, dm=dm, num_calibration_samples=1, device='cpu')
+    model.freeze()
+
+    # Load the quantized model
+    param = torch.load(folder_name+f'/qat_model_{args.radius}.ckpt', map_location='cpu')
+    for pa in param:
+        model.state_dict()[pa].copy_(param[pa])
+
+    output = args.output or folder_name+f'/frozen_model_{args.radius}.npz'
+    export_model(model, output, input_dimension=dm.dim)
+    print("Frozen model written to", output)
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,242 @@
+import os
+import re
+import numpy as np
+
+'''Loader of the HW configurations (HW/configs/*).'''
+'''A configuration is read from its top.sv (parameters of every instance of the pipeline and the inline weights of
+async_conv), graph_pkg.sv (graph size, radius, time window and precision) and the conv*_param.mem files of the
+sync_conv layers. Parameters missing in top.sv take the default values of the modules in HW/src_feature_extractor.'''
+
+# Modules of the pipeline in HW/src_feature_extractor
+MODULES = ('async_conv', 'async_maxpool', 'sync_conv_parallel', 'sync_conv', 'sync_maxpool', 'out_serialize')
+
+# Width of the bias at the end of every line of conv*_param.mem
+BIAS_BITS = 32
+
+
+def strip_comments(text):
+    '''Remove SystemVerilog comments.'''
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    return re.sub(r'//[^\n]*', '', text)
+
+
+def _matching(text, start):
+    '''Index of the bracket closing the one at text[start].'''
+    pairs = {'(': ')', '{': '}', '[': ']'}
+    stack = []
+    for index in range(start, len(text)):
+        if text[index] in pairs:
+            stack.append(pairs[text[index]])
+        elif stack and text[index] == stack[-1]:
+            stack.pop()
+            if not stack:
+                return index
+    raise ValueError(f'Unbalanced brackets at {start}')
+
+
+def _split(text, separator=','):
+    '''Split text on separators outside of brackets and strings.'''
+    parts, depth, string, start = [], 0, False, 0
+    for index, char in enumerate(text):
+        if char == '"':
+            string = not string
+        elif string:
+            continue
+        elif char in '({[':
+            depth += 1
+        elif char in ')}]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def evaluate(expression, scope):
+    '''Value of a parameter expression - integers, strings, names, negated names and {...} lists, None otherwise.'''
+    expression = expression.strip()
+    if re.fullmatch(r'-?\d+', expression):
+        return int(expression)
+    sized = re.fullmatch(r"(-?)(\d*)'([sS]?)([bdhoBDHO])([0-9a-fA-F_]+)", expression)
+    if sized:
+        base = {'b': 2, 'o': 8, 'd': 10, 'h': 16}[sized.group(4).lower()]
+        value = int(sized.group(5).replace('_', ''), base)
+        return -value if sized.group(1) else value
+    if re.fullmatch(r'"[^"]*"', expression):
+        return expression[1:-1]
+    if expression.startswith("'{") or expression.startswith('{'):
+        items = [evaluate(item, scope) for item in _split(expression[expression.index('{') + 1:-1])]
+        if any(isinstance(item, str) for item in items):
+            return ''.join(item for item in items if isinstance(item, str))
+        return items
+    name = re.fullmatch(r'(-?)\s*(\w+::)?(\w+)', expression)
+    if name and name.group(3) in scope:
+        value = scope[name.group(3)]
+        return -value if name.group(1) and value is not None else value
+    return None
+
+
+def parse_parameters(text, scope=None):
+    '''Values of the parameter and localparam declarations of a file (in declaration order).'''
+    values = {} if scope is None else scope
+    pattern = re.compile(r'\b(?:localparam|parameter)\s+(?:(?:int|string|logic|bit|signed|unsigned)\s+|\[[^\]]*\]\s*)*(\w+)\s*(?:\[[^\]]*\]\s*)*=')
+    for match in pattern.finditer(text):
+        start, end = match.end(), match.end()
+        while end < len(text) and text[end] not in ',;)':
+            end = _matching(text, end) + 1 if text[end] in '({[' else end + 1
+        values[match.group(1)] = evaluate(text[start:end], values)
+    return values
+
+
+def parse_instances(text, modules=MODULES):
+    '''Instances of the modules in order of appearance as (module, name, parameters, ports) with unevaluated parameters.'''
+    instances = []
+    pattern = re.compile(r'\b(' + '|'.join(modules) + r')\s*(#\s*\(|\w+\s*\()')
+    for match in pattern.finditer(text):
+        '''Instances without a parameter list use the defaults of the module.'''
+        if match.group(2).startswith('#'):
+            parameters_start, parameters_end = match.end(), _matching(text, match.end() - 1)
+        else:
+            parameters_start = parameters_end = match.start(2) - 1
+        name = re.match(r'\s*(\w+)\s*\(', text[parameters_end + 1:])
+        ports_start = parameters_end + 1 + name.end() - 1
+        ports_end = _matching(text, ports_start)
+
+        instance = [match.group(1), name.group(1)]
+        for block in (text[parameters_start:parameters_end], text[ports_start + 1:ports_end]):
+            connections = (re.fullmatch(r'\.(\w+)\s*\((.*)\)', item, flags=re.S) for item in _split(block))
+            instance.append({connection.group(1): connection.group(2).strip() for connection in connections if connection})
+        instances.append(tuple(instance))
+    return instances
+
+
+def module_parameters(source_dir, module):
+    '''Unevaluated default parameters of a module in declaration order.'''
+    with open(os.path.join(source_dir, module + '.sv')) as fp:
+        text = strip_comments(fp.read())
+    header = re.search(r'\bmodule\s+' + module + r'\s*#\s*\(', text)
+    header = text[header.end():_matching(text, header.end() - 1)]
+
+    defaults = {}
+    for item in _split(header):
+        declaration = re.fullmatch(r'parameter\s+(?:(?:int|string|logic|bit)\s+)?(\w+)\s*(?:\[[^\]]*\]\s*)*=\s*(.*)', item, flags=re.S)
+        if declaration:
+            defaults[declaration.group(1)] = declaration.group(2)
+    return defaults
+
+
+def read_mem(path, input_dim, field_bits=8):
+    '''Raw weights (output_dim, input_dim + 3) and signed biases (output_dim,) of a conv*_param.mem file.'''
+    '''Every line holds the weights of a single output channel, weight w at bits [field_bits * (w + 1) + 31 : field_bits * w + 32]
+    (input features, then relative x, y and t positions) and the two's complement bias in the lowest 32 bits.'''
+    with open(path) as fp:
+        lines = [line.strip() for line in fp if line.strip()]
+    values = [int(line, 16) for line in lines]
+
+    shifts = BIAS_BITS + field_bits * np.arange(input_dim + 3)
+    weights = np.array([[(value >> int(shift)) & ((1 << field_bits) - 1) for shift in shifts] for value in values], dtype=np.int64)
+    biases = np.array([value & ((1 << BIAS_BITS) - 1) for value in values], dtype=np.int64)
+    biases = np.where(biases >= 1 << (BIAS_BITS - 1), biases - (1 << BIAS_BITS), biases)
+    return weights, biases
+
+
+def wrap(values, bits, signed=False):
+    '''Values truncated to a bits wide register.'''
+    values = np.bitwise_and(np.asarray(values, dtype=np.int64), (1 << bits) - 1)
+    if signed:
+        values = np.where(values >= 1 << (bits - 1), values - (1 << bits), values)
+    return values
+
+
+class HWConfig:
+    '''Parameters and weights of a HW configuration.'''
+    def __init__(self, path, source_dir=None):
+        self.path = os.path.normpath(path)
+        self.name = os.path.basename(self.path)
+        if source_dir is None:
+            source_dir = os.path.join(os.path.dirname(os.path.dirname(self.path)), 'src_feature_extractor')
+        self.source_dir = source_dir
+
+        '''Graph parameters of graph_pkg.sv (grapth_pkg.sv in some configurations).'''
+        package = [name for name in ('graph_pkg.sv', 'grapth_pkg.sv') if os.path.exists(os.path.join(self.path, name))]
+        if not package:
+            raise FileNotFoundError(f'No graph_pkg.sv in {self.path}')
+        with open(os.path.join(self.path, package[0])) as fp:
+            self.package = parse_parameters(strip_comments(fp.read()))
+        self.graph_size = self.package['GRAPH_SIZE']
+        self.radius = self.package['RADIUS']
+        self.time_window = self.package['TIME_WINDOW']
+        self.precision = self.package['PRECISION']
+
+        with open(os.path.join(self.path, 'top.sv')) as fp:
+            self.text = strip_comments(fp.read())
+        self.parameters = parse_parameters(self.text, dict(self.package))
+        self.max_x = self.parameters['MAX_X_COORD']
+        self.max_y = self.parameters['MAX_Y_COORD']
+
+        '''Features of events at x = 0, y = 0 with polarity 0 are set to zero before the first pooling (flush events).'''
+        self.trigger = 'is_trigger' in self.text
+
+        self.layers = [self._layer(*instance) for instance in parse_instances(self.text)]
+
+    def _instance_parameters(self, module, parameters):
+        '''Parameters of an instance - values set in top.sv, then defaults of the module.'''
+        values = {name: evaluate(value, self.parameters) for name, value in parameters.items()}
+        for name, value in module_parameters(self.source_dir, module).items():
+            if name not in values:
+                values[name] = evaluate(value, {**self.package, **values})
+        return values
+
+    def _layer(self, module, name, parameters, ports):
+        parameters = self._instance_parameters(module, parameters)
+        if module == 'async_conv':
+            return self._async_conv(name, parameters, ports)
+        if module in ('sync_conv', 'sync_conv_parallel'):
+            return self._sync_conv(module, name, parameters)
+        if module in ('async_maxpool', 'sync_maxpool'):
+            return {'name': name, 'type': module, 'in_size': parameters['IN_GRAPH_SIZE'], 'out_size': parameters['OUT_GRAPH_SIZE']}
+        return {'name': name, 'type': module, 'graph_size': parameters['GRAPH_SIZE'], 'zero_point': parameters['ZERO_POINT'],
+                'input_dim': parameters['INPUT_DIM']}
+
+    def _async_conv(self, name, parameters, ports):
+        '''Weights and biases are constant arrays of top.sv, declared with descending ranges ([15:0][3:0]).'''
+        rows = re.findall(r'\b' + re.escape(ports['weights']) + r"\[(\d+)\]\s*<?=\s*'?\{([^}]*)\}", self.text)
+        weight = np.zeros((len(rows), parameters['INPUT_DIM']), dtype=np.int64)
+        for row, values in rows:
+            weight[int(row)] = [int(value) for value in _split(values)][::-1]
+
+        bias = re.search(r'\b' + re.escape(ports['bias']) + r"\s*\[[^\]]*\]\s*=\s*'?\{([^}]*)\}", self.text)
+        bias = np.array([int(value) for value in _split(bias.group(1))][::-1], dtype=np.int64)
+        if weight.shape[0] != parameters['OUTPUT_DIM'] or bias.shape[0] != parameters['OUTPUT_DIM']:
+            raise ValueError(f'{self.name}/{name}: expected {parameters["OUTPUT_DIM"]} output channels')
+
+        return {'name': name, 'type': 'async_conv',
+                'weight': wrap(weight, self.precision + 1, signed=True), 'bias': bias,
+                'multiplier': parameters['MULTIPLIER_OUT'], 'zero_point': parameters['ZERO_POINT'],
+                'scale_in': list(parameters['SCALE_IN'])[::-1]}
+
+    def _sync_conv(self, module, name, parameters):
+        '''sync_conv stores 8-bit weights in the .mem files, sync_conv_parallel PRECISION-bit weights.'''
+        input_dim, output_dim = parameters['INPUT_DIM'], parameters['OUTPUT_DIM']
+        field_bits = parameters['PRECISION'] if module == 'sync_conv_parallel' else 8
+        weight, bias = read_mem(os.path.join(self.path, os.path.basename(parameters['INIT_PATH'])), input_dim, field_bits)
+        if weight.shape[0] != output_dim:
+            raise ValueError(f'{self.name}/{name}: {weight.shape[0]} lines in {parameters["INIT_PATH"]}, expected {output_dim}')
+
+        return {'name': name, 'type': 'sync_conv', 'module': module, 'graph_size': parameters['GRAPH_SIZE'],
+                'parallel_mul': parameters['PARALLEL_MUL'] if module == 'sync_conv_parallel' else 1,
+                'weight': wrap(weight - parameters['ZERO_POINT_WEIGHT'], self.precision + 1, signed=True), 'bias': bias,
+                'zero_point_in': parameters['ZERO_POINT_IN'], 'zero_point_out': parameters['ZERO_POINT_OUT'],
+                'multiplier': parameters['MULTIPLIER_OUT'],
+                'scale_in': parameters['SCALE_IN'], 'scale_in_neg': parameters.get('SCALE_IN_NEG', parameters['SCALE_IN']),
+                'rounding': not parameters.get('USE_DSP', 0)}
+
+    def __repr__(self):
+        layers = ', '.join(layer['name'] for layer in self.layers)
+        return f"{self.__class__.__name__}({self.name}, graph_size={self.graph_size}, radius={self.radius}, time_window={self.time_window}, layers=[{layers}])"
+
+
+def load_config(path, source_dir=None):
+    '''Read a HW configuration directory (e.g. HW/configs/Small_100ms_128).'''
+    return HWConfig(path, source_dir)
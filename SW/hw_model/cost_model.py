@@ -0,0 +1,265 @@
+import numpy as np
+from collections import deque
+
+from hw_model.config import load_config
+
+'''Cycle-level cost model of the HW feature extractor (HW/src_feature_extractor).'''
+'''Only the timing of the pipeline is modelled, not the features. edges_gen reads one event from its input FIFO every
+MEMORY_OPS_NUM cycles and async_conv and async_maxpool process the events in lockstep with it. async_maxpool switches
+its feature memory when the pooled time slice of an event differs from the previous one, and every switch starts the
+next layer. The sync layers are data independent - sync_conv scans all GRAPH_SIZE ** 2 cells with 9 edges for every
+output channel (PARALLEL_MUL channels at a time in sync_conv_parallel) and cleans the oldest memory, sync_maxpool switches
+after POOL_SIZE buffers of its input and out_serialize reads all cells of a buffer. A layer switched while it is still
+busy stops the RTL simulation (CONVOLUTION THROUGHPUT IS TOO SMALL), the model queues the buffer and counts an overrun.
+Cycle counts follow the counters of the RTL, the latencies of the pipeline registers are approximate.'''
+
+# Clock of the programmable logic (top_synth.v)
+CLOCK_HZ = 200e6
+
+# Depth of the input FIFO of edges_gen (fifo_generator_0)
+FIFO_DEPTH = 1024
+
+# Cycles from the last read of an event in edges_gen to the switch of async_maxpool (delay modules of edges_gen,
+# output of async_conv and the delayed pointer of async_maxpool)
+ASYNC_LATENCY = 15 + 19 + 5
+
+# Cycles from the end of a layer to the switch of the next one (delayed pointer and the register of feature_memory)
+SYNC_CONV_LATENCY = 10 + 1
+SYNC_MAXPOOL_LATENCY = 5 + 1
+OUT_SERIALIZE_LATENCY = 3
+
+# Feature memories between two layers - one written, two read (current and previous time slice)
+NUM_MEMORIES = 3
+
+
+def percentiles(values, points=(50, 90, 99)):
+    '''Percentiles, mean and max of values (None if empty).'''
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return None
+    result = {f'p{p}': float(np.percentile(values, p)) for p in points}
+    result.update({'mean': float(values.mean()), 'max': float(values.max())})
+    return result
+
+
+def window_buffers(t, pool_size):
+    '''Buffer of every event of a window as in async_maxpool (hw_model/pipeline.py) and the number of buffers.'''
+    slices = np.asarray(t, dtype=np.int64) // pool_size
+    ranks = np.cumsum(slices != np.concatenate(([0], slices[:-1])))
+    return ranks, int(ranks[-1]) + 1 if ranks.size > 0 else 1
+
+
+class HWCostModel:
+    '''Timing of a HW configuration (hw_model/config.py) for a stream of time windows.'''
+    def __init__(self, config, clock_hz=CLOCK_HZ, fifo_depth=FIFO_DEPTH):
+        self.config = config
+        self.clock_hz = clock_hz
+        self.fifo_depth = fifo_depth
+
+        '''edges_gen needs MEMORY_OPS_NUM cycles for every event and clears half of the context per cycle at the end of a window.'''
+        self.memory_ops = config.package['MEMORY_OPS_NUM']
+        self.reset_cycles = config.graph_size ** 2 // 2 + 1
+
+        async_maxpool = [layer for layer in config.layers if layer['type'] == 'async_maxpool']
+        if not async_maxpool:
+            raise ValueError(f'{config.name}: the pipeline has no async_maxpool')
+        self.pool_size = async_maxpool[0]['in_size'] // async_maxpool[0]['out_size']
+        self.stages = [self._stage(layer) for layer in config.layers if layer['type'] in ('sync_conv', 'sync_maxpool', 'out_serialize')]
+
+        '''Windows are padded to a multiple of the buffers pooled by the sync_maxpool layers, so every window ends with an output.'''
+        self.group = int(np.prod([stage['pool'] for stage in self.stages if stage['type'] == 'sync_maxpool']))
+
+        # Buffers of async_maxpool for every buffer of a layer
+        pooled = 1
+        for stage in self.stages:
+            stage['pooled'] = pooled
+            pooled *= stage['pool']
+
+    @classmethod
+    def from_config(cls, path, source_dir=None, **kwargs):
+        return cls(load_config(path, source_dir), **kwargs)
+
+    def _stage(self, layer):
+        '''Cycles of a layer for every buffer - processing (until the switch of the next layer) and cleaning.'''
+        stage = {'name': layer['name'], 'type': layer['type'], 'cycles': 0, 'zero': 0, 'pool': 1}
+        if layer['type'] == 'sync_conv':
+            cells, output_dim = layer['graph_size'] ** 2, layer['weight'].shape[0]
+            parallel = layer['parallel_mul']
+            if layer['module'] == 'sync_conv_parallel':
+                # Weights of PARALLEL_MUL channels are loaded before every scan of the cells
+                stage['cycles'] = output_dim // parallel * (parallel + cells * 9)
+            else:
+                stage['cycles'] = cells * 9 * output_dim
+            stage.update({'zero': cells, 'latency': SYNC_CONV_LATENCY})
+        elif layer['type'] == 'sync_maxpool':
+            # Cells are pooled while the previous layer writes them
+            stage.update({'pool': layer['in_size'] // layer['out_size'], 'latency': SYNC_MAXPOOL_LATENCY})
+        else:
+            cells = layer['graph_size'] ** 2
+            stage.update({'cycles': cells * layer['input_dim'], 'zero': cells, 'latency': OUT_SERIALIZE_LATENCY})
+        return stage
+
+    def reset(self):
+        '''Start a new stream with an idle pipeline.'''
+        self.ready = 0.0
+        self.state = [{'free': 0.0, 'starts': deque(maxlen=NUM_MEMORIES + 1), 'switches': 0} for _ in self.stages]
+
+    def _edges_gen(self, arrivals, droppable):
+        '''First read cycle of every event (NaN if dropped) and the occupancy of the FIFO at its arrival.'''
+        ops, count = self.memory_ops, arrivals.size
+        index = np.arange(count)
+
+        # Without drops start[i] = max(ready + ops * i, arrival[j] + ops * (i - j) for j <= i), a running max
+        start = ops * index + np.maximum(self.ready, np.maximum.accumulate(arrivals - ops * index))
+        occupancy = index - np.minimum(np.searchsorted(start, arrivals, side='right'), index)
+        if occupancy.max(initial=0) < self.fifo_depth:
+            return start, occupancy
+
+        '''Events arriving at a full FIFO are lost, the queue is replayed event by event.'''
+        start = np.full(count, np.nan)
+        occupancy = np.zeros(count, dtype=np.int64)
+        queue, last = deque(), self.ready - ops
+        for i in range(count):
+            while queue and queue[0] <= arrivals[i]:
+                queue.popleft()
+            occupancy[i] = len(queue)
+            if occupancy[i] >= self.fifo_depth and droppable[i]:
+                continue
+            last = max(arrivals[i], last + ops)
+            start[i] = last
+            queue.append(last)
+        return start, occupancy
+
+    def window(self, t, arrivals, start, duration):
+        '''Timing of a window - t are the graph timestamps of its events, arrivals and the window in us.'''
+        cycles = self.clock_hz / 1e6
+        end = (start + duration) * cycles
+        ranks, num_buffers = window_buffers(t, self.pool_size)
+
+        '''The window is closed by trigger events at its end (one for each buffer up to a multiple of the pooled buffers),
+        the last one opens the first buffer of the next window.'''
+        padded = -(-num_buffers // self.group) * self.group
+        num_triggers = padded - num_buffers + 1
+        arrivals = np.concatenate(((start + np.asarray(arrivals, dtype=np.float64)) * cycles, np.full(num_triggers, end)))
+        ranks = np.concatenate((ranks, np.arange(num_buffers, padded + 1)))
+        droppable = np.arange(arrivals.size) < arrivals.size - num_triggers
+
+        reads, occupancy = self._edges_gen(arrivals, droppable)
+        served = ~np.isnan(reads)
+
+        # Context of edges_gen is cleared after the last event of the window
+        self.ready = reads[served][-1] + self.memory_ops + self.reset_cycles
+
+        '''Buffer r is switched when the first served event of a later buffer reaches async_maxpool.'''
+        first = np.full(padded + 1, np.inf)
+        np.minimum.at(first, ranks[served], reads[served])
+        switches = np.minimum.accumulate(first[::-1])[::-1][1:] + self.memory_ops + ASYNC_LATENCY
+
+        stages = []
+        for stage, state in zip(self.stages, self.state):
+            report = {'name': stage['name'], 'busy': 0.0, 'overruns': 0, 'max_waiting': 0, 'wait': []}
+            if stage['type'] == 'sync_maxpool':
+                # Every pool_size-th switch of the input switches the output
+                counts = state['switches'] + np.arange(1, switches.size + 1)
+                state['switches'] += switches.size
+                outputs = switches[counts % stage['pool'] == 0] + stage['latency']
+            else:
+                outputs = []
+                for switch in switches:
+                    begin = max(switch, state['free'])
+                    report['overruns'] += int(switch < state['free'])
+                    state['starts'].append(begin)
+                    # Buffers written to the feature memory and not read yet
+                    report['max_waiting'] = max(report['max_waiting'], sum(previous > switch for previous in state['starts']))
+                    report['wait'].append(begin - switch)
+                    report['busy'] += stage['cycles'] + stage['zero']
+                    outputs.append(begin + stage['cycles'] + stage['latency'])
+                    state['free'] = begin + stage['cycles'] + stage['zero']
+                outputs = np.array(outputs)
+            stages.append(report)
+            switches = outputs
+
+        return {'events': int(t.size if isinstance(t, np.ndarray) else len(t)), 'buffers': num_buffers, 'triggers': num_triggers,
+                'dropped': int((~served & droppable).sum()), 'fifo_max': int(occupancy.max(initial=0)),
+                'fifo': occupancy[droppable], 'latency': (switches[-1] - end) / cycles if switches.size > 0 else np.nan,
+                'edges_gen_busy': float(served.sum() * self.memory_ops + self.reset_cycles), 'stages': stages,
+                'end': end}
+
+    def simulate(self, windows):
+        '''Report of a stream of windows given as (t, arrivals, duration), arrivals and durations in us.'''
+        '''Windows follow each other without gaps and the pipeline starts idle.'''
+        self.reset()
+        results, start = [], 0.0
+        for t, arrivals, duration in windows:
+            results.append(self.window(np.asarray(t), arrivals, start, duration))
+            start += duration
+        return self.report(results, start)
+
+    def report(self, results, total):
+        '''Latency distribution, event rates, load of the layers and buffer occupancy of the simulated windows.'''
+        cycles = total * self.clock_hz / 1e6
+        events = sum(result['events'] for result in results)
+        served = events - sum(result['dropped'] for result in results)
+        edges_gen_busy = sum(result['edges_gen_busy'] for result in results)
+
+        # Buffers of async_maxpool in the padded windows
+        buffers = np.mean([-(-result['buffers'] // self.group) * self.group for result in results]) if results else 0
+
+        stages = []
+        for index, stage in enumerate(self.stages):
+            if stage['type'] == 'sync_maxpool':
+                continue
+            reports = [result['stages'][index] for result in results]
+            busy = sum(report['busy'] for report in reports)
+            stages.append({'name': stage['name'], 'cycles_per_buffer': int(stage['cycles'] + stage['zero']),
+                           'cycles_per_window': float(buffers / stage['pooled'] * (stage['cycles'] + stage['zero'])),
+                           'load': busy / cycles if cycles > 0 else None,
+                           'overruns': sum(report['overruns'] for report in reports),
+                           'memories_needed': NUM_MEMORIES + max(report['max_waiting'] for report in reports),
+                           'wait_us': percentiles(np.concatenate([report['wait'] for report in reports]) / self.clock_hz * 1e6)})
+
+        fifo = np.concatenate([result['fifo'] for result in results]) if results else np.zeros(0)
+        latency = [result['latency'] for result in results]
+        report = {'config': self.config.name, 'clock_mhz': self.clock_hz / 1e6, 'windows': len(results), 'events': events,
+                  'time_window_us': self.config.time_window, 'stream_us': total,
+                  'latency_us': percentiles(latency),
+                  'event_rate': events / total * 1e6 if total > 0 else None,
+                  'peak_event_rate': self.clock_hz / self.memory_ops,
+                  'sustained_event_rate': served / edges_gen_busy * self.clock_hz if edges_gen_busy > 0 else None,
+                  'edges_gen_load': edges_gen_busy / cycles if cycles > 0 else None,
+                  'buffers_per_window': percentiles([result['buffers'] for result in results]),
+                  'fifo': {'depth': self.fifo_depth, 'occupancy': percentiles(fifo),
+                           'dropped': sum(result['dropped'] for result in results)},
+                  'stages': stages}
+
+        '''Shortest window the slowest sync layer keeps up with, for windows with the mean number of buffers.'''
+        slowest = max(stages, key=lambda stage: stage['cycles_per_window'], default=None)
+        if slowest is not None:
+            report['bottleneck'] = slowest['name']
+            report['min_window_us'] = slowest['cycles_per_window'] / self.clock_hz * 1e6
+        return report
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.config.name}, clock_hz={self.clock_hz:g}, fifo_depth={self.fifo_depth})"
+
+
+def print_report(report):
+    def value(stats, key, fmt='.1f'):
+        return format(stats[key], fmt) if stats is not None else '-'
+
+    latency = report['latency_us']
+    print(f"\n{report['config']}: {report['windows']} windows of {report['time_window_us'] / 1000:g} ms, {report['events']} events"
+          f" ({report['event_rate'] / 1e6:.3f} Mev/s in)")
+    print(f"  latency after the window [us]  p50 {value(latency, 'p50')}  p90 {value(latency, 'p90')}"
+          f"  p99 {value(latency, 'p99')}  max {value(latency, 'max')}")
+    print(f"  event rate [Mev/s]             peak {report['peak_event_rate'] / 1e6:.3f}"
+          f"  sustained {report['sustained_event_rate'] / 1e6:.3f}  edges_gen load {report['edges_gen_load']:.1%}")
+    fifo = report['fifo']
+    print(f"  FIFO occupancy (depth {fifo['depth']})    p50 {value(fifo['occupancy'], 'p50', '.0f')}"
+          f"  p99 {value(fifo['occupancy'], 'p99', '.0f')}  max {value(fifo['occupancy'], 'max', '.0f')}  dropped {fifo['dropped']}")
+    print(f"  {'layer':<18}{'cycles/buffer':>14}{'load':>8}{'overruns':>10}{'memories':>10}{'wait p99 [us]':>15}")
+    for stage in report['stages']:
+        print(f"  {stage['name']:<18}{stage['cycles_per_buffer']:>14}{stage['load']:>8.1%}{stage['overruns']:>10}"
+              f"{stage['memories_needed']:>10}{value(stage['wait_us'], 'p99'):>15}")
+    if 'bottleneck' in report:
+        print(f"  bottleneck {report['bottleneck']}, shortest window {report['min_window_us'] / 1000:.2f} ms")
@@ -0,0 +1,259 @@
+import numpy as np
+
+from networks.layers.graph_gen import GraphGen
+from runtime.numpy_efgcn import segment_max
+from hw_model.config import load_config, wrap
+
+'''Bit-accurate model of the HW feature extractor (HW/src_feature_extractor) on NumPy arrays.'''
+'''Events go through async_conv (one output for every event and its edges), async_maxpool (events are pooled to
+cells of a buffer, a new buffer is started whenever the pooled time slice changes), the sync_conv and sync_maxpool
+layers (every buffer is processed with the previous one as the older time slice) and out_serialize. Buffers are
+flat memories of feature vectors with an 18-bit edge mask per address - bit (dy + 1) * 3 + (dx + 1) marks a neighbour
+cell in the same buffer, the same bit + 9 a neighbour in the previous buffer and bit 4 an occupied cell. All buffers
+are processed at the end of the time window.'''
+
+# Relative (dx, dy) cell positions in the order of the edge mask bits
+NEIGHBOURS = np.stack(np.meshgrid(np.arange(-1, 2), np.arange(-1, 2), indexing='xy'), axis=-1).reshape(-1, 2)
+NUM_BITS = 18
+SELF_BIT = 4
+
+
+def requantize(acc, multiplier, zero_point, precision, rounding=True):
+    '''Output of the HW multipliers - (acc * multiplier) >> 32 (rounded half up) plus the zero point on precision bits.'''
+    product = acc * multiplier
+    if rounding:
+        product = product + (1 << 31)
+    return wrap((product >> 32) + zero_point, precision)
+
+
+def set_bits(masks, keys, bits):
+    '''masks[keys] |= 1 << bits, keys may repeat.'''
+    pairs = np.unique(keys * NUM_BITS + bits)
+    keys, bits = pairs // NUM_BITS, pairs % NUM_BITS
+    for bit in np.unique(bits):
+        masks[keys[bits == bit]] |= 1 << int(bit)
+
+
+def resize(buffers, masks, size):
+    '''Buffers of a memory read with size addresses (unwritten addresses are zero).'''
+    if buffers.shape[1] >= size:
+        return buffers[:, :size], masks[:, :size]
+    padding = size - buffers.shape[1]
+    return np.pad(buffers, ((0, 0), (0, padding), (0, 0))), np.pad(masks, ((0, 0), (0, padding)))
+
+
+class HWPipeline:
+    '''Feature extractor of a HW configuration (hw_model/config.py).'''
+    def __init__(self, config):
+        self.config = config
+        self.layers = config.layers
+        self.precision = config.precision
+        self.dtype = np.uint8 if config.precision <= 8 else np.uint16
+        if not self.layers or self.layers[0]['type'] != 'async_conv':
+            raise ValueError(f'{config.name}: the pipeline has to start with async_conv')
+
+        '''Graph generation of edges_gen.sv.'''
+        self.graph_gen = GraphGen(r=config.radius, dimension_XY=config.graph_size, self_loop=True, hw_context=True,
+                                  max_edges=config.package.get('MAX_EDGES'))
+
+        '''Outputs of async_conv for every edge type (neighbour polarity and relative position).'''
+        self.lut = self._async_conv_lut(self.layers[0])
+
+    @classmethod
+    def from_config(cls, path, source_dir=None):
+        return cls(load_config(path, source_dir))
+
+    def normalize(self, x, y, timestamp, polarity):
+        '''Sensor events (timestamps in us) in graph coordinates [x, y, t, p] as in normalize.sv.'''
+        config = self.config
+        bits = (config.graph_size - 1).bit_length()
+        x = wrap(np.asarray(x, dtype=np.int64) * config.graph_size // config.max_x, bits)
+        y = wrap(np.asarray(y, dtype=np.int64) * config.graph_size // config.max_y, bits)
+        t = wrap(np.asarray(timestamp, dtype=np.int64) % config.time_window * config.graph_size // config.time_window, bits)
+        return np.column_stack((x, y, t, np.asarray(polarity) > 0)).astype(np.int64)
+
+    def build_graph(self, events):
+        '''Edges (source, neighbour) of the events, the self loop first.'''
+        return self.graph_gen.build(events)[2].numpy().astype(np.int64)
+
+    def forward(self, events, edges=None, return_stages=False):
+        '''Output features (graph_size ** 3, channels) of out_serialize for the [x, y, t, p] events of a time window.'''
+        '''Positive polarities are 1, others (0 or -1) are 0. The outputs of all layers are returned as well with
+        return_stages - features of every event after async_conv, (features, masks) of the buffers after the others.'''
+        events = np.array(events, dtype=np.int64).reshape(-1, 4)
+        events[:, 3] = events[:, 3] > 0
+        edges = self.build_graph(events) if edges is None else np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        stages, output = {}, None
+        for layer in self.layers:
+            if layer['type'] == 'async_conv':
+                output = self._async_conv(layer, events, edges)
+            elif layer['type'] == 'async_maxpool':
+                output = self._async_maxpool(layer, events, edges, output)
+            elif layer['type'] == 'sync_conv':
+                output = self._sync_conv(layer, *output)
+            elif layer['type'] == 'sync_maxpool':
+                output = self._sync_maxpool(layer, *output)
+            elif layer['type'] == 'out_serialize':
+                output = self._out_serialize(layer, *output)
+            else:
+                raise ValueError(f"Unknown layer type {layer['type']}")
+            stages[layer['name']] = output
+
+        return (output, stages) if return_stages else output
+
+    def _async_conv_lut(self, layer):
+        '''async_conv output for every (neighbour polarity, dx, dy, dt), positions are relative to the event.'''
+        radius = self.config.radius
+        scale = np.array([0] + list(layer['scale_in']), dtype=np.int64)
+        if radius >= scale.size:
+            raise ValueError(f'{self.config.name}: async_conv has input scales only up to radius {scale.size - 1}')
+
+        offsets = np.arange(-radius, radius + 1)
+        p, dx, dy, dt = np.meshgrid(np.arange(2), offsets, offsets, np.arange(radius + 1), indexing='ij')
+        inputs = np.stack((np.where(p == 1, scale[1], -scale[1]),
+                           np.sign(dx) * scale[np.abs(dx)],
+                           np.sign(dy) * scale[np.abs(dy)],
+                           -scale[dt]), axis=-1).reshape(-1, 4)
+        inputs = wrap(inputs, self.precision + 1, signed=True)
+
+        acc = wrap(inputs @ layer['weight'].T, 32, signed=True) + layer['bias']
+        return requantize(acc, layer['multiplier'], layer['zero_point'], self.precision)
+
+    def _async_conv(self, layer, events, edges):
+        '''Max of the outputs over the edges of every event and the zero point (ReLU).'''
+        radius, size = self.config.radius, 2 * self.config.radius + 1
+        source, neighbour = edges[:, 0], edges[:, 1]
+        dx = events[neighbour, 0] - events[source, 0]
+        dy = events[neighbour, 1] - events[source, 1]
+        dt = events[source, 2] - events[neighbour, 2]
+        index = ((events[neighbour, 3] * size + dx + radius) * size + dy + radius) * (radius + 1) + dt
+
+        features = np.full((events.shape[0], self.lut.shape[1]), layer['zero_point'], dtype=self.dtype)
+        if edges.shape[0] > 0:
+            messages, nodes = segment_max(self.lut[index], source)
+            features[nodes] = np.maximum(features[nodes], messages)
+
+        '''Events at x = 0, y = 0 with polarity 0 trigger the processing of the buffers and carry no features.'''
+        if self.config.trigger:
+            features[(events[:, 0] == 0) & (events[:, 1] == 0) & (events[:, 3] == 0)] = 0
+        return features
+
+    def _async_maxpool(self, layer, events, edges, features):
+        '''Max of the event features in every cell and the edges of the cells.'''
+        pool, out_size = layer['in_size'] // layer['out_size'], layer['out_size']
+        x, y, t = events[:, 0], events[:, 1], events[:, 2]
+
+        '''The buffer is switched when the time slice differs from the previous event (starting from slice 0).'''
+        slices = t // pool
+        ranks = np.cumsum(slices != np.concatenate(([0], slices[:-1])))
+        num_ranks = int(ranks[-1]) + 1 if ranks.size > 0 else 1
+
+        buffers = np.zeros((num_ranks, out_size * out_size, features.shape[1]), dtype=self.dtype)
+        masks = np.zeros((num_ranks, out_size * out_size), dtype=np.int64)
+        keys = ranks * out_size * out_size + (y // pool) * out_size + x // pool
+        if keys.size > 0:
+            pooled, cells = segment_max(features, keys)
+            buffers.reshape(-1, features.shape[1])[cells] = pooled
+            masks.reshape(-1)[cells] = 1 << SELF_BIT
+
+        '''Edges to other events, neighbours in another time slice set the bits of the previous buffer.'''
+        source, neighbour = edges[edges[:, 0] != edges[:, 1]].T
+        dx = wrap(x[neighbour] // pool - x[source] // pool, 2, signed=True)
+        dy = wrap(y[neighbour] // pool - y[source] // pool, 2, signed=True)
+        bits = (slices[neighbour] != slices[source]) * 9 + (dy + 1) * 3 + dx + 1
+        set_bits(masks.reshape(-1), keys[source], bits)
+        return buffers, masks
+
+    def _sync_conv(self, layer, buffers, masks):
+        '''Graph convolution of every occupied cell with the neighbours of its edge mask.'''
+        graph_size, precision = layer['graph_size'], self.precision
+        buffers, masks = resize(buffers, masks, graph_size * graph_size)
+        input_dim = buffers.shape[2]
+        weight, bias = layer['weight'], layer['bias']
+        feature_weight = weight[:, :input_dim].T.astype(np.float64)
+        scale, scale_neg = layer['scale_in'], layer['scale_in_neg']
+
+        ranks, addresses = np.nonzero(masks)
+        cell_masks = masks[ranks, addresses]
+        x, y = addresses % graph_size, addresses // graph_size
+        features = np.full((ranks.size, weight.shape[0]), layer['zero_point_out'], dtype=np.int64)
+
+        for bit in range(NUM_BITS):
+            selected = np.flatnonzero((cell_masks >> bit) & 1)
+            if selected.size == 0:
+                continue
+
+            '''Neighbour addresses wrap around the graph, the previous buffer of the first one is empty.'''
+            dx, dy = NEIGHBOURS[bit % 9]
+            neighbours = ((y[selected] + dy) % graph_size) * graph_size + (x[selected] + dx) % graph_size
+            source = ranks[selected] - (bit >= 9)
+            inputs = np.where((source >= 0)[:, None], buffers[np.maximum(source, 0), neighbours], 0)
+            inputs = wrap(inputs.astype(np.int64) - layer['zero_point_in'], precision + 1, signed=True)
+
+            positions = np.array([scale if dx > 0 else -scale_neg if dx < 0 else 0,
+                                  scale if dy > 0 else -scale_neg if dy < 0 else 0,
+                                  -scale_neg if bit >= 9 else 0])
+            positions = wrap(positions, precision + 1, signed=True)
+
+            # Accumulators are below 2**53, so the float64 product is exact
+            acc = (inputs.astype(np.float64) @ feature_weight).astype(np.int64) + weight[:, input_dim:] @ positions + bias
+            if layer['rounding']:
+                acc = wrap(acc, 32, signed=True)
+            messages = requantize(acc, layer['multiplier'], layer['zero_point_out'], precision, layer['rounding'])
+            features[selected] = np.maximum(features[selected], messages)
+
+        '''Every address is written, empty cells hold the output zero point.'''
+        output = np.full((buffers.shape[0], graph_size * graph_size, weight.shape[0]), layer['zero_point_out'], dtype=self.dtype)
+        output[ranks, addresses] = features
+        return output, masks
+
+    def _sync_maxpool(self, layer, buffers, masks):
+        '''Max of the occupied cells of pool_size consecutive buffers and the edges of the pooled cells.'''
+        in_size, out_size = layer['in_size'], layer['out_size']
+        pool = in_size // out_size
+        num_ranks = -(-buffers.shape[0] // pool)
+
+        ranks, addresses = np.nonzero(masks & (1 << SELF_BIT))
+        cell_masks = masks[ranks, addresses]
+        addresses = addresses % (in_size * in_size)
+        x, y = addresses % in_size, addresses // in_size
+        keys = (ranks // pool) * out_size * out_size + (y // pool) * out_size + x // pool
+
+        output = np.zeros((num_ranks, out_size * out_size, buffers.shape[2]), dtype=self.dtype)
+        output_masks = np.zeros((num_ranks, out_size * out_size), dtype=np.int64)
+        if keys.size > 0:
+            pooled, cells = segment_max(buffers[ranks, addresses], keys)
+            output.reshape(-1, buffers.shape[2])[cells] = pooled
+            output_masks.reshape(-1)[cells] = 1 << SELF_BIT
+
+        '''Edges of the previous buffer stay in the same output buffer except for the first buffer of every pool.'''
+        for bit in range(NUM_BITS):
+            selected = np.flatnonzero((cell_masks >> bit) & 1) if bit != SELF_BIT else np.zeros(0, dtype=np.int64)
+            if selected.size == 0:
+                continue
+            dx, dy = NEIGHBOURS[bit % 9]
+            diff_x = wrap((x[selected] + dx) % in_size // pool - x[selected] // pool, 2, signed=True)
+            diff_y = wrap((y[selected] + dy) % in_size // pool - y[selected] // pool, 2, signed=True)
+            bits = (diff_y + 1) * 3 + diff_x + 1
+            if bit >= 9:
+                bits = bits + 9 * (ranks[selected] % pool == 0)
+            bits = wrap(bits, 6)
+            valid = bits < NUM_BITS
+            set_bits(output_masks.reshape(-1), keys[selected][valid], bits[valid])
+        return output, output_masks
+
+    def _out_serialize(self, layer, buffers, masks):
+        '''Dense (x, y, t) grid of the last graph_size buffers, unwritten cells hold the zero point.'''
+        graph_size, zero_point = layer['graph_size'], layer['zero_point']
+        buffers = resize(buffers, masks, graph_size * graph_size)[0]
+        addresses = np.arange(graph_size * graph_size)
+        cells = (addresses % graph_size * graph_size + addresses // graph_size) * graph_size
+
+        output = np.full((graph_size ** 3, buffers.shape[2]), zero_point, dtype=self.dtype)
+        for rank, buffer in enumerate(buffers):
+            output[cells + rank % graph_size] = np.maximum(buffer, zero_point)
+        return output
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.config.name})"
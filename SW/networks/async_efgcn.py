@@ -0,0 +1,116 @@
+import numpy as np
+import torch
+from torch.nn import Module
+
+from networks.efgcn import EFGCN
+from networks.layers.graph_gen import GraphGen
+
+
+class AsyncEFGCN(Module):
+    '''Event-driven inference of a frozen quantized EFGCN (after calibration and freeze).
+
+    As async_conv.sv and async_maxpool.sv on the FPGA, conv1 and max_pool1 run for every arriving
+    event - its edges are generated, its conv1 output is computed from the edges to the past events
+    and the max of its 4x4x4 pooled cell is updated. Only the synchronous part (conv2 to the head)
+    runs when the window is closed with close(), on the pooled graph, so the latency from the last
+    event to the prediction depends on the number of pooled cells and not on the number of events.
+    The logits are identical to EFGCN.q_forward on the graph of the whole window.'''
+    def __init__(self, model: EFGCN, radius=3, input_dimension=(256, 256, 256), hw_context=False):
+        super(AsyncEFGCN, self).__init__()
+        self.model = model
+        self.radius = radius
+        self.input_dimension = input_dimension
+        self.hw_context = hw_context
+
+        # Pooled cells of max_pool1 are stored in a dense grid addressed by (cx * GY + cy) * GT + ct
+        self.pool_size = model.max_pool1.pool_size
+        self.grid = tuple(-(-dimension // self.pool_size) for dimension in input_dimension)
+        self.num_cells = self.grid[0] * self.grid[1] * self.grid[2]
+
+        self.device = next(model.parameters()).device
+        self.pooled_features = torch.full((self.num_cells, model.conv1.output_dim), -torch.inf, dtype=torch.float32, device=self.device)
+        self.reset()
+
+    def reset(self):
+        '''Start a new window.'''
+        # The neighbour matrix of GraphGen is not cleared by release(), so every window has its own generator
+        self.graph_gen = GraphGen(self.radius, dimension_XY=self.input_dimension[:2], self_loop=True, hw_context=self.hw_context)
+
+        # Only the cells written in the last window are cleared
+        if hasattr(self, 'cells') and self.cells:
+            self.pooled_features[torch.tensor(sorted(self.cells), device=self.device)] = -torch.inf
+
+        # Occupied cells and pooled edges as cell keys (source * num_cells + neighbour)
+        self.cells = set()
+        self.pooled_edges = set()
+
+    def forward(self, event):
+        '''Process a single [x, y, t, p] event.'''
+        self.extend([event])
+
+    def extend(self, events):
+        '''Process a chunk of [x, y, t, p] events in time order.'''
+        # Edges of a new node point only to the past events, so its conv1 output is final on arrival
+        # and a chunk gives the same result as single events
+        first_node, first_edge = self.graph_gen.index + 1, len(self.graph_gen.edges)
+        for event in events:
+            self.graph_gen.forward(event)
+        if self.graph_gen.index < first_node:
+            return
+
+        # Subgraph of the new nodes and their neighbours
+        edges = torch.tensor(self.graph_gen.edges[first_edge:], dtype=torch.int64).reshape(-1, 2)
+        ids = torch.unique(edges)
+        nodes = torch.tensor([self.graph_gen.pos[i] for i in ids.tolist()], dtype=torch.float32)
+        features = torch.tensor([self.graph_gen.features[i] for i in ids.tolist()], dtype=torch.float32)
+        local_edges = torch.searchsorted(ids, edges)
+
+        # Output rows of conv1 are the sources of the edges, the new nodes in order
+        with torch.no_grad():
+            features = self.model.conv1.q_forward(nodes.to(self.device), features.to(self.device), local_edges.to(self.device), first_layer=True)
+            features = self.model.relu1.q_forward(features)
+
+        # Relaxing max pooling - the cell of every new node is updated with its features
+        keys = self._cell_keys(nodes)
+        new_keys = keys[ids.numpy() >= first_node]
+        index = torch.as_tensor(new_keys, device=self.device).unsqueeze(1).expand(-1, features.size(1))
+        self.pooled_features.scatter_reduce_(0, index, features, reduce='amax', include_self=True)
+        self.cells.update(new_keys.tolist())
+
+        # Edges between different cells (self loops of the cells are added by close())
+        source, neighbour = keys[local_edges[:, 0].numpy()], keys[local_edges[:, 1].numpy()]
+        mask = source != neighbour
+        self.pooled_edges.update((source[mask] * self.num_cells + neighbour[mask]).tolist())
+
+    def graph(self):
+        '''Pooled graph of the current window, identical to the output of max_pool1.'''
+        # Sorted cell keys give the lexicographic order of the cell positions (as unique_rows)
+        keys = torch.tensor(sorted(self.cells), dtype=torch.int64)
+        positions = torch.stack((keys // (self.grid[1] * self.grid[2]), (keys // self.grid[2]) % self.grid[1], keys % self.grid[2]), dim=1)
+        features = self.pooled_features[keys.to(self.device)]
+
+        pooled_edges = torch.tensor(sorted(self.pooled_edges), dtype=torch.int64)
+        edges = torch.stack((pooled_edges // self.num_cells, pooled_edges % self.num_cells), dim=1)
+        edges = torch.searchsorted(keys, edges.reshape(-1)).reshape(-1, 2)
+        edges = torch.cat((edges, torch.arange(keys.size(0)).unsqueeze(1).expand(-1, 2)), dim=0)
+        return positions.to(self.device), features, edges.to(self.device)
+
+    def predict(self):
+        '''Logits of the events received so far without closing the window (anytime classification).'''
+        nodes, features, edges = self.graph()
+        batch = torch.zeros(nodes.size(0), dtype=torch.int64, device=self.device)
+        with torch.no_grad():
+            return self.model.q_forward_pooled(nodes, features, edges, batch, 1)[0]
+
+    def close(self):
+        '''Close the window - run the synchronous part of the network and start a new window.'''
+        logits = self.predict()
+        self.reset()
+        return logits
+
+    def _cell_keys(self, nodes):
+        cells = np.floor_divide(nodes.numpy(), self.pool_size).astype(np.int64)
+        return (cells[:, 0] * self.grid[1] + cells[:, 1]) * self.grid[2] + cells[:, 2]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(radius={self.radius}, input_dimension={self.input_dimension}, hw_context={self.hw_context})"
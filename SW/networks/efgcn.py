@@ -6,84 +6,110 @@ from networks.layers.qpool_out import QuantGraphPoolOut
 from networks.layers.qlinear import QuantLinear
 from networks.layers.qrelu import QuantReLU
 from networks.layers.max_pool import GraphPooling
+from networks.layers.utils.csr import GraphCSR
+
+# Pooling stages of the precomputed graph pyramid and the keys of its tensors in a sample
+PYRAMID_LEVELS = ('pool1', 'pool2', 'out')
+PYRAMID_KEYS = tuple(f'{level}_{name}' for level in PYRAMID_LEVELS for name in ('nodes', 'edges', 'assign', 'batch'))
     
 class EFGCN(Module):
     def __init__(self, 
                  input_dimension = (256, 256, 256),
                  bias: bool = False, 
                  num_outputs: int = 100, 
-                 num_bits: int = 8):
+                 num_bits: int = 8,
+                 node_level: bool = False,
+                 sparse_head: bool = False):
         super(EFGCN, self).__init__()
 
-        self.conv1 = QuantGraphConv(input_dim=1, output_dim=16, bias=bias, num_bits=num_bits)
+        self.conv1 = QuantGraphConv(input_dim=1, output_dim=16, bias=bias, num_bits=num_bits, node_level=node_level)
         self.relu1 = QuantReLU(num_bits=num_bits)
 
-        self.max_pool1 = GraphPooling(pool_size=4, max_dimension=input_dimension[0], only_vertices=False, self_loop=True)
+        self.max_pool1, self.max_pool2, self.out = self.pooling_layers(input_dimension)
 
-        self.conv2 = QuantGraphConv(input_dim=16, output_dim=32, bias=bias, num_bits=num_bits)
+        self.conv2 = QuantGraphConv(input_dim=16, output_dim=32, bias=bias, num_bits=num_bits, node_level=node_level)
         self.relu2 = QuantReLU(num_bits=num_bits)
-        self.conv3 = QuantGraphConv(input_dim=32, output_dim=32, bias=bias, num_bits=num_bits)
+        self.conv3 = QuantGraphConv(input_dim=32, output_dim=32, bias=bias, num_bits=num_bits, node_level=node_level)
         self.relu3 = QuantReLU(num_bits=num_bits)
 
-        self.max_pool2 = GraphPooling(pool_size=2, max_dimension=input_dimension[0]//4, only_vertices=False, self_loop=True)
-
-        self.conv4 = QuantGraphConv(input_dim=32, output_dim=64, bias=bias, num_bits=num_bits)
+        self.conv4 = QuantGraphConv(input_dim=32, output_dim=64, bias=bias, num_bits=num_bits, node_level=node_level)
         self.relu4 = QuantReLU(num_bits=num_bits)
-        self.conv5 = QuantGraphConv(input_dim=64, output_dim=64, bias=bias, num_bits=num_bits)
+        self.conv5 = QuantGraphConv(input_dim=64, output_dim=64, bias=bias, num_bits=num_bits, node_level=node_level)
         self.relu5 = QuantReLU(num_bits=num_bits)
 
-        out_pull = 8 if input_dimension[0]==256 else 4
-
-        self.out = QuantGraphPoolOut(pool_size=out_pull, max_dimension=input_dimension[0]//8)
         self.linear = QuantLinear(4*4*4*64, num_outputs, bias=bias)
 
-    def forward(self, nodes, features, edges):
+        # Apply the linear layer only to occupied output cells instead of the dense grid
+        self.sparse_head = sparse_head
+
+    def forward(self, nodes, features, edges, batch=None, num_graphs=None, pyramid=None):
         '''Standard forward method for training on floats'''
-        features = self.conv1(nodes, features, edges)
+        '''For a batch from collate_fn, batch is the graph index of every node and one row of
+        logits is returned for every graph, otherwise the input is a single graph.
+        pyramid holds the pooled graphs precomputed with graph_pyramid() (PYRAMID_KEYS).'''
+        single_graph = batch is None
+        batch, num_graphs = self._graph_batch(nodes, batch, num_graphs)
+
+        # Edges sorted by destination, shared by the convolutions until the next pooling
+        csr = GraphCSR(edges, nodes.size(0))
+
+        features = self.conv1(nodes, features, edges, csr=csr)
         features = self.relu1(features)
 
-        nodes, features, edges = self.max_pool1(nodes, features, edges)
+        nodes, features, edges, batch = self.max_pool1(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool1'))
+        csr = GraphCSR(edges, nodes.size(0))
 
-        features = self.conv2(nodes, features, edges)
+        features = self.conv2(nodes, features, edges, csr=csr)
         features = self.relu2(features)
-        features = self.conv3(nodes, features, edges)
+        features = self.conv3(nodes, features, edges, csr=csr)
         features = self.relu3(features)
 
-        nodes, features, edges = self.max_pool2(nodes, features, edges)
+        nodes, features, edges, batch = self.max_pool2(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool2'))
+        csr = GraphCSR(edges, nodes.size(0))
         
-        features = self.conv4(nodes, features, edges)
+        features = self.conv4(nodes, features, edges, csr=csr)
         features = self.relu4(features)
-        features = self.conv5(nodes, features, edges)
+        features = self.conv5(nodes, features, edges, csr=csr)
         features = self.relu5(features)
         
-        features = self.out(nodes, features)
-        features = self.linear(features)
-        return features
+        if self.sparse_head:
+            cells, graphs, features, num_graphs = self.out.occupied_cells(nodes, features, batch, num_graphs, topology=self._pyramid_level(pyramid, 'out'))
+            features = self.linear.sparse_forward(cells, graphs, features, num_graphs)
+        else:
+            features = self.out(nodes, features, batch, num_graphs, topology=self._pyramid_level(pyramid, 'out'))
+            features = self.linear(features)
+        return features[0] if single_graph else features
     
-    def calibration(self, nodes, features, edges):
+    def calibration(self, nodes, features, edges, batch=None, num_graphs=None, pyramid=None):
         '''Calibration method to adjust quantize parameters on dataset'''
-        features = self.conv1.calibration(nodes, features, edges, use_obs=True)
+        single_graph = batch is None
+        batch, num_graphs = self._graph_batch(nodes, batch, num_graphs)
+        csr = GraphCSR(edges, nodes.size(0))
+
+        features = self.conv1.calibration(nodes, features, edges, use_obs=True, csr=csr)
         features = self.relu1.calibration(features)
         
-        nodes, features, edges = self.max_pool1(nodes, features, edges)
+        nodes, features, edges, batch = self.max_pool1(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool1'))
+        csr = GraphCSR(edges, nodes.size(0))
 
-        features = self.conv2.calibration(nodes, features, edges)
+        features = self.conv2.calibration(nodes, features, edges, csr=csr)
         features = self.relu2.calibration(features)
 
-        features = self.conv3.calibration(nodes, features, edges)
+        features = self.conv3.calibration(nodes, features, edges, csr=csr)
         features = self.relu3.calibration(features)
 
-        nodes, features, edges = self.max_pool2(nodes, features, edges)
+        nodes, features, edges, batch = self.max_pool2(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool2'))
+        csr = GraphCSR(edges, nodes.size(0))
 
-        features = self.conv4.calibration(nodes, features, edges)
+        features = self.conv4.calibration(nodes, features, edges, csr=csr)
         features = self.relu4.calibration(features)
 
-        features = self.conv5.calibration(nodes, features, edges)
+        features = self.conv5.calibration(nodes, features, edges, csr=csr)
         features = self.relu5.calibration(features)
 
-        features = self.out.calibration(nodes, features)
+        features = self.out.calibration(nodes, features, batch, num_graphs, topology=self._pyramid_level(pyramid, 'out'))
         features = self.linear.calibration(features)
-        return features
+        return features[0] if single_graph else features
     
     def freeze(self):
         '''Freeze parameters after calibration'''
@@ -105,30 +131,131 @@ class EFGCN(Module):
         self.out.freeze(observer_in=self.conv5.observer_out)
         self.linear.freeze(observer_in=self.conv5.observer_out)
 
-    def q_forward(self, nodes, features, edges):
+    def q_forward(self, nodes, features, edges, batch=None, num_graphs=None, pyramid=None):
         '''Forward method for quantized model'''
-        features = self.conv1.q_forward(nodes, features, edges, first_layer=True)
+        single_graph = batch is None
+        batch, num_graphs = self._graph_batch(nodes, batch, num_graphs)
+        csr = GraphCSR(edges, nodes.size(0))
+
+        features = self.conv1.q_forward(nodes, features, edges, first_layer=True, csr=csr)
         features = self.relu1.q_forward(features)
 
-        nodes, features, edges = self.max_pool1(nodes, features, edges)
+        nodes, features, edges, batch = self.max_pool1(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool1'))
+        features = self.q_forward_pooled(nodes, features, edges, batch, num_graphs, pyramid=pyramid)
+
+        return features[0] if single_graph else features
+
+    def q_forward_pooled(self, nodes, features, edges, batch, num_graphs, pyramid=None):
+        '''Quantized forward method from conv2 on the graph after max_pool1'''
+        '''The synchronous part of the network, it is shared with the event-driven mode (networks/async_efgcn.py)
+        which computes conv1 and max_pool1 event by event. One row of logits is returned for every graph.'''
+        csr = GraphCSR(edges, nodes.size(0))
 
-        features = self.conv2.q_forward(nodes, features, edges)
+        features = self.conv2.q_forward(nodes, features, edges, csr=csr)
         features = self.relu2.q_forward(features)
-        features = self.conv3.q_forward(nodes, features, edges)
+        features = self.conv3.q_forward(nodes, features, edges, csr=csr)
         features = self.relu3.q_forward(features)
 
-        nodes, features, edges = self.max_pool2(nodes, features, edges)
+        nodes, features, edges, batch = self.max_pool2(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool2'))
+        csr = GraphCSR(edges, nodes.size(0))
 
-        features = self.conv4.q_forward(nodes, features, edges)
+        features = self.conv4.q_forward(nodes, features, edges, csr=csr)
         features = self.relu4.q_forward(features)
-        features = self.conv5.q_forward(nodes, features, edges)
+        features = self.conv5.q_forward(nodes, features, edges, csr=csr)
         features = self.relu5.q_forward(features)
 
-        features = self.out.q_forward(nodes, features)
-        features = self.linear.q_forward(features)
-        features = self.linear.observer_out.dequantize_tensor(features)
-    
-        return features
+        if self.sparse_head:
+            cells, graphs, features, num_graphs = self.out.occupied_cells(nodes, features, batch, num_graphs, topology=self._pyramid_level(pyramid, 'out'))
+            features = self.linear.sparse_q_forward(cells, graphs, features, num_graphs, fill_value=self.out.observer_in.zero_point)
+        else:
+            features = self.out.q_forward(nodes, features, batch, num_graphs, topology=self._pyramid_level(pyramid, 'out'))
+            features = self.linear.q_forward(features)
+        return self.linear.observer_out.dequantize_tensor(features)
+
+    def int_forward(self, nodes, features, edges, batch=None, num_graphs=None, pyramid=None):
+        '''Forward method for quantized model on integer tensors with the arithmetic of the HW'''
+        '''Features between layers are uint8 and accumulators int32. Requantization rounds half up with
+        the integer multipliers, so the result can differ slightly from the float emulation of q_forward.'''
+        single_graph = batch is None
+        batch, num_graphs = self._graph_batch(nodes, batch, num_graphs)
+        csr = GraphCSR(edges, nodes.size(0))
+
+        features = self.conv1.int_forward(nodes, features, edges, first_layer=True, csr=csr)
+        features = self.relu1.int_forward(features)
+
+        nodes, features, edges, batch = self.max_pool1(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool1'))
+        csr = GraphCSR(edges, nodes.size(0))
+
+        features = self.conv2.int_forward(nodes, features, edges, csr=csr)
+        features = self.relu2.int_forward(features)
+        features = self.conv3.int_forward(nodes, features, edges, csr=csr)
+        features = self.relu3.int_forward(features)
+
+        nodes, features, edges, batch = self.max_pool2(nodes, features, edges, batch, topology=self._pyramid_level(pyramid, 'pool2'))
+        csr = GraphCSR(edges, nodes.size(0))
+
+        features = self.conv4.int_forward(nodes, features, edges, csr=csr)
+        features = self.relu4.int_forward(features)
+        features = self.conv5.int_forward(nodes, features, edges, csr=csr)
+        features = self.relu5.int_forward(features)
+
+        # The integer head is always dense (sparse_head applies to forward and q_forward)
+        features = self.out.int_forward(nodes, features, batch, num_graphs, topology=self._pyramid_level(pyramid, 'out'))
+        features = self.linear.int_forward(features)
+        features = self.linear.observer_out.dequantize_tensor(features.to(torch.float32))
+
+        return features[0] if single_graph else features
+
+    @staticmethod
+    def pooling_layers(input_dimension):
+        '''Pooling layers of the network, the only layers which change the graph.'''
+        max_pool1 = GraphPooling(pool_size=4, max_dimension=input_dimension[0], only_vertices=False, self_loop=True)
+        max_pool2 = GraphPooling(pool_size=2, max_dimension=input_dimension[0]//4, only_vertices=False, self_loop=True)
+
+        out_pull = 8 if input_dimension[0]==256 else 4
+
+        out = QuantGraphPoolOut(pool_size=out_pull, max_dimension=input_dimension[0]//8)
+        return max_pool1, max_pool2, out
+
+    @staticmethod
+    def graph_pyramid(nodes, edges, input_dimension=(256, 256, 256)):
+        '''Pooled graphs of all pooling stages for a single graph.'''
+        '''The pooled graphs depend only on the input graph, so they can be stored with the processed
+        sample and passed to forward as pyramid to skip the pooling topology work at inference.'''
+        max_pool1, max_pool2, out = EFGCN.pooling_layers(input_dimension)
+        pool1_nodes, pool1_assign, pool1_edges, _ = max_pool1.topology(nodes, edges)
+        pool2_nodes, pool2_assign, pool2_edges, _ = max_pool2.topology(pool1_nodes, pool1_edges)
+        out_nodes, out_assign, _ = out.topology(pool2_nodes)
+        return {'pool1_nodes': pool1_nodes.to(torch.int32),
+                'pool1_edges': pool1_edges.to(torch.int32),
+                'pool1_assign': pool1_assign.to(torch.int32),
+                'pool2_nodes': pool2_nodes.to(torch.int32),
+                'pool2_edges': pool2_edges.to(torch.int32),
+                'pool2_assign': pool2_assign.to(torch.int32),
+                'out_nodes': out_nodes.to(torch.int32),
+                'out_assign': out_assign.to(torch.int32)}
+
+    @staticmethod
+    def _pyramid_level(pyramid, level):
+        # Precomputed topology of a pooling stage (without graph indices the pyramid is a single graph)
+        if pyramid is None:
+            return None
+        nodes = pyramid[level + '_nodes']
+        batch = pyramid.get(level + '_batch')
+        if batch is None:
+            batch = torch.zeros(nodes.size(0), dtype=torch.int64, device=nodes.device)
+        if level == 'out':
+            return nodes, pyramid[level + '_assign'], batch
+        return nodes, pyramid[level + '_assign'], pyramid[level + '_edges'], batch
+
+    @staticmethod
+    def _graph_batch(nodes, batch, num_graphs):
+        # A single graph is processed as a batch with one graph
+        if batch is None:
+            batch = torch.zeros(nodes.size(0), dtype=torch.int64, device=nodes.device)
+        if num_graphs is None:
+            num_graphs = int(batch.max()) + 1 if batch.numel() > 0 else 1
+        return batch, num_graphs
     
     def get_parameters(self):
         self.conv1.get_parameters('tiny_conv1_param.txt')
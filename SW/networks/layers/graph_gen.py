@@ -1,19 +1,37 @@
+import numpy as np
 import torch
 from torch.nn import Module
 
+from networks.layers.utils.context import TiledContext
+
 
 class GraphGen(Module):
-    def __init__(self, r, dimension_XY=256, self_loop=True):
+    def __init__(self, r, dimension_XY=256, self_loop=True, hw_context=False, max_edges=None, sparse_context=False):
         super(GraphGen, self).__init__()
-        # Module parameters
+        # Module parameters (dimension_XY is a single size for square sensors or a (width, height) pair)
         self.r = r
         self.dimension_XY = dimension_XY
+        self.dimension_X, self.dimension_Y = (dimension_XY, dimension_XY) if np.ndim(dimension_XY) == 0 else tuple(dimension_XY)
 
-        # Gemerate neighbour matrix
-        self.neighbour_matrix = torch.zeros((dimension_XY, dimension_XY), dtype=torch.int32)
-        
-        # Precompute context ranges 
-        self.precomputed_ctx_ranges = {i: torch.arange(max(0, i - self.r), min(self.dimension_XY, i + self.r + 1)) for i in range(self.dimension_XY)}
+        # Hardware context mode (edges_gen.sv) - no duplicate dropping, bounded context
+        # with at most max_edges neighbours (29 for r=3) read in memory address order
+        self.hw_context = hw_context
+        self.hw_offsets = self._hw_context_offsets(r)
+        self.max_edges = len(self.hw_offsets) if max_edges is None else max_edges
+
+        # Gemerate neighbour matrix (in HW mode -1 marks an empty cell)
+        # The sparse context allocates memory only for tiles with events (for large sensors)
+        self.sparse_context = sparse_context
+        empty = -1 if hw_context else 0
+        if sparse_context:
+            self.neighbour_matrix = TiledContext((self.dimension_X, self.dimension_Y), fill_value=empty)
+        else:
+            self.neighbour_matrix = torch.full((self.dimension_X, self.dimension_Y), empty, dtype=torch.int32)
+
+        # Precompute context ranges (computed on the fly for the sparse context)
+        if not sparse_context:
+            self.precomputed_ctx_ranges_x = {i: self._ctx_range(i, self.dimension_X) for i in range(self.dimension_X)}
+            self.precomputed_ctx_ranges_y = {i: self._ctx_range(i, self.dimension_Y) for i in range(self.dimension_Y)}
         
         # Initialize lists
         self.pos = []
@@ -41,12 +59,22 @@ class GraphGen(Module):
             self.neighbour_matrix[x, y] = self.index
 
     def _check_duplicate(self, x, y, t):
+        # The hardware writes every event to the context memory
+        if self.hw_context:
+            return True
         return False if self.neighbour_matrix[x, y] != 0 and self.pos[self.neighbour_matrix[x, y]][2] == t else True
         
     def _generate_edges(self, x, y, t):
+        if self.hw_context:
+            return self._generate_hw_edges(x, y, t)
+
         # Generate indices of context
-        x_ctx_range = self.precomputed_ctx_ranges[x]
-        y_ctx_range = self.precomputed_ctx_ranges[y]
+        if self.sparse_context:
+            x_ctx_range = self._ctx_range(x, self.dimension_X)
+            y_ctx_range = self._ctx_range(y, self.dimension_Y)
+        else:
+            x_ctx_range = self.precomputed_ctx_ranges_x[x]
+            y_ctx_range = self.precomputed_ctx_ranges_y[y]
         x_ctx, y_ctx = torch.meshgrid(x_ctx_range, y_ctx_range, indexing='ij')
         x_ctx, y_ctx = x_ctx.flatten(), y_ctx.flatten()
 
@@ -65,6 +93,121 @@ class GraphGen(Module):
             if square_distance <= self.r ** 2:
                 self.edges.append((self.index, idx))
 
+    def _ctx_range(self, i, dimension):
+        return torch.arange(max(0, i - self.r), min(dimension, i + self.r + 1))
+
+    def _generate_hw_edges(self, x, y, t):
+        # Add self loop
+        if self.self_loop:
+            self.edges.append((self.index, self.index))
+
+        # Read the context in the same order as the memory ports in edges_gen.sv
+        num_edges = 0
+        for dx, dy in self.hw_offsets:
+            x_ctx, y_ctx = x + dx, y + dy
+            if not (0 <= x_ctx < self.dimension_X and 0 <= y_ctx < self.dimension_Y):
+                continue
+            idx = self.neighbour_matrix[x_ctx, y_ctx].item()
+            if idx < 0:
+                continue
+
+            # Only past events within the radius are connected
+            t_ctx = self.pos[idx][2]
+            if t_ctx <= t and dx ** 2 + dy ** 2 + (t - t_ctx) ** 2 <= self.r ** 2:
+                self.edges.append((self.index, idx))
+                num_edges += 1
+                if num_edges == self.max_edges:
+                    break
+
+    @staticmethod
+    def _hw_context_offsets(r):
+        # Spatial offsets inside the radius ordered by memory address (y * GRAPH_SIZE + x),
+        # for r=3 these are the 29 reads of ports A and B (MEM_ADDR_* in graph_pkg.sv)
+        offsets = np.arange(-r, r + 1)
+        dy, dx = np.meshgrid(offsets, offsets, indexing='ij')
+        dx, dy = dx.flatten(), dy.flatten()
+        mask = dx ** 2 + dy ** 2 <= r ** 2
+        return np.stack((dx[mask], dy[mask]), axis=1)
+
+    def build(self, events, chunk_size=65536):
+        '''Build the whole graph at once from an (N, 4) array of [x, y, t, p] events.
+
+        Output is identical to calling forward() for every event on a fresh
+        generator followed by release(), including the duplicate rule and the
+        fact that the node stored with index 0 is never found in the context
+        (both only apply outside of the hardware context mode).'''
+        events = np.asarray(events).astype(np.int64).reshape(-1, 4)
+        dim_x, dim_y = self.dimension_X, self.dimension_Y
+
+        # Drop duplicates - an event is skipped if the previous event on the same pixel
+        # has the same timestamp (unless that previous event is node 0, see _check_duplicate)
+        pix = events[:, 0] * dim_y + events[:, 1]
+        order = np.argsort(pix, kind='stable')
+        duplicate = np.zeros(events.shape[0], dtype=bool)
+        if not self.hw_context:
+            duplicate[order[1:]] = (pix[order[1:]] == pix[order[:-1]]) & (events[order[1:], 2] == events[order[:-1], 2]) & (order[:-1] != 0)
+        events = events[~duplicate]
+
+        num_nodes = events.shape[0]
+        x, y, t = events[:, 0], events[:, 1], events[:, 2]
+
+        # Sorted (pixel, index) keys - the last node written to a pixel before node k
+        # is the largest key smaller than pixel * num_nodes + k
+        pix = x * dim_y + y
+        order = np.argsort(pix, kind='stable')
+        sorted_pix = pix[order]
+        sorted_keys = sorted_pix * num_nodes + order
+
+        # Context offsets in the same order as the meshgrid in _generate_edges
+        if self.hw_context:
+            dx, dy = self.hw_offsets[:, 0], self.hw_offsets[:, 1]
+        else:
+            offsets = np.arange(-self.r, self.r + 1)
+            dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+            dx, dy = dx.flatten(), dy.flatten()
+
+        edges = []
+        for start in range(0, num_nodes, chunk_size):
+            index = np.arange(start, min(start + chunk_size, num_nodes))
+            x_ctx = x[index, None] + dx
+            y_ctx = y[index, None] + dy
+            valid = (x_ctx >= 0) & (x_ctx < dim_x) & (y_ctx >= 0) & (y_ctx < dim_y)
+
+            # Find the last node written to each context pixel before the current one
+            ctx_pix = x_ctx * dim_y + y_ctx
+            position = np.searchsorted(sorted_keys, ctx_pix * num_nodes + index[:, None]) - 1
+            valid &= position >= 0
+            position = np.where(valid, position, 0)
+            valid &= sorted_pix[position] == ctx_pix
+            idx = order[position]
+
+            # Index 0 is treated as an empty cell by the neighbour matrix
+            if not self.hw_context:
+                valid &= idx != 0
+            square_distance = (x[idx] - x[index, None]) ** 2 + (y[idx] - y[index, None]) ** 2 + (t[idx] - t[index, None]) ** 2
+            valid &= square_distance <= self.r ** 2
+
+            # Hardware connects only past events and keeps the first max_edges neighbours
+            if self.hw_context:
+                valid &= t[idx] <= t[index, None]
+                valid &= np.cumsum(valid, axis=1) <= self.max_edges
+
+            # Self loop goes first, then the neighbours in context order
+            if self.self_loop:
+                idx = np.concatenate((index[:, None], idx), axis=1)
+                valid = np.concatenate((np.ones((index.size, 1), dtype=bool), valid), axis=1)
+
+            source = np.broadcast_to(index[:, None], idx.shape)
+            edges.append(np.stack((source[valid], idx[valid]), axis=1))
+
+        edges = np.concatenate(edges, axis=0) if edges else np.zeros((0, 2), dtype=np.int64)
+
+        nodes_tensor = torch.tensor(events[:, :3], dtype=torch.float32, device='cpu')
+        features_tensor = torch.tensor(events[:, 3:], dtype=torch.float32, device='cpu')
+        edges_tensor = torch.tensor(edges, dtype=torch.int32, device='cpu')
+
+        return nodes_tensor, features_tensor, edges_tensor
+
     def release(self):
         # Convert lists to tensors
         nodes_tensor = torch.tensor(self.pos, dtype=torch.float32, device='cpu')
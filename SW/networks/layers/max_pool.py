@@ -1,6 +1,9 @@
 import torch
 from torch.nn import Module
 
+from networks.layers.utils.unique import unique_rows
+from networks.layers.utils.csr import scatter_max
+
 class GraphPooling(Module):
     def __init__(self, pool_size=4, max_dimension=256, only_vertices=False, self_loop=True):
         super(GraphPooling, self).__init__()
@@ -12,15 +15,47 @@ class GraphPooling(Module):
 
         self.average_positions = False
 
-    def forward(self, vertices, features, edges):
+        # Deduplicate cells and edges with single int64 keys instead of the row sort of torch.unique(dim=0)
+        self.linear_keys = True
+
+    def forward(self, vertices, features, edges, batch=None, topology=None):
+        # The pooled graph depends only on the input graph, so it can be precomputed with topology()
+        if topology is None:
+            topology = self.topology(vertices, edges, batch)
+        unique_positions, indices, edge_index, pooled_batch = topology
+
+        # Aggregate features for each unique position - OPTIONAL use other reduce functions instead of "sum"
+        pooled_features = scatter_max(features, indices.to(torch.int64), unique_positions.size(0))
+
+        # For potential pruning graph at the beginning - OPTIONAL
+        if self.only_vertices:
+            if batch is not None:
+                return unique_positions, pooled_features, pooled_batch
+            return unique_positions, pooled_features
+
+        if batch is not None:
+            return unique_positions, pooled_features, edge_index, pooled_batch
+        return unique_positions, pooled_features, edge_index
+
+    def topology(self, vertices, edges, batch=None):
+        # Pooled vertices, index of the pooled vertex for every vertex, pooled edges and graph index of pooled vertices
         # Reduce dimension of vertices to find indices with the same pool cells
         normalized_vertices = torch.div(vertices, self.pool_size, rounding_mode='floor').to(torch.int64)
 
+        # For a batch of graphs the graph index is a part of the pool cell, so graphs are never merged
+        if batch is not None:
+            normalized_vertices = torch.cat((batch.unsqueeze(1).to(torch.int64), normalized_vertices), dim=1)
+
         # Change vertices to original dimensions - OPTIONAL
         # normalized_vertices = normalized_vertices * self.pool_size
         
         # Find indices of unique positions
-        unique_positions, indices = torch.unique(normalized_vertices, dim=0, return_inverse=True)
+        if self.linear_keys:
+            unique_positions, indices = unique_rows(normalized_vertices, return_inverse=True)
+        else:
+            unique_positions, indices = torch.unique(normalized_vertices, dim=0, return_inverse=True)
+        if batch is not None:
+            batch, unique_positions = unique_positions[:, 0], unique_positions[:, 1:]
 
         # Find indices of unique spatial positions - OPTIONAL (comment out the line above and uncomment the line below)
         # unique_positions, indices = torch.unique(normalized_vertices[:,:2], dim=0, return_inverse=True)
@@ -30,25 +65,20 @@ class GraphPooling(Module):
             averaged_positions = torch.zeros((unique_positions.size(0), 3), dtype=vertices.dtype, device=vertices.device)
             unique_positions = averaged_positions.scatter_reduce(0, indices.unsqueeze(1).expand(-1,3), vertices, reduce="mean", include_self=False)
 
-        # Aggregate features for each unique position - OPTIONAL use other reduce functions instead of "sum"
-        pooled_features = torch.zeros((unique_positions.size(0), features.size(1)), dtype=features.dtype, device=features.device)
-        pooled_features = pooled_features.scatter_reduce(0, indices.unsqueeze(1).expand(-1, features.size(1)), features, reduce="amax", include_self=False) #TODO Change to True
-
-        # For potential pruning graph at the beginning - OPTIONAL
         if self.only_vertices:
-            return unique_positions, pooled_features
+            return unique_positions, indices, None, batch
         
         # Remove self loops (for filter out the same positions duplicates)
         edge_index = indices[edges]
         mask = edge_index[:, 0] != edge_index[:, 1]
         edge_index = edge_index[mask, :]
 
-        edge_index = torch.unique(edge_index, dim=0)
+        edge_index = unique_rows(edge_index) if self.linear_keys else torch.unique(edge_index, dim=0)
         
         # Add self loops (to keep only one self loop for each unique position)
         if self.self_loop:
             edge_index = torch.cat((edge_index, torch.arange(unique_positions.size(0), device=edge_index.device).unsqueeze(1).expand(-1, 2)), dim=0)
-        return unique_positions, pooled_features, edge_index
+        return unique_positions, indices, edge_index, batch
     
     def __repr__(self):
         return f"{self.__class__.__name__}(pool_size={self.pool_size}, max_dimension={self.max_dimension})"
\ No newline at end of file
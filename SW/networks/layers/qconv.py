@@ -5,7 +5,8 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 
 from networks.layers.utils.observer import Observer, FakeQuantize
-from networks.layers.utils.quantize import quantize_tensor, dequantize_tensor
+from networks.layers.utils.quantize import quantize_tensor, dequantize_tensor, integer_linear, accumulator_bound, requantize_tensor, wrap_int32
+from networks.layers.utils.csr import GraphCSR
 
 class QuantGraphConv(nn.Module):
     '''Quantized version of GraphConv layer.'''
@@ -13,7 +14,8 @@ class QuantGraphConv(nn.Module):
                  input_dim: int = 1, 
                  output_dim: int = 4,
                  bias:bool = False,
-                 num_bits:int = 8):
+                 num_bits:int = 8,
+                 node_level:bool = False):
         super().__init__()
         
         '''Initialize standard layers.'''
@@ -26,6 +28,9 @@ class QuantGraphConv(nn.Module):
 
         self.num_bits = num_bits
 
+        '''Compute the linear layer per node instead of per edge in forward and q_forward.'''
+        self.node_level = node_level
+
         '''Initialize quantization observers for input, weight and output tensors.'''
         self.observer_in = Observer(num_bits=num_bits)
         self.observer_w = Observer(num_bits=num_bits)
@@ -45,9 +50,17 @@ class QuantGraphConv(nn.Module):
     def forward(self, 
                 node: torch.Tensor, 
                 features: torch.Tensor, 
-                edges: torch.Tensor):
+                edges: torch.Tensor,
+                csr: GraphCSR = None):
         
         '''Standard forward pass of GraphConv layer.'''
+        '''csr is the sorted graph structure shared by layers with the same edges (built if not given).'''
+        if csr is None:
+            csr = GraphCSR(edges, node.size(0))
+        edges = csr.edges
+
+        if self.node_level:
+            return self._node_level_forward(node, features, csr)
 
         '''Calculate message for PointNet layer.'''
         pos_i = node[edges[:, 0]]
@@ -59,10 +72,7 @@ class QuantGraphConv(nn.Module):
         msg = self.linear(msg)
 
         '''Update graph features.'''
-        unique_positions, indices = torch.unique(edges[:,0], dim=0, return_inverse=True)
-        expanded_indices = indices.unsqueeze(1).expand(-1, self.output_dim)
-        pooled_features = torch.zeros((unique_positions.size(0), self.output_dim), dtype=features.dtype, device=features.device)
-        pooled_features = pooled_features.scatter_reduce(0, expanded_indices, msg, reduce="amax", include_self=False)
+        pooled_features = csr.segment_max(msg)
 
         return pooled_features
     
@@ -70,9 +80,14 @@ class QuantGraphConv(nn.Module):
                     node: torch.Tensor, 
                     features: torch.Tensor, 
                     edges: torch.Tensor,
-                    use_obs: bool = False):
+                    use_obs: bool = False,
+                    csr: GraphCSR = None):
         
         '''Calibration forward for updating observers.'''        
+        if csr is None:
+            csr = GraphCSR(edges, node.size(0))
+        edges = csr.edges
+
         '''Calculate message for PointNet layer.'''
         pos_i = node[edges[:, 0]]
         pos_j = node[edges[:, 1]]
@@ -98,10 +113,7 @@ class QuantGraphConv(nn.Module):
         msg = FakeQuantize.apply(msg, self.observer_out)
 
         '''Update graph features.'''
-        unique_positions, indices = torch.unique(edges[:,0], dim=0, return_inverse=True)
-        expanded_indices = indices.unsqueeze(1).expand(-1, self.output_dim)
-        pooled_features = torch.zeros((unique_positions.size(0), self.output_dim), dtype=features.dtype, device=features.device)
-        pooled_features = pooled_features.scatter_reduce(0, expanded_indices, msg, reduce="amax", include_self=False)
+        pooled_features = csr.segment_max(msg)
         
         return pooled_features
 
@@ -152,9 +164,18 @@ class QuantGraphConv(nn.Module):
                   features: torch.Tensor, 
                   edges: torch.Tensor,
                   first_layer: bool = False,
-                  after_pool: bool = False):
+                  after_pool: bool = False,
+                  csr: GraphCSR = None):
         
         '''Quantized forward pass of GraphConv layer.'''
+        if csr is None:
+            csr = GraphCSR(edges, node.size(0))
+        edges = csr.edges
+
+        if self.node_level:
+            msg = self._node_level_q_message(node, features, edges, first_layer)
+            if msg is not None:
+                return csr.segment_max(msg)
 
         '''Quantize input features'''
         if first_layer:
@@ -177,12 +198,111 @@ class QuantGraphConv(nn.Module):
         msg = torch.clamp(msg, 0, 2**self.num_bits - 1)
 
         '''Update graph features.'''
-        unique_positions, indices = torch.unique(edges[:,0], dim=0, return_inverse=True)
-        expanded_indices = indices.unsqueeze(1).expand(-1, self.output_dim)
-        pooled_features = torch.zeros((unique_positions.size(0), self.output_dim), dtype=features.dtype, device=features.device)
-        pooled_features = pooled_features.scatter_reduce(0, expanded_indices, msg, reduce="amax", include_self=False) # Find max features for each node
+        pooled_features = csr.segment_max(msg) # Find max features for each node
         
         return pooled_features
 
+    def int_forward(self, 
+                    node: torch.Tensor, 
+                    features: torch.Tensor, 
+                    edges: torch.Tensor,
+                    first_layer: bool = False,
+                    csr: GraphCSR = None):
+        
+        '''Integer forward pass of GraphConv layer with the arithmetic of the HW.'''
+        '''Features are uint8 (floats quantized here for the first layer), accumulators hold the wrapped int32 products
+        plus the bias (see integer_linear) and the output is requantized with the integer multiplier qscale_m.'''
+        if csr is None:
+            csr = GraphCSR(edges, node.size(0))
+        edges = csr.edges
+
+        if first_layer:
+            features = self.observer_in.quantize_tensor(features)
+        features = features.to(torch.float32) - self.observer_in.zero_point
+        pos = self.observer_in.quantize_tensor(node[edges[:, 1]] - node[edges[:, 0]]) - self.observer_in.zero_point
+
+        if self.node_level:
+            '''Integer sums are exact, so the features term is always computed once for every node.'''
+            '''The bias is added to the sum of both terms, after the wrap around of the 32-bit accumulator.'''
+            weight_x, weight_pos = self.linear.weight[:, :self.input_dim], self.linear.weight[:, self.input_dim:]
+            bias = self.linear.bias
+            acc_x = integer_linear(features, weight_x)
+            acc_pos = integer_linear(pos, weight_pos)
+            if acc_x.is_floating_point() and acc_pos.is_floating_point() and \
+                    float(accumulator_bound(features, weight_x, bias) + accumulator_bound(pos, weight_pos)) < 2 ** 24:
+                acc = acc_x[edges[:, 1]] + acc_pos
+                if bias is not None:
+                    acc = acc + bias.to(torch.float32)
+            else:
+                acc = wrap_int32(acc_x.to(torch.int64)[edges[:, 1]] + acc_pos.to(torch.int64))
+                if bias is not None:
+                    acc = acc + bias.to(torch.int64)
+        else:
+            msg = torch.cat((features[edges[:, 1]], pos), dim=1)
+            acc = integer_linear(msg, self.linear.weight, self.linear.bias)
+
+        '''Requantization is monotonic while no output wraps around, then only the max accumulator of every node
+        is requantized, otherwise every message is requantized before the max like in the HW.'''
+        if acc.numel() > 0:
+            limits = self._requantize(torch.stack(acc.aminmax()), wrap=False)
+            if limits.min() >= 0 and limits.max() < 2 ** self.num_bits:
+                return self._requantize(csr.segment_max(acc))
+
+        '''Update graph features.'''
+        pooled_features = csr.segment_max(self._requantize(acc))
+
+        return pooled_features
+
+    def _requantize(self, 
+                    acc: torch.Tensor, 
+                    wrap: bool = True):
+        
+        '''Requantize accumulators with the integer multiplier and the shift of the frozen scales.'''
+        return requantize_tensor(acc, self.qscale_m, self.observer_out.zero_point, self.num_bits, int(self.num_bits_scale), wrap)
+
+    def _node_level_forward(self, 
+                            node: torch.Tensor, 
+                            features: torch.Tensor, 
+                            csr: GraphCSR):
+        
+        '''Forward pass with the linear layer split into per node terms.'''
+        '''W [x_j, p_j - p_i] + b = (W_x x_j + W_p p_j + b) - W_p p_i, both terms are computed once for
+        every node and, as rounding of the subtraction is monotonic, W_p p_i is subtracted after the max.'''
+        weight_x, weight_pos = self.linear.weight[:, :self.input_dim], self.linear.weight[:, self.input_dim:]
+        pos = F.linear(node.to(features.dtype), weight_pos)
+        msg = F.linear(features, weight_x, self.linear.bias) + pos
+
+        pooled_features = csr.segment_max(msg[csr.edges[:, 1]])
+        return pooled_features - pos[csr.nodes]
+
+    def _node_level_q_message(self, 
+                              node: torch.Tensor, 
+                              features: torch.Tensor, 
+                              edges: torch.Tensor,
+                              first_layer: bool = False):
+        
+        '''Quantized messages with the features term computed per node.'''
+        '''Only the quantized position difference is computed per edge. The result is identical to the
+        per edge computation while all accumulators are integers below 2**24 (exact in float32), otherwise
+        None is returned and the per edge computation is used.'''
+        weight_x, weight_pos = self.linear.weight[:, :self.input_dim], self.linear.weight[:, self.input_dim:]
+        if first_layer:
+            features = self.observer_in.quantize_tensor(features)
+        features = features - self.observer_in.zero_point
+        pos = self.observer_in.quantize_tensor(node[edges[:, 1]] - node[edges[:, 0]]) - self.observer_in.zero_point
+
+        '''Bit-exact check - bound of the accumulator for every output channel.'''
+        bound = weight_x.abs().sum(dim=1) * features.abs().max() if features.numel() > 0 else 0
+        bound = bound + (weight_pos.abs().sum(dim=1) * pos.abs().max() if pos.numel() > 0 else 0)
+        if self.linear.bias is not None:
+            bound = bound + self.linear.bias.abs()
+        if not bool((torch.as_tensor(bound) < 2 ** 24).all()):
+            return None
+
+        msg = F.linear(features, weight_x, self.linear.bias)[edges[:, 1]] + F.linear(pos, weight_pos)
+        msg = (msg * self.m + self.observer_out.zero_point).floor() 
+        msg = torch.clamp(msg, 0, 2**self.num_bits - 1)
+        return msg
+
     def __repr__(self):
         return f"{self.__class__.__name__}(input_dim={self.input_dim}, output_dim={self.output_dim}, bias={self.bias}, num_bits={self.num_bits})"
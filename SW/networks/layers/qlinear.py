@@ -4,7 +4,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from networks.layers.utils.observer import Observer, FakeQuantize
-from networks.layers.utils.quantize import quantize_tensor, dequantize_tensor
+from networks.layers.utils.quantize import quantize_tensor, dequantize_tensor, integer_linear, requantize_tensor
 
 class QuantLinear(nn.Module):
     '''Quantized version of Linear layer.'''
@@ -40,6 +40,9 @@ class QuantLinear(nn.Module):
         self.register_buffer('num_bits_model', torch.tensor([num_bits], requires_grad=False))
         self.register_buffer('num_bits_scale', torch.tensor([-1], requires_grad=False))
 
+        '''Weights reordered per output cell for sparse_q_forward, cached until the weights change.'''
+        self._sparse_cache = None
+
     def forward(self, 
                 features: torch.Tensor):
 
@@ -129,5 +132,101 @@ class QuantLinear(nn.Module):
         features = torch.clamp(features, 0, 2**self.num_bits - 1)
         return features
 
+    def int_forward(self, 
+                    features: torch.Tensor):
+        
+        '''Integer forward pass of Linear layer with the arithmetic of the HW (uint8 features, wrapped int32 accumulators plus the bias).'''
+        features = features.to(torch.float32) - self.observer_in.zero_point
+        features = integer_linear(features, self.linear.weight, self.linear.bias)
+        features = requantize_tensor(features, self.qscale_m, self.observer_out.zero_point, self.num_bits, int(self.num_bits_scale))
+        return features
+
+    def sparse_forward(self,
+                       cells: torch.Tensor,
+                       graphs: torch.Tensor,
+                       features: torch.Tensor,
+                       num_graphs: int = 1,
+                       fill_value=0):
+
+        '''Standard forward pass for an input with fill_value everywhere except for occupied cells.'''
+        '''features[k] are the input[cells[k] * C:(cells[k] + 1) * C] of graph graphs[k] (from QuantGraphPoolOut.occupied_cells),
+        so the weights are applied only to occupied cells and the empty cells add a constant.'''
+        features = self._sparse_linear(cells, graphs, features - fill_value, num_graphs)
+        features = features + fill_value * self.linear.weight.sum(dim=1)
+        if self.bias:
+            features = features + self.linear.bias
+        return features
+
+    def sparse_q_forward(self,
+                         cells: torch.Tensor,
+                         graphs: torch.Tensor,
+                         features: torch.Tensor,
+                         num_graphs: int = 1,
+                         fill_value=0):
+
+        '''Quantized forward pass for an input with fill_value (quantized) everywhere except for occupied cells.'''
+        '''W (x - zero_point) = W_occupied (x_occupied - fill_value) + (fill_value - zero_point) sum(W), the result is
+        identical to q_forward while all accumulators are integers below 2**24 (exact in float32), otherwise the
+        dense input is built and q_forward is used. The dense input is also used when most cells are occupied.'''
+        cell_weight, cell_abs_sum, weight_sum, weight_abs_sum = self._sparse_weight(features.size(1))
+        if cells.size(0) * 2 > num_graphs * cell_weight.size(0):
+            return self._dense_q_forward(cells, graphs, features, num_graphs, fill_value)
+
+        features = features - fill_value
+        constant = fill_value - self.observer_in.zero_point
+        output = torch.zeros((num_graphs, self.output_dim), dtype=features.dtype, device=features.device)
+
+        '''Bit-exact check - bound of the accumulator for every graph and output.'''
+        max_input = features.abs().max() if features.numel() > 0 else 0
+        bound = output.index_add(0, graphs, cell_abs_sum[cells]) * max_input + constant.abs() * weight_abs_sum
+        if self.bias:
+            bound = bound + self.linear.bias.abs()
+        if not bool((bound < 2 ** 24).all()):
+            return self._dense_q_forward(cells, graphs, features + fill_value, num_graphs, fill_value)
+
+        products = torch.bmm(features.unsqueeze(1), cell_weight[cells]).squeeze(1)
+        features = output.index_add(0, graphs, products) + constant * weight_sum
+        if self.bias:
+            features = features + self.linear.bias
+        features = (features * self.m + self.observer_out.zero_point).round()
+        features = torch.clamp(features, 0, 2**self.num_bits - 1)
+        return features
+
+    def _dense_q_forward(self,
+                         cells: torch.Tensor,
+                         graphs: torch.Tensor,
+                         features: torch.Tensor,
+                         num_graphs: int,
+                         fill_value=0):
+
+        '''q_forward on the dense input built from the occupied cells.'''
+        num_cells = self.input_dim // features.size(1)
+        dense = torch.zeros((num_graphs * num_cells, features.size(1)), dtype=features.dtype, device=features.device) + fill_value
+        dense[graphs * num_cells + cells] = features
+        return self.q_forward(dense.reshape(num_graphs, -1))
+
+    def _sparse_weight(self, num_channels: int):
+
+        '''Weights as (cells, channels, outputs), sums of their magnitudes for every cell and output and
+        sums of weights and their magnitudes for every output.'''
+        weight = self.linear.weight.detach()
+        key = (weight.data_ptr(), weight._version, weight.device, num_channels)
+        if self._sparse_cache is None or self._sparse_cache[0] != key:
+            cell_weight = weight.t().reshape(-1, num_channels, self.output_dim).contiguous()
+            self._sparse_cache = (key, (cell_weight, cell_weight.abs().sum(dim=1), weight.sum(dim=1), weight.abs().sum(dim=1)))
+        return self._sparse_cache[1]
+
+    def _sparse_linear(self,
+                       cells: torch.Tensor,
+                       graphs: torch.Tensor,
+                       features: torch.Tensor,
+                       num_graphs: int):
+
+        '''Product of the weight columns of occupied cells with their features, summed for every graph.'''
+        weight = self.linear.weight.reshape(self.output_dim, -1, features.size(1))[:, cells, :]
+        products = torch.einsum('okc,kc->ko', weight, features)
+        output = torch.zeros((num_graphs, self.output_dim), dtype=products.dtype, device=products.device)
+        return output.index_add(0, graphs, products)
+
     def __repr__(self):
         return f"{self.__class__.__name__}(input_dim={self.input_dim}, output_dim={self.output_dim}, bias={self.bias}, num_bits={self.num_bits})"
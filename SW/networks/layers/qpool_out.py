@@ -2,6 +2,8 @@ import torch
 from torch.nn import Module
 
 from networks.layers.utils.observer import Observer, FakeQuantize
+from networks.layers.utils.unique import unique_rows
+from networks.layers.utils.csr import scatter_max
 
 class QuantGraphPoolOut(Module):
     def __init__(self, 
@@ -18,48 +20,26 @@ class QuantGraphPoolOut(Module):
         self.observer_in = Observer(num_bits=num_bits)
         self.num_bits = num_bits
 
+        '''Deduplicate cells with single int64 keys instead of the row sort of torch.unique(dim=0).'''
+        self.linear_keys = True
+
     def forward(self, 
                 vertices: torch.Tensor, 
-                features: torch.Tensor):
-        
-        normalized_vertices = torch.div(vertices, self.pool_size, rounding_mode='floor').to(torch.int64)
-        unique_positions, indices = torch.unique(normalized_vertices, dim=0, return_inverse=True)
-
-        pooled_features = torch.zeros((unique_positions.size(0), features.size(1)), dtype=features.dtype, device=features.device)
-
-
-        output_features = torch.zeros((self.grid_size ** 3, features.size(1)), dtype=features.dtype, device=features.device)
-        pooled_features = pooled_features.scatter_reduce(0, indices.unsqueeze(1).expand(-1, features.size(1)), features, reduce="amax", include_self=False) #TODO Change to True
-        indices_1d = unique_positions[:, 0] * self.grid_size ** 2 + unique_positions[:, 1] * self.grid_size + unique_positions[:, 2]
+                features: torch.Tensor,
+                batch: torch.Tensor = None,
+                num_graphs: int = None,
+                topology: tuple = None):
         
-        output_features[indices_1d] = pooled_features
-        output_features = output_features.flatten()
-        return output_features
+        return self._pool(vertices, features, batch, num_graphs, topology)
     
     def calibration(self, 
                     vertices: torch.Tensor, 
-                    features: torch.Tensor):
+                    features: torch.Tensor,
+                    batch: torch.Tensor = None,
+                    num_graphs: int = None,
+                    topology: tuple = None):
 
-        # Redukcja wymiarowości przestrzeni wierzchołków
-        normalized_vertices = torch.div(vertices, self.pool_size, rounding_mode='floor').to(torch.int64)
-
-
-        unique_positions, indices = torch.unique(normalized_vertices, dim=0, return_inverse=True)
-
-        pooled_features = torch.zeros((unique_positions.size(0), features.size(1)), dtype=features.dtype, device=features.device)
-
-
-        output_features = torch.zeros((self.grid_size ** 3, features.size(1)), dtype=features.dtype, device=features.device)
-
-        # TODO - ("sum", "prod", "mean", "amax", "amin")
-        pooled_features = pooled_features.scatter_reduce(0, indices.unsqueeze(1).expand(-1, features.size(1)), features, reduce="amax", include_self=False) #TODO Change to True
-        
-        indices_1d = unique_positions[:, 0] * self.grid_size ** 2 + unique_positions[:, 1] * self.grid_size + unique_positions[:, 2]
-        
-        output_features[indices_1d] = pooled_features
-        output_features = output_features.flatten()
-
-        return output_features
+        return self._pool(vertices, features, batch, num_graphs, topology)
     
     def freeze(self,
                observer_in: Observer = None,
@@ -71,28 +51,91 @@ class QuantGraphPoolOut(Module):
 
     def q_forward(self, 
                     vertices: torch.Tensor, 
-                    features: torch.Tensor):
+                    features: torch.Tensor,
+                    batch: torch.Tensor = None,
+                    num_graphs: int = None,
+                    topology: tuple = None):
+        
+        # Empty cells are filled with the zero point of the quantized features
+        return self._pool(vertices, features, batch, num_graphs, topology, fill_value=self.observer_in.zero_point)
+
+    def int_forward(self, 
+                    vertices: torch.Tensor, 
+                    features: torch.Tensor,
+                    batch: torch.Tensor = None,
+                    num_graphs: int = None,
+                    topology: tuple = None):
         
-        # Redukcja wymiarowości przestrzeni wierzchołków
+        # Integer fill value, so that uint8 features keep their type
+        return self._pool(vertices, features, batch, num_graphs, topology, fill_value=int(self.observer_in.zero_point))
+
+    def topology(self, 
+                 vertices: torch.Tensor, 
+                 batch: torch.Tensor = None):
+
+        '''Occupied cells, index of the cell for every vertex and graph index of cells (None for a single graph).'''
         normalized_vertices = torch.div(vertices, self.pool_size, rounding_mode='floor').to(torch.int64)
 
+        # For a batch of graphs the graph index is a part of the pool cell
+        if batch is not None:
+            normalized_vertices = torch.cat((batch.unsqueeze(1).to(torch.int64), normalized_vertices), dim=1)
+        if self.linear_keys:
+            unique_positions, indices = unique_rows(normalized_vertices, return_inverse=True)
+        else:
+            unique_positions, indices = torch.unique(normalized_vertices, dim=0, return_inverse=True)
+
+        if batch is not None:
+            return unique_positions[:, 1:], indices, unique_positions[:, 0]
+        return unique_positions, indices, None
+
+    def occupied_cells(self, 
+                       vertices: torch.Tensor, 
+                       features: torch.Tensor,
+                       batch: torch.Tensor = None,
+                       num_graphs: int = None,
+                       topology: tuple = None):
+
+        '''Max pooled features of the occupied cells only (sparse output for QuantLinear).'''
+        '''Returns the index of every occupied cell in the grid, its graph index, its features and the number of graphs.'''
+        # The occupied cells depend only on the graph, so they can be precomputed with topology()
+        if topology is None:
+            topology = self.topology(vertices, batch)
+        unique_positions, indices, graphs = topology
+        unique_positions, indices = unique_positions.to(torch.int64), indices.to(torch.int64)
 
-        unique_positions, indices = torch.unique(normalized_vertices, dim=0, return_inverse=True)
+        # TODO - ("sum", "prod", "mean", "amax", "amin")
+        pooled_features = scatter_max(features, indices, unique_positions.size(0))
 
-        pooled_features = torch.zeros((unique_positions.size(0), features.size(1)), dtype=features.dtype, device=features.device)
+        if batch is not None:
+            graphs = graphs.to(torch.int64)
+            if num_graphs is None:
+                num_graphs = int(batch.max()) + 1 if batch.numel() > 0 else 1
+        else:
+            graphs, num_graphs = torch.zeros(unique_positions.size(0), dtype=torch.int64, device=unique_positions.device), 1
 
+        cells = unique_positions[:, 0] * self.grid_size ** 2 + unique_positions[:, 1] * self.grid_size + unique_positions[:, 2]
+        return cells, graphs, pooled_features, num_graphs
 
-        output_features = torch.zeros((self.grid_size ** 3, features.size(1)), dtype=features.dtype, device=features.device) + self.observer_in.zero_point
+    def _pool(self, 
+              vertices: torch.Tensor, 
+              features: torch.Tensor,
+              batch: torch.Tensor = None,
+              num_graphs: int = None,
+              topology: tuple = None,
+              fill_value=0):
 
-        # TODO - ("sum", "prod", "mean", "amax", "amin")
-        pooled_features = pooled_features.scatter_reduce(0, indices.unsqueeze(1).expand(-1, features.size(1)), features, reduce="amax", include_self=False)
+        '''Max pool features into a dense grid, flattened for a single graph or one row per graph for a batch.'''
+        cells, graphs, pooled_features, num_graphs = self.occupied_cells(vertices, features, batch, num_graphs, topology)
 
-        # Przeliczenie indeksów dla output_features
-        indices_1d = unique_positions[:, 0] * self.grid_size ** 2 + unique_positions[:, 1] * self.grid_size + unique_positions[:, 2]
-        
+        # Each graph has its own grid of grid_size ** 3 cells
+        indices_1d = graphs * self.grid_size ** 3 + cells
+
+        output_features = torch.zeros((num_graphs * self.grid_size ** 3, features.size(1)), dtype=features.dtype, device=features.device) + fill_value
         output_features[indices_1d] = pooled_features
-        output_features = output_features.flatten()
-        return output_features
+
+        if batch is None:
+            return output_features.flatten()
+        return output_features.reshape(num_graphs, -1)
     
     def __repr__(self):
         return f"{self.__class__.__name__}(pool_size={self.pool_size}, max_dimension={self.max_dimension})"
\ No newline at end of file
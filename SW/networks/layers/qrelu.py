@@ -51,6 +51,12 @@ class QuantReLU(nn.Module):
         features[features < self.observer_in.zero_point] = self.observer_in.zero_point
         return features
 
+    def int_forward(self, 
+                    features: torch.Tensor):
+        
+        '''Integer forward pass of ReLU layer (the max with the zero point of the HW).'''
+        return torch.clamp(features, min=int(self.observer_in.zero_point))
+
 
     def __repr__(self):
         return f"{self.__class__.__name__}, num_bits={self.num_bits})"
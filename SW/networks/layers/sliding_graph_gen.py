@@ -0,0 +1,126 @@
+import numpy as np
+import torch
+from torch.nn import Module
+
+
+class SlidingGraphGen(Module):
+    '''Streaming version of GraphGen that keeps only the events from the last time_window.
+
+    Nodes live in a ring buffer of max_nodes slots and are identified by a sequence number.
+    Edges always point from a new node to older ones, so each node keeps its own edges in a
+    fixed size row and evicting the oldest nodes only moves the head of the buffer.
+    Edges to evicted nodes are masked out when the graph is read with graph().'''
+    def __init__(self, r, time_window, dimension_XY=256, max_nodes=65536, self_loop=True):
+        super(SlidingGraphGen, self).__init__()
+        # Module parameters
+        self.r = r
+        self.time_window = time_window
+        self.dimension_XY = dimension_XY
+        self.max_nodes = max_nodes
+
+        # Neighbour matrix holds the sequence number of the last node on each pixel (-1 for empty)
+        self.neighbour_matrix = np.full((dimension_XY, dimension_XY), -1, dtype=np.int64)
+
+        # Ring buffers for nodes, features and edges (self loop + full context per node)
+        self.max_edges = (2 * r + 1) ** 2 + 1
+        self.pos = np.zeros((max_nodes, 3), dtype=np.int64)
+        self.features = np.zeros((max_nodes, 1), dtype=np.float32)
+        self.edges = np.full((max_nodes, self.max_edges), -1, dtype=np.int64)
+
+        # Sequence numbers of the oldest alive node and of the next node to add
+        self.head = 0
+        self.tail = 0
+
+        # Self loop
+        self.self_loop = self_loop
+
+    def forward(self, event):
+        # Unpack event
+        x = int(event[0])
+        y = int(event[1])
+        t = int(event[2])
+        feature = event[3]
+
+        # Remove nodes which are out of the time window
+        self._evict(t)
+
+        # Check if the event is a duplicate
+        if self._check_duplicate(x, y, t):
+            # Drop the oldest node if the buffer is full
+            if self.tail - self.head == self.max_nodes:
+                self.head += 1
+
+            slot = self.tail % self.max_nodes
+            self._generate_edges(x, y, t, slot)
+            self.pos[slot] = (x, y, t)
+            self.features[slot] = feature
+            self.neighbour_matrix[x, y] = self.tail
+            self.tail += 1
+
+    def extend(self, events):
+        for event in events:
+            self.forward(event)
+
+    def _evict(self, t):
+        # Events arrive in time order, so the expired nodes are always at the head
+        while self.head < self.tail and self.pos[self.head % self.max_nodes, 2] <= t - self.time_window:
+            self.head += 1
+
+    def _check_duplicate(self, x, y, t):
+        last = self.neighbour_matrix[x, y]
+        return False if last >= self.head and self.pos[last % self.max_nodes, 2] == t else True
+
+    def _generate_edges(self, x, y, t, slot):
+        # Get sequence numbers of alive nodes in the context
+        context = self.neighbour_matrix[max(0, x - self.r):x + self.r + 1, max(0, y - self.r):y + self.r + 1].flatten()
+        context = context[context >= self.head]
+
+        # Check if the potential neighbour is in the context
+        pos_ctx = self.pos[context % self.max_nodes]
+        square_distance = (pos_ctx[:, 0] - x) ** 2 + (pos_ctx[:, 1] - y) ** 2 + (pos_ctx[:, 2] - t) ** 2
+        neighbours = context[square_distance <= self.r ** 2]
+
+        # Add self loop
+        if self.self_loop:
+            neighbours = np.concatenate(([self.tail], neighbours))
+
+        self.edges[slot] = -1
+        self.edges[slot, :neighbours.size] = neighbours
+
+    def graph(self, relative_time=True):
+        '''Return nodes, features and edges of the current window.
+
+        With relative_time the timestamps are shifted so that the window starts at 0.'''
+        slots = np.arange(self.head, self.tail) % self.max_nodes
+        nodes = self.pos[slots]
+        features = self.features[slots]
+
+        # Keep only edges to alive nodes and renumber them from the head of the buffer
+        neighbours = self.edges[slots]
+        source = np.broadcast_to(np.arange(self.head, self.tail)[:, None], neighbours.shape)
+        mask = neighbours >= self.head
+        edges = np.stack((source[mask], neighbours[mask]), axis=1) - self.head
+
+        if relative_time and slots.size > 0:
+            nodes = nodes.copy()
+            nodes[:, 2] -= nodes[-1, 2] - self.time_window + 1
+
+        nodes_tensor = torch.tensor(nodes, dtype=torch.float32, device='cpu')
+        features_tensor = torch.tensor(features, dtype=torch.float32, device='cpu')
+        edges_tensor = torch.tensor(edges, dtype=torch.int32, device='cpu')
+
+        return nodes_tensor, features_tensor, edges_tensor
+
+    def release(self):
+        # Return the current graph and clear the buffer
+        nodes, features, edges = self.graph()
+        self.neighbour_matrix[:] = -1
+        self.head = 0
+        self.tail = 0
+        return nodes, features, edges
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(dimension_size={self.dimension_XY})(radius={self.r})(time_window={self.time_window})"
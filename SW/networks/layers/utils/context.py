@@ -0,0 +1,63 @@
+import torch
+
+
+class TiledContext:
+    '''Sparse replacement for the dense neighbour matrix used by GraphGen.'''
+    '''The sensor is split into square tiles, which are allocated only when the first event
+    is written to them, so memory grows with the active part of the sensor and not its area.'''
+    def __init__(self,
+                 dimension: tuple,
+                 tile_size: int = 16,
+                 fill_value: int = 0):
+
+        self.dimension = dimension
+        self.tile_size = tile_size
+        self.fill_value = fill_value
+
+        '''Number of tiles in y used to build a single key for each tile.'''
+        self.num_tiles_y = (dimension[1] + tile_size - 1) // tile_size
+        self.tiles = {}
+
+    def __getitem__(self, key):
+
+        '''Read the context for a single pixel or for tensors of x and y coordinates.'''
+        x, y = (torch.as_tensor(k, dtype=torch.int64) for k in key)
+        tile_keys = (x // self.tile_size) * self.num_tiles_y + (y // self.tile_size)
+
+        if x.dim() == 0:
+            tile = self.tiles.get(tile_keys.item())
+            if tile is None:
+                return torch.tensor(self.fill_value, dtype=torch.int32)
+            return tile[x % self.tile_size, y % self.tile_size].clone()
+
+        values = torch.full(x.shape, self.fill_value, dtype=torch.int32)
+        for tile_key in torch.unique(tile_keys).tolist():
+            tile = self.tiles.get(tile_key)
+            if tile is None:
+                continue
+            mask = tile_keys == tile_key
+            values[mask] = tile[x[mask] % self.tile_size, y[mask] % self.tile_size]
+        return values
+
+    def __setitem__(self, key, value):
+
+        '''Write a single pixel, allocating its tile if needed.'''
+        x, y = int(key[0]), int(key[1])
+        if not (0 <= x < self.dimension[0] and 0 <= y < self.dimension[1]):
+            raise IndexError(f'Pixel ({x}, {y}) is out of bounds for dimension {self.dimension}')
+
+        tile_key = (x // self.tile_size) * self.num_tiles_y + (y // self.tile_size)
+        tile = self.tiles.get(tile_key)
+        if tile is None:
+            tile = torch.full((self.tile_size, self.tile_size), self.fill_value, dtype=torch.int32)
+            self.tiles[tile_key] = tile
+        tile[x % self.tile_size, y % self.tile_size] = value
+
+    def clear(self):
+        self.tiles = {}
+
+    def nbytes(self):
+        return sum(tile.numel() * tile.element_size() for tile in self.tiles.values())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(dimension={self.dimension}, tile_size={self.tile_size}, tiles={len(self.tiles)})"
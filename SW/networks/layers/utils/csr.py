@@ -0,0 +1,58 @@
+import torch
+
+
+def scatter_max(values: torch.Tensor,
+                index: torch.Tensor,
+                size: int):
+
+    '''Max of values (one row for every element of index) for every output row, each row must have a value.'''
+    index = index.unsqueeze(1).expand(-1, values.size(1))
+    if values.is_floating_point() or values.numel() == 0:
+        output = torch.zeros((size, values.size(1)), dtype=values.dtype, device=values.device)
+        return output.scatter_reduce(0, index, values, reduce="amax", include_self=False)
+
+    # Integer scatter_reduce is several times slower without initial values, the minimum never changes the max
+    output = values.amin(dim=0).expand(size, -1).contiguous()
+    return output.scatter_reduce(0, index, values, reduce="amax", include_self=True)
+
+
+class GraphCSR:
+    '''Edges sorted by the destination node (edges[:, 0]) with CSR row pointers.'''
+    '''The structure depends only on the edges, so it is built once after each pooling stage and
+    shared by all convolutions working on the same graph instead of sorting the edges in every layer.'''
+    def __init__(self,
+                 edges: torch.Tensor,
+                 num_nodes: int = None):
+
+        edges = edges.to(torch.int64).reshape(-1, 2)
+        if num_nodes is None:
+            num_nodes = int(edges.max()) + 1 if edges.numel() > 0 else 0
+        self.num_nodes = num_nodes
+
+        '''Sort edges by destination, the stable sort keeps the order of edges of each node.'''
+        order = torch.argsort(edges[:, 0], stable=True)
+        self.edges = edges[order]
+
+        '''Row pointers - edges of node i are self.edges[rowptr[i]:rowptr[i + 1]].'''
+        counts = torch.bincount(self.edges[:, 0], minlength=num_nodes)
+        self.rowptr = torch.cat((counts.new_zeros(1), torch.cumsum(counts, dim=0)))
+
+        '''Nodes with at least one edge (same as torch.unique(edges[:, 0])) and their output row for every edge.'''
+        self.nodes = torch.nonzero(counts).flatten()
+        self.rows = torch.repeat_interleave(torch.arange(self.nodes.size(0), device=edges.device), counts[self.nodes])
+
+    def segment_max(self, msg: torch.Tensor):
+
+        '''Max of messages (one row per edge in self.edges) over the edges of every node in self.nodes.'''
+        '''Rows are sorted, so the reduction sweeps contiguous ranges of msg.'''
+        return scatter_max(msg, self.rows, self.nodes.size(0))
+
+    def to(self, device):
+        self.edges = self.edges.to(device)
+        self.rowptr = self.rowptr.to(device)
+        self.nodes = self.nodes.to(device)
+        self.rows = self.rows.to(device)
+        return self
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(num_nodes={self.num_nodes}, num_edges={self.edges.size(0)})"
@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 
 def quantize_tensor(tensor: torch.Tensor,
                     scale: torch.Tensor,
@@ -16,7 +17,7 @@ def quantize_tensor(tensor: torch.Tensor,
 
         q_x = zero_point + (tensor / scale)
         q_x = q_x.round()
-        q_x.clamp(qmin, qmax)
+        q_x = q_x.clamp(qmin, qmax)
         
         return q_x
     
@@ -25,4 +26,56 @@ def dequantize_tensor(tensor_quant: torch.Tensor,
                       zero_point: torch.Tensor):
     
     '''Dequantize tensor'''
-    return scale * (tensor_quant - zero_point)
\ No newline at end of file
+    return scale * (tensor_quant - zero_point)
+
+def integer_linear(tensor: torch.Tensor,
+                   weight: torch.Tensor,
+                   bias: torch.Tensor = None):
+
+        '''Linear layer on integer valued tensors with the accumulators of the HW.'''
+        '''The product tensor @ weight.T is summed in a signed 32-bit accumulator, which wraps around, and the bias is
+        added to it in 64 bits before the requantization (matrix_multiplication.sv). There are no fast integer matrix
+        kernels, so the result is computed in float32 when every accumulator is below 2**24, which holds the integers
+        exactly and is returned as is. Otherwise the product is computed in float64 and returned as int64.'''
+        if float(accumulator_bound(tensor, weight, bias)) < 2 ** 24:
+                return F.linear(tensor.to(torch.float32), weight.to(torch.float32), None if bias is None else bias.to(torch.float32))
+        acc = wrap_int32(F.linear(tensor.to(torch.float64), weight.to(torch.float64)).to(torch.int64))
+        if bias is not None:
+                acc = acc + bias.to(torch.int64)
+        return acc
+
+def wrap_int32(acc: torch.Tensor):
+
+        '''Integer accumulators wrapped around like a signed 32-bit register, as int64.'''
+        return acc.to(torch.int32).to(torch.int64)
+
+def accumulator_bound(tensor: torch.Tensor,
+                      weight: torch.Tensor,
+                      bias: torch.Tensor = None):
+
+        '''Bound of the magnitude of every accumulator of tensor @ weight.T + bias.'''
+        bound = weight.abs().sum(dim=1).max() * tensor.abs().max() if tensor.numel() > 0 and weight.numel() > 0 else 0
+        if bias is not None:
+                bound = bound + bias.abs().max()
+        return bound
+
+def requantize_tensor(acc: torch.Tensor,
+                      multiplier: torch.Tensor,
+                      zero_point: torch.Tensor,
+                      num_bits: int = 8,
+                      shift: int = 32,
+                      wrap: bool = True):
+
+        '''Requantize integer accumulators with the arithmetic of matrix_multiplication.sv and vector_multiplication.sv.'''
+        '''((acc * multiplier + 2**(shift - 1)) >> shift) + zero_point, rounded half up and truncated to num_bits bits
+        like the output register of the HW (there is no saturation). With wrap=False the int64 values are not truncated.'''
+        # The zero point is added before the shift, ((p + r) >> s) + z == (p + r + (z << s)) >> s
+        q_x = acc.to(torch.int64, copy=True)
+        q_x.mul_(int(multiplier)).add_((1 << (shift - 1)) + (int(zero_point) << shift)).bitwise_right_shift_(shift)
+        if not wrap:
+                return q_x
+
+        # The conversion to uint8 keeps the lowest 8 bits
+        if num_bits != 8:
+                q_x = q_x & (2 ** num_bits - 1)
+        return q_x.to(torch.uint8) if num_bits <= 8 else q_x
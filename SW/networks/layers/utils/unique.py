@@ -0,0 +1,52 @@
+import math
+import torch
+
+'''Fast replacement of torch.unique(rows, dim=0) for non-negative integer rows.'''
+'''Every row is encoded into a single int64 key with a mixed radix of the column ranges, which keeps
+the lexicographic order of rows. Small key ranges (e.g. grid_size ** 3 pool cells) are deduplicated
+with a direct bucket index, larger ones with the 1D sort of torch.unique.'''
+
+# Largest key range deduplicated with the bucket index (memory of the lookup table)
+BUCKET_LIMIT = 1 << 22
+
+
+def unique_rows(rows: torch.Tensor,
+                return_inverse: bool = False):
+
+    '''Same output as torch.unique(rows, dim=0, return_inverse=return_inverse).'''
+    if rows.size(0) == 0 or rows.dim() != 2 or rows.is_floating_point() or rows.min() < 0:
+        return torch.unique(rows, dim=0, return_inverse=return_inverse)
+
+    '''Radix of every column and the number of possible keys.'''
+    bases = (rows.max(dim=0).values + 1).tolist()
+    num_keys = math.prod(bases)
+    if num_keys >= 2 ** 63:
+        return torch.unique(rows, dim=0, return_inverse=return_inverse)
+
+    dtype = rows.dtype
+    rows = rows.to(torch.int64)
+    keys = rows[:, 0]
+    for column, base in enumerate(bases[1:], start=1):
+        keys = keys * base + rows[:, column]
+
+    if num_keys <= BUCKET_LIMIT:
+        '''Occupied buckets in key order, the inverse is the number of occupied buckets before the key.'''
+        occupied = torch.zeros(num_keys, dtype=torch.bool, device=rows.device)
+        occupied[keys] = True
+        unique_keys = torch.nonzero(occupied).flatten()
+        if return_inverse:
+            inverse = (torch.cumsum(occupied, dim=0) - 1)[keys]
+    else:
+        unique_keys, inverse = torch.unique(keys, sorted=True, return_inverse=True)
+
+    '''Decode keys back to rows.'''
+    columns = []
+    for base in reversed(bases[1:]):
+        columns.append(unique_keys % base)
+        unique_keys = torch.div(unique_keys, base, rounding_mode='floor')
+    columns.append(unique_keys)
+    unique = torch.stack(columns[::-1], dim=1).to(dtype)
+
+    if return_inverse:
+        return unique, inverse
+    return unique
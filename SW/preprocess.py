@@ -6,14 +6,18 @@ import argparse
 import multiprocessing as mp
 
 
+def parse_target(target):
+    radius, time_window, dim = (int(value) for value in target.split(':'))
+    return radius, time_window, dim
+
 def main(args):
 
     if args.dataset == 'mnistdvs':
-        dm = MnistDVS(data_dir='dataset', batch_size=1, radius=args.radius)
+        dm = MnistDVS(data_dir='dataset', batch_size=1, radius=args.radius, hw_context=args.hw_context, targets=args.targets, pyramid=args.pyramid)
     elif args.dataset == 'ncars':
-        dm = NCars(data_dir='dataset', batch_size=1, radius=args.radius)
+        dm = NCars(data_dir='dataset', batch_size=1, radius=args.radius, hw_context=args.hw_context, targets=args.targets, pyramid=args.pyramid)
     elif args.dataset == 'cifar10':
-        dm = Cifar10(data_dir='dataset', batch_size=1, radius=args.radius)
+        dm = Cifar10(data_dir='dataset', batch_size=1, radius=args.radius, hw_context=args.hw_context, targets=args.targets, pyramid=args.pyramid)
     else:
         raise ValueError(f'Dataset {args.dataset} not supported')
     dm.prepare_data()
@@ -22,6 +26,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--dataset', type=str, default='ncars')
     parser.add_argument('--radius', type=int, default=3)
+    parser.add_argument('--hw_context', action='store_true', help='Generate graphs with the bounded context of the HW edges_gen module')
+    parser.add_argument('--pyramid', action='store_true', help='Store the pooled graphs of EFGCN with every sample')
+    parser.add_argument('--targets', type=parse_target, nargs='+', default=None,
+                        help='Graph sets generated in one pass as radius:time_window_ms:dim (e.g. 3:100:128 3:50:256)')
 
     args = parser.parse_args()
     mp.set_start_method('spawn', force=True)
@@ -0,0 +1,57 @@
+import torch
+
+from networks.efgcn import EFGCN
+from runtime.numpy_efgcn import save_frozen
+
+'''Export of frozen quantized EFGCN models for the NumPy runtime (runtime/numpy_efgcn.py).'''
+
+
+def _scalar(tensor):
+    # float32 values are stored as exact Python floats
+    return float(torch.as_tensor(tensor).reshape(-1)[0])
+
+def _linear_arrays(name, linear):
+    # Weights hold integers after freeze, the float32 bias is stored as is
+    weight = linear.weight.detach().cpu()
+    bias = linear.bias.detach().cpu() if linear.bias is not None else torch.zeros(weight.size(0))
+    return {name + '.weight': weight.round().to(torch.int16).numpy(),
+            name + '.bias': bias.to(torch.float32).numpy()}
+
+def export_model(model: EFGCN,
+                 path: str,
+                 input_dimension=(256, 256, 256)):
+
+    '''Write a frozen EFGCN (after calibration, freeze and loading of the quantized weights) to a single file.'''
+    if _scalar(model.linear.qscale_m) < 0:
+        raise ValueError('Model is not frozen, run calibration and freeze() before the export')
+
+    layers, arrays = [], {}
+    stages = [('conv1', 'relu1'), 'max_pool1', ('conv2', 'relu2'), ('conv3', 'relu3'), 'max_pool2', ('conv4', 'relu4'), ('conv5', 'relu5')]
+    for stage in stages:
+        if isinstance(stage, str):
+            pool = getattr(model, stage)
+            if pool.only_vertices or pool.average_positions:
+                raise ValueError(f'{stage} - only pooling of vertices and edges to cell positions is supported')
+            layers.append({'name': stage, 'type': 'pool', 'pool_size': pool.pool_size, 'self_loop': pool.self_loop})
+            continue
+
+        conv_name, relu_name = stage
+        conv, relu = getattr(model, conv_name), getattr(model, relu_name)
+        layers.append({'name': conv_name, 'type': 'conv', 'first_layer': conv_name == 'conv1',
+                       'scale_in': _scalar(conv.observer_in.scale), 'zero_point_in': _scalar(conv.observer_in.zero_point),
+                       'm': _scalar(conv.m), 'zero_point_out': _scalar(conv.observer_out.zero_point)})
+        arrays.update(_linear_arrays(conv_name, conv.linear))
+        layers.append({'name': relu_name, 'type': 'relu', 'zero_point': _scalar(relu.observer_in.zero_point)})
+
+    layers.append({'name': 'out', 'type': 'pool_out', 'pool_size': model.out.pool_size, 'grid_size': model.out.grid_size,
+                   'zero_point': _scalar(model.out.observer_in.zero_point)})
+    layers.append({'name': 'linear', 'type': 'linear',
+                   'zero_point_in': _scalar(model.linear.observer_in.zero_point), 'm': _scalar(model.linear.m),
+                   'zero_point_out': _scalar(model.linear.observer_out.zero_point), 'scale_out': _scalar(model.linear.observer_out.scale)})
+    arrays.update(_linear_arrays('linear', model.linear.linear))
+
+    meta = {'input_dimension': list(input_dimension),
+            'num_bits': int(model.conv1.num_bits),
+            'num_outputs': int(model.linear.output_dim),
+            'layers': layers}
+    save_frozen(path, meta, arrays)
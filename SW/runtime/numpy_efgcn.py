@@ -0,0 +1,167 @@
+import json
+import numpy as np
+
+'''Standalone runtime of frozen quantized EFGCN models, it depends only on NumPy.'''
+'''A frozen model is a single .npz file (written by runtime/export.py) with the integer weights and float32
+biases of every layer and a JSON description "meta" of the layers in execution order with their zero points,
+scales, multipliers and pooling sizes. NumpyEFGCN.q_forward repeats the float32 arithmetic of EFGCN.q_forward,
+so the outputs are identical.'''
+
+FORMAT = 'efgcn-frozen'
+VERSION = 1
+
+
+def save_frozen(path, meta, arrays):
+    '''Write the description and arrays of a frozen model to a single file.'''
+    meta = dict(meta, format=FORMAT, version=VERSION)
+    arrays = dict(arrays, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8))
+    with open(path, 'wb') as fp:
+        np.savez(fp, **arrays)
+
+
+def load_frozen(path):
+    '''Read the description and arrays of a frozen model.'''
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    meta = json.loads(arrays.pop('meta').tobytes().decode())
+    if meta.get('format') != FORMAT or meta.get('version') != VERSION:
+        raise ValueError(f'{path} is not a frozen EFGCN model (version {VERSION})')
+    return meta, arrays
+
+
+def unique_rows(rows):
+    '''Sorted unique rows of non-negative integers and the index of the unique row for every row.'''
+    # Rows are encoded into single int64 keys with a mixed radix, which keeps the lexicographic order
+    bases = rows.max(axis=0) + 1 if rows.shape[0] > 0 else np.ones(rows.shape[1], dtype=np.int64)
+    keys = rows[:, 0].astype(np.int64)
+    for column in range(1, rows.shape[1]):
+        keys = keys * bases[column] + rows[:, column]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+    columns = []
+    for column in range(rows.shape[1] - 1, 0, -1):
+        columns.append(unique_keys % bases[column])
+        unique_keys = unique_keys // bases[column]
+    columns.append(unique_keys)
+    return np.stack(columns[::-1], axis=1), inverse.reshape(-1)
+
+
+def segment_max(values, index):
+    '''Max of values (one row for every element of index) for every index value, in sorted order.'''
+    order = np.argsort(index, kind='stable')
+    index = index[order]
+    starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1])))
+    return np.maximum.reduceat(values[order], starts, axis=0), index[starts]
+
+
+def quantize(tensor, scale, zero_point, num_bits=8):
+    '''Quantize tensor as quantize_tensor in float32.'''
+    q_x = np.round(zero_point + tensor.astype(np.float32) / scale)
+    return np.clip(q_x, 0, 2 ** num_bits - 1)
+
+
+def linear(tensor, weight, bias, exact=True):
+    '''Linear layer on integer valued float32 tensors.'''
+    # float32 holds the accumulators exactly below 2**24 (exact=True), larger sums are computed in float64
+    if exact:
+        return tensor @ weight.T + bias
+    return (tensor.astype(np.float64) @ weight.T.astype(np.float64) + bias).astype(np.float32)
+
+
+class NumpyEFGCN:
+    '''Frozen quantized EFGCN on NumPy arrays.'''
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.layers = meta['layers']
+        self.num_bits = meta['num_bits']
+
+        '''Weights of every layer, integer weights are converted to float32 once.'''
+        self.weights = {name: array.astype(np.float32) for name, array in arrays.items()}
+
+        '''Layers with all accumulators below 2**24 for inputs in [0, 2**num_bits - 1] (exact in float32).'''
+        self.exact = {}
+        for layer in self.layers:
+            if layer['type'] in ('conv', 'linear'):
+                weight, bias = self.weights[layer['name'] + '.weight'], self.weights[layer['name'] + '.bias']
+                zero_point = layer['zero_point_in']
+                bound = np.abs(weight).sum(axis=1).max() * max(zero_point, 2 ** self.num_bits - 1 - zero_point) + np.abs(bias).max()
+                self.exact[layer['name']] = bool(bound < 2 ** 24)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(*load_frozen(path))
+
+    def q_forward(self, nodes, features, edges, batch=None, num_graphs=None):
+        '''Forward method of the quantized model, same arguments and output as EFGCN.q_forward.'''
+        single_graph = batch is None
+        if batch is None:
+            batch = np.zeros(nodes.shape[0], dtype=np.int64)
+        if num_graphs is None:
+            num_graphs = int(batch.max()) + 1 if batch.size > 0 else 1
+
+        nodes, features, edges = np.asarray(nodes), np.asarray(features, dtype=np.float32), np.asarray(edges, dtype=np.int64)
+        for layer in self.layers:
+            if layer['type'] == 'conv':
+                features = self._conv(layer, nodes, features, edges)
+            elif layer['type'] == 'relu':
+                features = np.maximum(features, np.float32(layer['zero_point']))
+            elif layer['type'] == 'pool':
+                nodes, features, edges, batch = self._pool(layer, nodes, features, edges, batch)
+            elif layer['type'] == 'pool_out':
+                features = self._pool_out(layer, nodes, features, batch, num_graphs)
+            elif layer['type'] == 'linear':
+                features = self._linear(layer, features)
+            else:
+                raise ValueError(f"Unknown layer type {layer['type']}")
+
+        return features[0] if single_graph else features
+
+    def _conv(self, layer, nodes, features, edges):
+        '''QuantGraphConv.q_forward.'''
+        scale, zero_point = np.float32(layer['scale_in']), np.float32(layer['zero_point_in'])
+        pos = nodes[edges[:, 1]] - nodes[edges[:, 0]]
+        if layer['first_layer']:
+            msg = quantize(np.concatenate((features[edges[:, 1]], pos.astype(np.float32)), axis=1), scale, zero_point, self.num_bits)
+        else:
+            msg = np.concatenate((features[edges[:, 1]], quantize(pos, scale, zero_point, self.num_bits)), axis=1)
+
+        msg = msg - zero_point
+        msg = linear(msg, self.weights[layer['name'] + '.weight'], self.weights[layer['name'] + '.bias'], self.exact[layer['name']])
+        msg = np.floor(msg * np.float32(layer['m']) + np.float32(layer['zero_point_out']))
+        msg = np.clip(msg, 0, 2 ** self.num_bits - 1)
+
+        # Max over the edges of every node with edges (sorted like GraphCSR.nodes)
+        return segment_max(msg, edges[:, 0])[0]
+
+    def _pool(self, layer, nodes, features, edges, batch):
+        '''GraphPooling, the graph index is a part of the pool cell.'''
+        cells = np.floor_divide(nodes, layer['pool_size']).astype(np.int64)
+        positions, indices = unique_rows(np.concatenate((batch.reshape(-1, 1).astype(np.int64), cells), axis=1))
+        pooled_features = segment_max(features, indices)[0]
+
+        edges = indices[edges]
+        edges = unique_rows(edges[edges[:, 0] != edges[:, 1]])[0]
+        if layer['self_loop']:
+            loops = np.arange(positions.shape[0], dtype=np.int64)
+            edges = np.concatenate((edges, np.stack((loops, loops), axis=1)), axis=0)
+        return positions[:, 1:], pooled_features, edges, positions[:, 0]
+
+    def _pool_out(self, layer, nodes, features, batch, num_graphs):
+        '''QuantGraphPoolOut.q_forward, a dense grid filled with the zero point for every graph.'''
+        grid_size = layer['grid_size']
+        cells = np.floor_divide(nodes, layer['pool_size']).astype(np.int64)
+        positions, indices = unique_rows(np.concatenate((batch.reshape(-1, 1).astype(np.int64), cells), axis=1))
+        pooled_features = segment_max(features, indices)[0]
+
+        indices_1d = ((positions[:, 0] * grid_size + positions[:, 1]) * grid_size + positions[:, 2]) * grid_size + positions[:, 3]
+        output_features = np.full((num_graphs * grid_size ** 3, features.shape[1]), np.float32(layer['zero_point']), dtype=np.float32)
+        output_features[indices_1d] = pooled_features
+        return output_features.reshape(num_graphs, -1)
+
+    def _linear(self, layer, features):
+        '''QuantLinear.q_forward and dequantization of the output.'''
+        features = features - np.float32(layer['zero_point_in'])
+        features = linear(features, self.weights[layer['name'] + '.weight'], self.weights[layer['name'] + '.bias'], self.exact[layer['name']])
+        features = np.round(features * np.float32(layer['m']) + np.float32(layer['zero_point_out']))
+        features = np.clip(features, 0, 2 ** self.num_bits - 1)
+        return np.float32(layer['scale_out']) * (features - np.float32(layer['zero_point_out']))
@@ -0,0 +1,73 @@
+import time
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from data.ncars import NCars
+from data.mnistdvs import MnistDVS
+from data.cifar10 import Cifar10
+
+from hw_model.pipeline import HWPipeline
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the bit-accurate model of a HW configuration on a dataset')
+    parser.add_argument('--config', type=str, default='../HW/configs/Small_100ms_128', help='HW configuration directory')
+    parser.add_argument('--dataset', type=str, default='ncars', help='Dataset to use')
+    parser.add_argument('--split', type=str, default='test', choices=['train', 'test'], help='Dataset split')
+    parser.add_argument('--num_samples', type=int, default=None, help='Number of simulated samples (default all)')
+    parser.add_argument('--output', type=str, default=None, help='Write the output features and labels to a .npz file')
+    parser.add_argument('--reference', type=str, default=None, help='Compare the output features with a .npz file (e.g. dumped by the RTL testbench)')
+    return parser.parse_args()
+
+def main(args):
+    pipeline = HWPipeline.from_config(args.config)
+    config = pipeline.config
+    print(config)
+
+    # Graphs generated with the bounded context of edges_gen for the graph size and time window of the configuration
+    target = [(config.radius, config.time_window // 1000, config.graph_size)]
+    if args.dataset == 'ncars':
+        dm = NCars(data_dir='dataset', batch_size=1, radius=config.radius, hw_context=True, targets=target)
+    elif args.dataset == 'cifar10':
+        dm = Cifar10(data_dir='dataset', batch_size=1, radius=config.radius, hw_context=True, targets=target)
+    elif args.dataset == 'mnistdvs':
+        dm = MnistDVS(data_dir='dataset', batch_size=1, radius=config.radius, hw_context=True, targets=target)
+    else:
+        raise ValueError('Dataset not supported')
+    dm.setup()
+
+    dataset = dm.train_data if args.split == 'train' else dm.test_data
+    num_samples = len(dataset) if args.num_samples is None else min(args.num_samples, len(dataset))
+
+    features, labels, num_events, elapsed = [], [], 0, 0.0
+    for index in tqdm(range(num_samples)):
+        sample = dataset[index]
+        events = np.column_stack((sample['nodes'].numpy(), sample['features'].numpy())).astype(np.int64)
+        edges = sample['edges'].numpy()
+
+        start = time.perf_counter()
+        features.append(pipeline.forward(events, edges))
+        elapsed += time.perf_counter() - start
+        labels.append(sample['y'])
+        num_events += events.shape[0]
+
+    features = np.stack(features) if features else np.zeros((0,), dtype=pipeline.dtype)
+    print(f'{num_samples} samples, {num_events} events in {elapsed:.2f} s '
+          f'({num_samples / max(elapsed, 1e-9):.1f} samples/s, {num_events / max(elapsed, 1e-9):.0f} events/s)')
+
+    if args.output is not None:
+        np.savez(args.output, features=features, y=np.array(labels))
+        print("Output features written to", args.output)
+
+    if args.reference is not None:
+        with np.load(args.reference) as data:
+            reference = data['features'][:num_samples]
+        if reference.shape != features.shape:
+            raise ValueError(f'Reference features {reference.shape} do not match the simulated features {features.shape}')
+        mismatches = (reference != features).reshape(num_samples, -1).any(axis=1)
+        print(f'{int(mismatches.sum())} of {num_samples} samples differ from the reference',
+              f'(first {np.flatnonzero(mismatches)[:10].tolist()})' if mismatches.any() else '')
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,79 @@
+import numpy as np
+import torch
+
+'''Anytime classification over partial time windows.'''
+'''The graph of the first events of a window is a prefix of the graph of the whole window (edges of
+GraphGen always point to past events), so the graphs at all checkpoints are cut from the processed
+sample without generating them again. A prediction with a confidence (max softmax probability) is
+made at every checkpoint and the classification stops at the first one above the threshold.'''
+
+
+def checkpoint_times(window_ms, step_ms):
+    '''Checkpoints every step_ms of events, the last one is the end of the window.'''
+    checkpoints = list(np.arange(step_ms, window_ms, step_ms))
+    return [float(checkpoint) for checkpoint in checkpoints] + [float(window_ms)]
+
+
+def window_prefix(sample, num_nodes):
+    '''Graph of the first num_nodes events of a sample.'''
+    edges = sample['edges'].reshape(-1, 2)
+    return {'nodes': sample['nodes'][:num_nodes],
+            'features': sample['features'][:num_nodes],
+            'edges': edges[edges[:, 0] < num_nodes],
+            'y': sample['y']}
+
+
+def checkpoint_graphs(sample, checkpoints, window_ms, dim):
+    '''Graphs of a sample at every checkpoint (in ms from the start of the window).'''
+    # Timestamps are normalised to dim time bins of the window, so checkpoints are exact to one bin
+    bounds = np.ceil(np.array(checkpoints) * dim / window_ms)
+    num_nodes = np.searchsorted(sample['nodes'][:, 2].numpy(), bounds, side='left')
+    return [window_prefix(sample, int(size)) for size in num_nodes]
+
+
+def confidence(logits):
+    '''Predicted class and its softmax probability.'''
+    probability = torch.softmax(logits, dim=-1)
+    return probability.max(dim=-1)
+
+
+def early_exit(confidences, threshold):
+    '''Index of the first checkpoint with the confidence above the threshold (the last checkpoint otherwise).'''
+    above = np.flatnonzero(np.asarray(confidences) >= threshold)
+    return int(above[0]) if above.size > 0 else len(confidences) - 1
+
+
+def anytime_report(preds, confidences, y_true, checkpoints, thresholds):
+    '''Accuracy-vs-latency report from the predictions and confidences (samples x checkpoints).'''
+    preds, confidences, y_true = np.asarray(preds), np.asarray(confidences), np.asarray(y_true)
+    correct = preds == y_true[:, None]
+
+    report = {'checkpoints': [], 'early_exit': []}
+    for index, checkpoint in enumerate(checkpoints):
+        report['checkpoints'].append({'latency_ms': checkpoint,
+                                      'accuracy': float(correct[:, index].mean()),
+                                      'mean_confidence': float(confidences[:, index].mean())})
+
+    for threshold in thresholds:
+        exits = np.array([early_exit(sample, threshold) for sample in confidences], dtype=np.int64)
+        latency = np.asarray(checkpoints)[exits]
+        report['early_exit'].append({'threshold': float(threshold),
+                                     'accuracy': float(correct[np.arange(exits.size), exits].mean()),
+                                     'mean_latency_ms': float(latency.mean()),
+                                     'p50_latency_ms': float(np.percentile(latency, 50)),
+                                     'p90_latency_ms': float(np.percentile(latency, 90)),
+                                     'early_exits': float((exits < len(checkpoints) - 1).mean())})
+    return report
+
+
+def print_report(report):
+    print("\nAccuracy at fixed checkpoints:")
+    print(f"{'latency [ms]':>14}{'accuracy':>10}{'confidence':>12}")
+    for row in report['checkpoints']:
+        print(f"{row['latency_ms']:>14.1f}{row['accuracy']:>10.4f}{row['mean_confidence']:>12.4f}")
+
+    print("\nEarly exit:")
+    print(f"{'threshold':>10}{'accuracy':>10}{'mean [ms]':>11}{'p50 [ms]':>10}{'p90 [ms]':>10}{'exited':>8}")
+    for row in report['early_exit']:
+        print(f"{row['threshold']:>10.2f}{row['accuracy']:>10.4f}{row['mean_latency_ms']:>11.1f}"
+              f"{row['p50_latency_ms']:>10.1f}{row['p90_latency_ms']:>10.1f}{row['early_exits']:>8.2%}")
@@ -0,0 +1,191 @@
+import inspect
+import json
+import time
+import numpy as np
+import torch
+
+from networks.layers.qlinear import QuantLinear
+
+'''Per-layer profiling of EFGCN forward passes.'''
+'''LayerProfiler replaces the forward methods of the layers of a model with timed wrappers while it is
+active (with LayerProfiler(model): ...) and restores them on exit, so an unprofiled model runs the
+original methods without any overhead. For every call of a layer it records the wall time, the peak
+memory (CUDA only), the number of input nodes, edges and output nodes (occupied cells for the output pooling,
+None for the linear layer and the model, whose outputs are rows of graphs).'''
+
+# Methods of the layers called by EFGCN.forward, calibration, q_forward and int_forward
+METHODS = ('forward', 'calibration', 'q_forward', 'int_forward', 'occupied_cells', 'sparse_forward', 'sparse_q_forward')
+
+# Methods of the model, each call is a pass and the parent of the layer calls in the trace
+MODEL_METHODS = ('forward', 'calibration', 'q_forward', 'int_forward')
+
+
+def _num_rows(value):
+    # Number of nodes (rows) of a tensor or of the first tensor of a tuple
+    if isinstance(value, (tuple, list)) and len(value) > 0:
+        value = value[0]
+    return int(value.size(0)) if isinstance(value, torch.Tensor) else None
+
+
+class LayerProfiler:
+    def __init__(self, model, layers=None, synchronize=True):
+        self.model = model
+
+        # Profiled layers are the direct children of the model (conv1 ... linear) by default
+        self.layers = dict(model.named_children()) if layers is None else {name: getattr(model, name) for name in layers}
+
+        # CUDA kernels are asynchronous, the device is synchronized around every call for the wall time
+        device = next(model.parameters()).device
+        self.cuda = device.type == 'cuda'
+        self.synchronize = synchronize and self.cuda
+
+        self.records = []
+        self.num_passes = 0
+        self._active = set()
+        self._cells = {}
+        self._peaks = []
+        self._patched = []
+        self._start = None
+        self._mode = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        for name, layer in self.layers.items():
+            for method in METHODS:
+                if hasattr(type(layer), method):
+                    self._patch(layer, name, method)
+        for method in MODEL_METHODS:
+            self._patch(self.model, 'model', method)
+        return self
+
+    def __exit__(self, *exc):
+        # Instance attributes shadow the methods of the class, deleting them restores the original methods
+        for module, method in self._patched:
+            delattr(module, method)
+        self._patched = []
+        return False
+
+    def _patch(self, module, name, method):
+        original = getattr(module, method)
+        parameters = inspect.signature(original).parameters
+        edges_index = list(parameters).index('edges') if 'edges' in parameters else None
+
+        def wrapper(*args, **kwargs):
+            # Nested calls of the same layer (e.g. out.q_forward calling occupied_cells) are a part of the outer call
+            if name in self._active:
+                output = original(*args, **kwargs)
+                if method == 'occupied_cells':
+                    self._cells[name] = int(output[0].size(0))
+                return output
+            self._active.add(name)
+            if name == 'model':
+                self.num_passes += 1
+                self._mode = method
+
+            edges = kwargs.get('edges', args[edges_index] if edges_index is not None and edges_index < len(args) else None)
+            # Layers called outside of a pass of the model (e.g. by AsyncEFGCN) are grouped by their own method
+            record = {'name': name, 'method': method, 'mode': self._mode if self._mode is not None else method,
+                      'pass': self.num_passes - 1,
+                      'input_nodes': _num_rows(args[0]) if args else None,
+                      'edges': _num_rows(edges)}
+
+            if self.synchronize:
+                torch.cuda.synchronize()
+            if self.cuda:
+                # Resetting the peak wipes the peak of the enclosing calls (the model), which keep the peak observed so far on a stack
+                memory = torch.cuda.memory_allocated()
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], torch.cuda.max_memory_allocated())
+                self._peaks.append(memory)
+                torch.cuda.reset_peak_memory_stats()
+            start = time.perf_counter()
+            try:
+                output = original(*args, **kwargs)
+                if self.synchronize:
+                    torch.cuda.synchronize()
+            finally:
+                self._active.discard(name)
+                if name == 'model':
+                    self._mode = None
+                if self.cuda:
+                    peak = max(self._peaks.pop(), torch.cuda.max_memory_allocated())
+                    if self._peaks:
+                        self._peaks[-1] = max(self._peaks[-1], peak)
+            end = time.perf_counter()
+
+            # The output pooling returns a dense grid, its nodes are the occupied cells of the nested occupied_cells call
+            cells = self._cells.pop(name, None)
+            if module is self.model or isinstance(module, QuantLinear):
+                output_nodes = None
+            else:
+                output_nodes = cells if cells is not None else _num_rows(output)
+
+            record.update({'start': start - self._start, 'time': end - start,
+                           'peak_memory': peak - memory if self.cuda else None,
+                           'output_nodes': output_nodes})
+            self.records.append(record)
+            return output
+
+        setattr(module, method, wrapper)
+        self._patched.append((module, method))
+
+    def reset(self):
+        self.records = []
+        self.num_passes = 0
+
+    def summary(self, percentiles=(50, 90, 99)):
+        '''Percentiles of the recorded values for every layer and method in execution order.'''
+        groups = {}
+        for record in self.records:
+            groups.setdefault((record['mode'], record['name'], record['method']), []).append(record)
+
+        # Share of the time of the passes of the model in the same mode
+        totals = {}
+        for record in self.records:
+            if record['name'] == 'model':
+                totals[record['mode']] = totals.get(record['mode'], 0.0) + record['time']
+
+        rows = []
+        for (mode, name, method), records in groups.items():
+            row = {'mode': mode, 'name': name, 'method': method, 'calls': len(records),
+                   'total_time': float(sum(record['time'] for record in records))}
+            total = totals.get(mode, 0.0)
+            row['share'] = row['total_time'] / total if total > 0 and name != 'model' else None
+            for key in ('time', 'peak_memory', 'input_nodes', 'edges', 'output_nodes'):
+                values = np.array([record[key] for record in records if record[key] is not None], dtype=np.float64)
+                row[key] = {f'p{p}': float(np.percentile(values, p)) for p in percentiles} if values.size > 0 else None
+                if values.size > 0:
+                    row[key]['mean'] = float(values.mean())
+            rows.append(row)
+        return rows
+
+    def print_summary(self, percentiles=(50, 90, 99)):
+        rows = self.summary(percentiles)
+        columns = [f'p{p}' for p in percentiles]
+        print(f"\nProfile of {self.num_passes} passes")
+        print(f"{'mode':<13}{'layer':<10}{'method':<18}{'calls':>7}{'share':>8}"
+              + ''.join(f"{'time ' + c + ' [ms]':>15}" for c in columns)
+              + f"{'peak mem p' + str(percentiles[-1]) + ' [MB]':>20}{'nodes in p50':>14}{'edges p50':>12}{'nodes out p50':>15}")
+        for row in rows:
+            def value(key, column, scale=1.0, fmt='.0f'):
+                return format(row[key][column] * scale, fmt) if row[key] is not None else '-'
+            share = f"{row['share']:.1%}" if row['share'] is not None else '-'
+            print(f"{row['mode']:<13}{row['name']:<10}{row['method']:<18}{row['calls']:>7}{share:>8}"
+                  + ''.join(f"{value('time', c, 1000, '.3f'):>15}" for c in columns)
+                  + f"{value('peak_memory', columns[-1], 2 ** -20, '.2f'):>20}"
+                  + f"{value('input_nodes', 'p50'):>14}{value('edges', 'p50'):>12}{value('output_nodes', 'p50'):>15}")
+
+    def to_json(self, path, percentiles=(50, 90, 99)):
+        '''Write the summary and all records to a JSON file.'''
+        with open(path, 'w') as fp:
+            json.dump({'num_passes': self.num_passes, 'summary': self.summary(percentiles), 'records': self.records}, fp, indent=2)
+
+    def to_chrome_trace(self, path):
+        '''Write the records as complete events of the Chrome trace format (chrome://tracing, Perfetto).'''
+        events = []
+        for record in self.records:
+            args = {key: record[key] for key in ('mode', 'pass', 'input_nodes', 'edges', 'output_nodes', 'peak_memory')}
+            events.append({'name': record['name'], 'cat': record['method'], 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': record['start'] * 1e6, 'dur': record['time'] * 1e6, 'args': args})
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
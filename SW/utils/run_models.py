@@ -1,9 +1,24 @@
+import json
+import time
+import numpy as np
 import torch
 import torch.nn as nn
 import lightning as L
 from torchmetrics import Accuracy
 from tqdm import tqdm
 
+from networks.efgcn import PYRAMID_KEYS
+from networks.async_efgcn import AsyncEFGCN
+from data.base.collate import collate_graphs
+from utils.anytime import checkpoint_times, checkpoint_graphs, confidence, anytime_report, print_report
+
+
+def graph_pyramid(batch: dict,
+                  device: str = 'cuda'):
+    
+    '''Precomputed graph pyramid of the batch (None if the samples were processed without it)'''
+    pyramid = {key: batch[key].to(device) for key in PYRAMID_KEYS if key in batch}
+    return pyramid if pyramid else None
 
 
 def float_inference(model: nn.Module, 
@@ -18,13 +33,15 @@ def float_inference(model: nn.Module,
         nodes = batch['nodes'].to(device)
         features = batch['features'].to(device)
         edges = batch['edges'].to(device)
-        pred = model(nodes, features, edges) # Float forward pass
+        graph_batch = batch['batch'].to(device)
+        pyramid = graph_pyramid(batch, device)
+        pred = model(nodes, features, edges, graph_batch, num_graphs=len(batch['y']), pyramid=pyramid) # Float forward pass
         y_pred = torch.argmax(pred, dim=-1)
-        preds.append(y_pred.cpu().unsqueeze(0))
+        preds.append(y_pred.cpu())
         y_true.append(batch['y'])
 
     preds = torch.cat(preds, dim=0).to('cpu')
-    y_true = torch.tensor(y_true).to('cpu')
+    y_true = torch.cat(y_true, dim=0).to('cpu')
 
     print("\nAccuracy for float model on test dataset:", accuracy(preds, y_true).item())
 
@@ -34,18 +51,26 @@ def calibration_inference(model,
                           num_calibration_samples: int = 500,
                           device: str = 'cuda'):
     
+    num_samples = 0
     for idx, batch in enumerate(dm.train_dataloader()):
         nodes = batch['nodes'].to(device)
         features = batch['features'].to(device)
         edges = batch['edges'].to(device)
-        _ = model.calibration(nodes, features, edges)
-        if idx > num_calibration_samples:
+        graph_batch = batch['batch'].to(device)
+        pyramid = graph_pyramid(batch, device)
+        _ = model.calibration(nodes, features, edges, graph_batch, num_graphs=len(batch['y']), pyramid=pyramid)
+        num_samples += len(batch['y'])
+        if num_samples > num_calibration_samples:
             break
     return model
 
 def quantize_inference(model: nn.Module, 
                     dm: L.LightningDataModule,
-                    device: str = 'cuda'):
+                    device: str = 'cuda',
+                    integer: bool = False):
+
+    '''Evaluate the quantized model, with integer=True on integer tensors with the arithmetic of the HW (int_forward)'''
+    q_forward = model.int_forward if integer else model.q_forward
 
     accuracy = Accuracy(task='multiclass', num_classes=dm.num_classes)
     preds = []
@@ -54,12 +79,99 @@ def quantize_inference(model: nn.Module,
         nodes = batch['nodes'].to(device)
         features = batch['features'].to(device)
         edges = batch['edges'].to(device)
-        pred = model.q_forward(nodes, features, edges)
+        graph_batch = batch['batch'].to(device)
+        pyramid = graph_pyramid(batch, device)
+        pred = q_forward(nodes, features, edges, graph_batch, num_graphs=len(batch['y']), pyramid=pyramid)
         y_pred = torch.argmax(pred, dim=-1)
-        preds.append(y_pred.cpu().unsqueeze(0))
+        preds.append(y_pred.cpu())
         y_true.append(batch['y'])
     
     preds = torch.cat(preds, dim=0).to('cpu')
-    y_true = torch.tensor(y_true).to('cpu')
+    y_true = torch.cat(y_true, dim=0).to('cpu')
+
+    print(f"\nAccuracy for {'integer' if integer else 'quantised'} model on test dataset:", accuracy(preds, y_true).item())
+
+
+def event_inference(model: nn.Module,
+                    dm: L.LightningDataModule,
+                    radius: int,
+                    hw_context: bool = False,
+                    device: str = 'cuda',
+                    chunk_size: int = 1):
+
+    '''Evaluate the quantized model event by event (AsyncEFGCN), the events of every test sample are replayed
+    in chunks of chunk_size and the latency of closing the window (the synchronous part of the network) is measured'''
+    async_model = AsyncEFGCN(model, radius=radius, input_dimension=dm.dim, hw_context=hw_context)
+
+    accuracy = Accuracy(task='multiclass', num_classes=dm.num_classes)
+    preds = []
+    y_true = []
+    latency = []
+    mismatches = 0
+    for idx in tqdm(range(len(dm.test_data))):
+        sample = dm.test_data[idx]
+        events = torch.cat((sample['nodes'], sample['features']), dim=1).to(torch.int64).numpy()
+        for start in range(0, events.shape[0], chunk_size):
+            async_model.extend(events[start:start + chunk_size])
+
+        start = time.perf_counter()
+        pred = async_model.close()
+        if pred.is_cuda:
+            torch.cuda.synchronize()
+        latency.append(time.perf_counter() - start)
+
+        # The event-driven mode must give the logits of the quantized model on the whole graph
+        with torch.no_grad():
+            reference = model.q_forward(sample['nodes'].to(device), sample['features'].to(device), sample['edges'].to(device))
+        mismatches += int(not torch.equal(pred, reference))
+
+        preds.append(torch.argmax(pred, dim=-1).cpu())
+        y_true.append(int(sample['y']))
+
+    preds = torch.stack(preds).to('cpu')
+    y_true = torch.tensor(y_true)
+    latency = np.array(latency) * 1000
+
+    print("\nAccuracy for event-driven quantised model on test dataset:", accuracy(preds, y_true).item())
+    print(f"Latency from the last event to the prediction: mean {latency.mean():.2f} ms, "
+          f"p50 {np.percentile(latency, 50):.2f} ms, p99 {np.percentile(latency, 99):.2f} ms")
+    print(f"{mismatches} of {len(latency)} samples differ from the quantised model on the whole graph")
+
+
+def anytime_inference(model: nn.Module,
+                      dm: L.LightningDataModule,
+                      step_ms: float = 10,
+                      thresholds: tuple = (0.6, 0.7, 0.8, 0.9, 0.95),
+                      device: str = 'cuda',
+                      output: str = None):
+
+    '''Evaluate the quantized model on the events received until every checkpoint (every step_ms of the window)
+    and report the accuracy at every checkpoint and of the early exit at the first confident checkpoint'''
+    window_ms = dm.targets[0][1]
+    checkpoints = checkpoint_times(window_ms, step_ms)
+
+    preds = []
+    confidences = []
+    y_true = []
+    for idx in tqdm(range(len(dm.test_data))):
+        sample = dm.test_data[idx]
+
+        # All checkpoints of a sample are evaluated as a single batch of graphs
+        batch = collate_graphs(checkpoint_graphs(sample, checkpoints, window_ms, dm.dim[2]))
+        with torch.no_grad():
+            pred = model.q_forward(batch['nodes'].to(device), batch['features'].to(device), batch['edges'].to(device),
+                                   batch['batch'].to(device), num_graphs=len(checkpoints))
+        probability, y_pred = confidence(pred)
+        preds.append(y_pred.cpu().numpy())
+        confidences.append(probability.cpu().numpy())
+        y_true.append(int(sample['y']))
+
+    report = anytime_report(preds, confidences, y_true, checkpoints, thresholds)
+    report.update({'dataset': dm.data_name, 'window_ms': window_ms, 'step_ms': step_ms, 'num_samples': len(y_true)})
+    print_report(report)
 
-    print("\nAccuracy for quantised model on test dataset:", accuracy(preds, y_true).item())
+    if output is not None:
+        with open(output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print("Anytime report written to", output)
+    return report